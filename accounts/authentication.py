@@ -0,0 +1,93 @@
+"""
+JWT authentication that trusts the claims in the access token.
+
+`CustomTokenObtainPairSerializer` embeds the user's id, email and flags in every
+token, so `ClaimsJWTAuthentication` can build `request.user` without a query.
+Attributes that are not claims (names, password, relations...) load the real
+`User` row on first use, so only views that need the full model pay for it.
+
+Claims are a snapshot taken at login: a change to `is_staff` or a deactivation
+takes effect when the user's tokens expire or are revoked (see
+`accounts.revocation`). Tokens issued without the claims fall back to loading
+the user like simplejwt does.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTTokenUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from accounts import revocation
+
+User = get_user_model()
+
+USER_CLAIMS = ("email", "is_staff", "is_superuser", "is_verified")
+
+
+class ClaimsUser(TokenUser):
+
+    """Stateless user built from token claims; other attributes come from the `User` row."""
+
+    @cached_property
+    def email(self):
+        return self.token["email"]
+
+    @cached_property
+    def is_verified(self):
+        return self.token["is_verified"]
+
+    @cached_property
+    def username(self):
+        return self.email
+
+    @cached_property
+    def instance(self):
+        return User.objects.get(pk=self.id)
+
+    def __getattr__(self, name):
+        # Only called for attributes the token does not provide.
+        if name.startswith("_") or name == "token":
+            raise AttributeError(name)
+        return getattr(self.instance, name)
+
+    def __eq__(self, other):
+        return getattr(other, "pk", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class ClaimsJWTAuthentication(JWTTokenUserAuthentication):
+
+    """Authenticate with a `ClaimsUser`, or the `User` row for tokens without claims."""
+
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        if revocation.is_revoked(validated_token):
+            raise InvalidToken(_("Token has been revoked"), code="token_revoked")
+        return validated_token
+
+    def get_user(self, validated_token):
+        if not all(claim in validated_token for claim in USER_CLAIMS):
+            return JWTAuthentication.get_user(self, validated_token)
+        return super().get_user(validated_token)
+
+
+def record_login(user):
+
+    """
+    Update `last_login` at most once per `ACCOUNTS_LAST_LOGIN_INTERVAL` seconds.
+
+    A login burst from one account then costs one UPDATE instead of one per token.
+    """
+    now = timezone.now()
+    interval = timedelta(seconds=settings.ACCOUNTS_LAST_LOGIN_INTERVAL)
+    if user.last_login is not None and now - user.last_login < interval:
+        return False
+    user.last_login = now
+    User.objects.filter(pk=user.pk).update(last_login=now)
+    return True
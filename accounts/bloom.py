@@ -0,0 +1,42 @@
+"""
+A fixed-size bloom filter over strings.
+
+`contains` never gives a false negative; false positives happen at roughly
+`error_rate` once `capacity` items have been added, and more often beyond that.
+"""
+import hashlib
+import math
+
+
+class BloomFilter:
+
+    """Bit array with `hashes` positions per item, derived from one blake2b digest."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Double hashing: position i is h1 + i * h2.
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def is_full(self):
+        return self.count >= self.capacity
@@ -0,0 +1,105 @@
+"""
+Password hashers whose cost is read from settings.
+
+`PASSWORD_HASHER` in settings picks which one hashes new passwords; the others
+stay in `PASSWORD_HASHERS` so existing hashes still verify. Django rehashes a
+password with the preferred hasher and current cost on the next successful
+login, so changing the profile or its cost upgrades users transparently.
+"""
+import base64
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    Argon2PasswordHasher, BasePasswordHasher, PBKDF2PasswordHasher, mask_hash
+)
+from django.utils.crypto import constant_time_compare
+from django.utils.translation import gettext_noop as _
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+
+    """PBKDF2-SHA256 with `PASSWORD_PBKDF2_ITERATIONS` iterations."""
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+
+    """Argon2 with costs from `PASSWORD_ARGON2_*`; needs the argon2-cffi package."""
+
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2_PARALLELISM
+
+
+class ScryptPasswordHasher(BasePasswordHasher):
+
+    """
+    scrypt from the standard library, with costs from `PASSWORD_SCRYPT_*`.
+
+    Hashes use the same `scrypt$n$salt$r$p$hash` format as the scrypt hasher
+    that ships with Django 4.0, so they keep working after an upgrade.
+    """
+    algorithm = "scrypt"
+
+    @property
+    def work_factor(self):
+        return settings.PASSWORD_SCRYPT_WORK_FACTOR
+
+    @property
+    def block_size(self):
+        return settings.PASSWORD_SCRYPT_BLOCK_SIZE
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_SCRYPT_PARALLELISM
+
+    def encode(self, password, salt, n=None, r=None, p=None):
+        assert password is not None
+        assert salt and "$" not in salt
+        n, r, p = n or self.work_factor, r or self.block_size, p or self.parallelism
+        hash_ = hashlib.scrypt(
+            password.encode(), salt=salt.encode(), n=n, r=r, p=p, maxmem=256 * n * r, dklen=64
+        )
+        hash_ = base64.b64encode(hash_).decode("ascii").strip()
+        return "%s$%d$%s$%d$%d$%s" % (self.algorithm, n, salt, r, p, hash_)
+
+    def _decode(self, encoded):
+        algorithm, n, salt, r, p, hash_ = encoded.split("$", 5)
+        assert algorithm == self.algorithm
+        return {"n": int(n), "salt": salt, "r": int(r), "p": int(p), "hash": hash_}
+
+    def verify(self, password, encoded):
+        decoded = self._decode(encoded)
+        encoded_2 = self.encode(password, decoded["salt"], decoded["n"], decoded["r"], decoded["p"])
+        return constant_time_compare(encoded, encoded_2)
+
+    def safe_summary(self, encoded):
+        decoded = self._decode(encoded)
+        return {
+            _("algorithm"): self.algorithm,
+            _("work factor"): decoded["n"],
+            _("salt"): mask_hash(decoded["salt"]),
+            _("block size"): decoded["r"],
+            _("parallelism"): decoded["p"],
+            _("hash"): mask_hash(decoded["hash"]),
+        }
+
+    def must_update(self, encoded):
+        decoded = self._decode(encoded)
+        return (decoded["n"], decoded["r"], decoded["p"]) != (self.work_factor, self.block_size, self.parallelism)
+
+    def harden_runtime(self, password, encoded):
+        # The cost is fixed by the parameters stored in the hash.
+        pass
@@ -0,0 +1,217 @@
+"""
+Outgoing email queue.
+
+`queue_email` stores the message as a `QueuedEmail` row and, once the
+transaction commits, schedules `send_queued_mail` to run
+`ACCOUNTS_MAIL_BATCH_DELAY` seconds later. Messages queued in the meantime
+(a burst of password resets, say) are picked up by that same run instead of
+each getting its own task.
+
+`send_queued_mail` sends due messages in batches of `ACCOUNTS_MAIL_BATCH_SIZE`,
+each over a single `get_connection()`. A message the server rejects is retried
+after `ACCOUNTS_MAIL_RETRY_DELAY` seconds, doubling on every failure, and
+dropped after `ACCOUNTS_MAIL_MAX_ATTEMPTS`; a broken connection ends the run and
+leaves the unsent rest for the next one. Celery beat also runs it every
+`ACCOUNTS_MAIL_FLUSH_INTERVAL` seconds to pick up retries, and `prune` deletes
+dropped messages after `ACCOUNTS_MAIL_DROPPED_RETENTION` days.
+
+Runs may overlap (a scheduled run and the beat one, on different workers), so
+each batch is claimed in the database first: one UPDATE stamps due rows with
+the run's `claim` token and moves them `CLAIM_TIMEOUT` seconds ahead, and the
+run then sends only the rows carrying its token. Rows are deleted after their
+batch is sent, so a worker that dies mid-batch may send a message twice, once
+its claim has lapsed, never zero times.
+
+`queue_template_email` stores only a template name and its context; the
+sending worker renders `<template>.txt` (and `<template>.html` if it exists)
+with the project's template engine, whose cached loader compiles each template
+once per process.
+"""
+import json
+import logging
+import smtplib
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+from django.utils import timezone
+from accounts.models import QueuedEmail
+from forums.tasks import enqueue
+
+SCHEDULED_KEY = "accounts:mail:scheduled"
+CLAIM_TIMEOUT = 300
+# The server answered, but refused this message: the connection is still usable.
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException)
+
+logger = logging.getLogger(__name__)
+
+
+def queue_email(subject, body, to, from_email=None, html_body=None):
+    """Queue a plain text email, with an optional HTML alternative, for the next batch."""
+    queued = QueuedEmail.objects.create(message=json.dumps({
+        "subject": subject,
+        "body": body,
+        "from_email": from_email or settings.DEFAULT_FROM_EMAIL,
+        "to": list(to),
+        "html_body": html_body,
+    }))
+    transaction.on_commit(schedule)
+    return queued
+
+
+def queue_template_email(template, subject, context, to, from_email=None):
+    """Queue an email rendered from `template` (e.g. "email/user_reset_password") when it is sent."""
+    queued = QueuedEmail.objects.create(message=json.dumps({
+        "subject": subject,
+        "template": template,
+        "context": context,
+        "from_email": from_email or settings.DEFAULT_FROM_EMAIL,
+        "to": list(to),
+    }))
+    transaction.on_commit(schedule)
+    return queued
+
+
+def schedule():
+
+    """
+    Schedule a `send_queued_mail` run, unless this process already has one due.
+
+    The key expires when the run is due rather than being cleared by the
+    worker, whose cache need not be this process's. If the broker is down the
+    message stays queued for the beat run, and the next one tries again.
+    """
+    from accounts.tasks import send_queued_mail as send_queued_mail_task
+
+    delay = settings.ACCOUNTS_MAIL_BATCH_DELAY
+    if cache.add(SCHEDULED_KEY, True, delay):
+        if not enqueue(send_queued_mail_task, countdown=delay):
+            cache.delete(SCHEDULED_KEY)
+
+
+def render(template, context):
+    """Return the plain text and HTML (or None) bodies of an email template."""
+    body = get_template(f"{template}.txt").render(context)
+    try:
+        html_body = get_template(f"{template}.html").render(context)
+    except TemplateDoesNotExist:
+        html_body = None
+    return body, html_body
+
+
+def _build(queued, connection):
+    data = json.loads(queued.message)
+    if "template" in data:
+        data["body"], data["html_body"] = render(data["template"], data["context"])
+    message = EmailMultiAlternatives(
+        data["subject"], data["body"], data["from_email"], data["to"], connection=connection
+    )
+    if data["html_body"]:
+        message.attach_alternative(data["html_body"], "text/html")
+    return message
+
+
+def _claim(token, batch_size):
+    """Claim up to `batch_size` due rows for the run `token`; returns them."""
+    now = timezone.now()
+    due = QueuedEmail.objects.filter(next_attempt_at__lte=now)
+    pks = list(due.order_by("next_attempt_at", "pk").values_list("pk", flat=True)[:batch_size])
+    # Repeating the filter in the UPDATE skips rows another run claimed since.
+    due.filter(pk__in=pks).update(claim=token, next_attempt_at=now + timedelta(seconds=CLAIM_TIMEOUT))
+    return list(QueuedEmail.objects.filter(claim=token).order_by("pk"))
+
+
+def _retry(queued, error, now):
+    queued.attempts += 1
+    queued.claim = None
+    queued.last_error = f"{type(error).__name__}: {error}"
+    if queued.attempts >= settings.ACCOUNTS_MAIL_MAX_ATTEMPTS:
+        queued.next_attempt_at = None
+        logger.error("Dropping queued email %s after %d attempts: %s", queued.pk, queued.attempts, queued.last_error)
+    else:
+        delay = settings.ACCOUNTS_MAIL_RETRY_DELAY * 2 ** (queued.attempts - 1)
+        queued.next_attempt_at = now + timedelta(seconds=delay)
+    return queued
+
+
+def _send_batch(batch):
+    """Send `batch` over one connection. Returns `(sent, failed, connection_ok)`."""
+    sent, failed = [], []
+    connection = get_connection(fail_silently=False)
+    now = timezone.now()
+    try:
+        connection.open()
+    except Exception as error:
+        return sent, [_retry(queued, error, now) for queued in batch], False
+    try:
+        for queued in batch:
+            try:
+                message = _build(queued, connection)
+            except Exception as error:
+                failed.append(_retry(queued, error, now))
+                continue
+            try:
+                connection.send_messages([message])
+            except MESSAGE_ERRORS as error:
+                failed.append(_retry(queued, error, now))
+            except Exception as error:
+                failed.append(_retry(queued, error, now))
+                return sent, failed, False
+            else:
+                sent.append(queued.pk)
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+    return sent, failed, True
+
+
+def send_queued_mail(batch_size=None):
+
+    """
+    Send every due queued email, one connection per batch.
+
+    Returns the run's totals (`batches`, `sent`, `failed`, `dropped`,
+    `seconds`).
+    """
+    batch_size = batch_size or settings.ACCOUNTS_MAIL_BATCH_SIZE
+    token = uuid.uuid4()
+    totals = {"batches": 0, "sent": 0, "failed": 0, "dropped": 0, "seconds": 0.0}
+    connection_ok = True
+    while connection_ok:
+        batch = _claim(token, batch_size)
+        if not batch:
+            break
+        started = time.perf_counter()
+        sent, failed, connection_ok = _send_batch(batch)
+        QueuedEmail.objects.filter(pk__in=sent).delete()
+        QueuedEmail.objects.bulk_update(failed, ["attempts", "next_attempt_at", "last_error", "claim"])
+        # Whatever a broken connection left unsent is due again straight away.
+        QueuedEmail.objects.filter(claim=token).update(claim=None, next_attempt_at=timezone.now())
+        elapsed = time.perf_counter() - started
+
+        dropped = sum(queued.next_attempt_at is None for queued in failed)
+        logger.info(
+            "Mail batch: %d sent, %d failed, %d dropped of %d in %.3fs",
+            len(sent), len(failed), dropped, len(batch), elapsed
+        )
+        totals["batches"] += 1
+        totals["sent"] += len(sent)
+        totals["failed"] += len(failed)
+        totals["dropped"] += dropped
+        totals["seconds"] += elapsed
+    return totals
+
+
+def prune():
+    """Delete emails dropped more than `ACCOUNTS_MAIL_DROPPED_RETENTION` days ago; returns how many."""
+    cutoff = timezone.now() - timedelta(days=settings.ACCOUNTS_MAIL_DROPPED_RETENTION)
+    deleted, _ = QueuedEmail.objects.filter(next_attempt_at=None, created_at__lte=cutoff).delete()
+    return deleted
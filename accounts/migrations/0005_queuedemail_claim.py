@@ -0,0 +1,18 @@
+# Generated by Django 3.0.5 on 2026-10-18 12:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_revokedtoken_revoked_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuedemail',
+            name='claim',
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -2,12 +2,10 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from django.template.loader import render_to_string
-from django.core.mail import EmailMultiAlternatives
+from django.utils import timezone
 
 from django_rest_passwordreset.signals import reset_password_token_created, post_password_reset
 from accounts.managers import CustomUserManager
-from celery import shared_task
 from predict.settings import DEFAULT_FROM_EMAIL
 
 
@@ -37,45 +35,58 @@ class UserProfile(models.Model):
     def __str__(self):
         return self.user.first_name
 
-def send_email_notification(sender, subject, body, plaintext_message=None, to=None):
 
-    try:
-        msg = EmailMultiAlternatives(
-            subject=subject,
-            body=plaintext_message,
-            from_email=sender,
-            to=to
-        )
-        msg.attach_alternative(body, "text/html")
-        return msg.send(fail_silently=False)
-    except:
-        return {"detail": "Email notification not sent"}
+class RevokedToken(models.Model):
 
-@shared_task
-def _send_email(*args, **kwargs):
-    send_email_notification(*args, **kwargs)
+    """
+    A revoked token (`jti:<jti>`) or all of a user's tokens (`user:<id>`).
+
+    Tokens matching `key` that were issued at or before `revoked_at` are
+    rejected; the row can be deleted once `expires_at` has passed.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    revoked_at = models.DateTimeField(db_index=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.key
+
+
+class QueuedEmail(models.Model):
+
+    """
+    An email waiting for `accounts.mail.send_queued_mail`.
+
+    `message` is the JSON-encoded subject, bodies, sender and recipients. A
+    failed attempt pushes `next_attempt_at` back; it is cleared once the
+    message has failed `ACCOUNTS_MAIL_MAX_ATTEMPTS` times. `claim` identifies
+    the run sending it, which also moves `next_attempt_at` to the end of its
+    lease so no other run picks it up meanwhile.
+    """
+    message = models.TextField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, null=True, db_index=True)
+    claim = models.UUIDField(null=True, blank=True, db_index=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Queued email {self.pk}"
 
-def send_email(*args, **kwargs):
-    _send_email.delay(*args, **kwargs)
 
 @receiver(reset_password_token_created)
 def password_reset_token_created(sender, instance, reset_password_token, *args, **kwargs):
 
     """Send link to reset user"s Password"""
-    # send email to the user
+    from accounts.mail import queue_template_email
+
+    # send email to the user; the mail worker renders the templates
     context = {
         "first_name": reset_password_token.user.first_name,
         "email": reset_password_token.user.email,
         "reset_password_url": f"?token={reset_password_token.key}"
     }
-
-    # render email text
-    email_sender = DEFAULT_FROM_EMAIL
-    email_subject = "Password Reset"
-    email_body = render_to_string("email/user_reset_password.html", context)
-    email_plaintext_message = render_to_string("email/user_reset_password.txt", context)
-
-    send_email(
-        email_sender, email_subject, email_body, email_plaintext_message,
-        to=[reset_password_token.user.email]
+    queue_template_email(
+        "email/user_reset_password", "Password Reset", context, [reset_password_token.user.email],
+        from_email=DEFAULT_FROM_EMAIL
     )
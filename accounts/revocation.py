@@ -0,0 +1,162 @@
+"""
+Token revocation without a query per request.
+
+Revocations are `RevokedToken` rows: one per logged-out token (`jti:<jti>`)
+and one per user who logged out everywhere (`user:<id>`). Every process keeps
+a bloom filter of those keys. A token whose keys are not in the filter is
+valid, which is the common case and costs no query; only possible matches are
+confirmed against the table.
+
+Each revocation bumps a version counter in the cache, again after commit. A process
+that sees a new version adds the rows revoked since its last sync (plus
+`SYNC_GRACE` for clock skew and slow transactions) and rebuilds the filter once
+it holds `ACCOUNTS_REVOCATION_FILTER_CAPACITY` keys.
+
+With a per-process cache (locmem, dummy) other processes would never see the
+counter change, so the version is read from the table instead: the latest
+`revoked_at`, one indexed query at most every
+`ACCOUNTS_REVOCATION_SYNC_INTERVAL` seconds per process. A revocation made by
+another process is enforced here within that interval, and one made by this
+process immediately. Configure a shared cache to see revocations as they happen.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import datetime_from_epoch
+from accounts.bloom import BloomFilter
+from accounts.models import RevokedToken
+
+VERSION_KEY = "accounts:revocations:version"
+SYNC_GRACE = timedelta(minutes=1)
+
+
+class _Filter:
+
+    """This process's bloom filter and the version it was last synced to."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.version = None
+        self.synced_at = None
+        # Per-process cache only: the table's version and when it was read.
+        self.db_version = None
+        self.db_read_at = None
+
+
+_filter = _Filter()
+
+
+def _jti_key(jti):
+    return f"jti:{jti}"
+
+
+def _user_key(user_id):
+    return f"user:{user_id}"
+
+
+def _cache_is_shared():
+    return not isinstance(caches["default"], (LocMemCache, DummyCache))
+
+
+def _db_version():
+    now = time.monotonic()
+    read_at = _filter.db_read_at
+    if read_at is None or now - read_at >= settings.ACCOUNTS_REVOCATION_SYNC_INTERVAL:
+        _filter.db_version = "db", RevokedToken.objects.aggregate(latest=Max("revoked_at"))["latest"]
+        _filter.db_read_at = now
+    return _filter.db_version
+
+
+def get_version():
+    if not _cache_is_shared():
+        # Fail closed: another process's revocation must be seen here too.
+        return _db_version()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Start from the clock so an evicted counter never repeats a synced version.
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _bump():
+    _filter.db_read_at = None
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        get_version()
+
+
+def _changed():
+    # Bump now and again on commit: a process that syncs in between misses the
+    # uncommitted row but records the first bump, so the second one resyncs it.
+    _bump()
+    transaction.on_commit(_bump)
+
+
+def get_filter():
+    """Return this process's bloom filter, synced to the current version."""
+    version = get_version()
+    if version == _filter.version:
+        return _filter.bloom
+    with _filter.lock:
+        if version != _filter.version:
+            started = timezone.now()
+            rows = RevokedToken.objects.filter(expires_at__gt=started)
+            if _filter.bloom is None or _filter.bloom.is_full:
+                keys = list(rows.values_list("key", flat=True))
+                _filter.bloom = BloomFilter(max(settings.ACCOUNTS_REVOCATION_FILTER_CAPACITY, 2 * len(keys)))
+            else:
+                keys = rows.filter(revoked_at__gte=_filter.synced_at - SYNC_GRACE).values_list("key", flat=True)
+            for key in keys:
+                _filter.bloom.add(key)
+            _filter.version, _filter.synced_at = version, started
+    return _filter.bloom
+
+
+def is_revoked(token):
+    """Whether `token` (a validated simplejwt token) was revoked."""
+    bloom = get_filter()
+    keys = [
+        key for key in (_jti_key(token.get(api_settings.JTI_CLAIM)), _user_key(token.get(api_settings.USER_ID_CLAIM)))
+        if key in bloom
+    ]
+    if not keys:
+        return False
+    # Tokens from before `iat` was added count as issued at the epoch.
+    issued_at = datetime_from_epoch(token.get("iat", 0))
+    return RevokedToken.objects.filter(key__in=keys, revoked_at__gte=issued_at).exists()
+
+
+def revoke_token(token):
+    """Revoke a single access or refresh token until it expires."""
+    RevokedToken.objects.get_or_create(key=_jti_key(token[api_settings.JTI_CLAIM]), defaults={
+        "revoked_at": timezone.now(), "expires_at": datetime_from_epoch(token["exp"])
+    })
+    _changed()
+
+
+def revoke_user_tokens(user_id):
+    """Revoke every token issued to the user up to now ("log out everywhere")."""
+    now = timezone.now()
+    lifetime = max(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME)
+    RevokedToken.objects.update_or_create(key=_user_key(user_id), defaults={
+        "revoked_at": now, "expires_at": now + lifetime
+    })
+    _changed()
+
+
+def prune():
+    """Delete revocations of tokens that have expired anyway; returns how many."""
+    deleted, _ = RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
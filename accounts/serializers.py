@@ -1,7 +1,13 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from rest_framework import serializers
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import datetime_to_epoch
+from accounts import revocation
+from accounts.authentication import USER_CLAIMS, record_login
 from accounts.models import UserProfile
 
 User = get_user_model()
@@ -9,8 +15,20 @@ User = get_user_model()
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 
     """Override default token login to include `user` data"""
+    @classmethod
+    def get_token(cls, user):
+        # Read back by `ClaimsJWTAuthentication` instead of querying the user.
+        token = super().get_token(user)
+        # Copied into access tokens too; "log out everywhere" compares against it,
+        # so keep the microseconds: a login in the same second must stay valid.
+        token["iat"] = datetime_to_epoch(token.current_time) + token.current_time.microsecond / 1e6
+        for claim in USER_CLAIMS:
+            token[claim] = getattr(user, claim)
+        return token
+
     def validate(self, attrs):
         data = super().validate(attrs)
+        record_login(self.user)
         data.update({
             "first_name": self.user.first_name,
             "last_name": self.user.last_name,
@@ -24,6 +42,30 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         return data
 
 
+class CustomTokenRefreshSerializer(TokenRefreshSerializer):
+
+    """Refuse to refresh revoked tokens."""
+    def validate(self, attrs):
+        if revocation.is_revoked(RefreshToken(attrs["refresh"])):
+            raise TokenError("Token has been revoked")
+        return super().validate(attrs)
+
+
+class LogoutSerializer(serializers.Serializer):
+
+    """Optional refresh token to revoke along with the access token."""
+    refresh = serializers.CharField(required=False)
+
+    def validate_refresh(self, value):
+        try:
+            token = RefreshToken(value)
+        except TokenError as error:
+            raise serializers.ValidationError(error.args[0])
+        if token.get(api_settings.USER_ID_CLAIM) != self.context["request"].user.id:
+            raise serializers.ValidationError("Token belongs to another user.")
+        return token
+
+
 class UserProfileSerializer(serializers.ModelSerializer):
 
     """User Profile Serializer"""
@@ -32,10 +74,31 @@ class UserProfileSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class ProfileField(serializers.Field):
+
+    """
+    Read-only profile of a user, read through `user.profiles`.
+
+    Serialize a `select_related("profiles")` queryset so listing users costs no
+    query per user; a user without a profile then gives None without a query.
+    """
+    def __init__(self, **kwargs):
+        kwargs["source"] = "*"
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, user):
+        try:
+            profile = user.profiles
+        except UserProfile.DoesNotExist:
+            return None
+        return UserProfileSerializer(profile, many=False).data
+
+
 class CreateUserSerializer(serializers.ModelSerializer):
 
     """Serializer to create a new user."""
-    profile = serializers.SerializerMethodField()
+    profile = ProfileField()
 
     class Meta:
         model = User
@@ -55,35 +118,23 @@ class CreateUserSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         email = validated_data.pop("email")
         password = validated_data.pop("password")
-        user = User.objects.create_user(email, password, **validated_data)
-
-        user_profile = UserProfile.objects.create(user=user)
+        # Hashing happens before the first INSERT, so no locks are held while it runs.
+        with transaction.atomic():
+            user = User.objects.create_user(email, password, **validated_data)
+            # Creating the profile also caches it on `user.profiles`.
+            UserProfile.objects.create(user=user)
         return user
 
-    def get_profile(self, obj):
-        try:
-            profile = UserProfile.objects.get(user=obj)
-            return UserProfileSerializer(profile, many=False).data
-        except:
-            return None
-
 
 class  RetrieveUserSerializer(serializers.ModelSerializer):
 
     """Serializer to retrieve existing user"""
-    profile = serializers.SerializerMethodField()
-
-    def get_profile(self, obj):
-        try:
-            profile = UserProfile.objects.get(user=obj)
-            return UserProfileSerializer(profile, many=False).data
-        except:
-            return None
+    profile = ProfileField()
+    discussion_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
-        exclude = ["password", "date_joined",]
-        depth = 1
+        exclude = ["password", "date_joined", "groups", "user_permissions"]
 
 
 class UpdateUserSerializer(serializers.ModelSerializer):
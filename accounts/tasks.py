@@ -0,0 +1,20 @@
+from celery import shared_task
+from accounts import mail, revocation
+
+
+@shared_task
+def prune_revoked_tokens():
+    """Delete revocations of tokens that have expired; scheduled by `CELERYBEAT_SCHEDULE`."""
+    return revocation.prune()
+
+
+@shared_task
+def send_queued_mail():
+    """Send queued emails in batches; scheduled by `accounts.mail.queue_email` and `CELERYBEAT_SCHEDULE`."""
+    return mail.send_queued_mail()
+
+
+@shared_task
+def prune_dropped_mail():
+    """Delete queued emails that were given up on; scheduled by `CELERYBEAT_SCHEDULE`."""
+    return mail.prune()
@@ -1,6 +1,24 @@
+import json
+import smtplib
+import uuid
+from datetime import timedelta
+from unittest import mock
+from django.core import mail as django_mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection
+from django.template import engines
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from kombu.exceptions import OperationalError
 from rest_framework.test import APIClient, APITestCase
 from rest_framework import status, permissions
-from .models import User, UserProfile
+from rest_framework_simplejwt.tokens import AccessToken
+from accounts import mail, revocation
+from accounts.bloom import BloomFilter
+from forums.models import Discussion
+from .models import QueuedEmail, RevokedToken, User, UserProfile
 
 
 class UserTest(APITestCase):
@@ -11,6 +29,10 @@ class UserTest(APITestCase):
 
     def setUp(self):
         self.client = APIClient()
+        # Each test starts with an empty revocation filter in this process.
+        patcher = mock.patch.object(revocation, "_filter", revocation._Filter())
+        patcher.start()
+        self.addCleanup(patcher.stop)
         self.super_admin = User.objects.create_user(
             email="superadmin@gmail.com",
             password="asdf",
@@ -176,3 +198,309 @@ class UserTest(APITestCase):
     def test_anonymous_user_cannot_get_own_profile(self):
         response = self.client.get(self.dashboard_endpoint)
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_dashboard_query_budget(self):
+        Discussion.objects.create(user=self.piu, title="Hello", content="Content")
+        self.regular_user_login()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.dashboard_endpoint)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["discussion_count"], 1)
+        self.assertEqual(response.data["profile"]["user"], self.piu.id)
+        self.assertNotIn("user_permissions", response.data)
+        self.assertEqual(len(context.captured_queries), 1)
+
+        User.objects.bulk_create([
+            User(email=f"bulk{i}@gmail.com", first_name="Bulk", password="!") for i in range(30)
+        ])
+        self.super_admin_login()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.dashboard_endpoint)
+        self.assertEqual(response.data["count"], User.objects.count())
+        self.assertEqual(len(response.data["results"]), 20)
+        self.assertIn("discussion_count", response.data["results"][0])
+        self.assertIsNone(response.data["results"][-1]["profile"])
+        # COUNT, one page of ids, then that page with profiles and discussion counts.
+        self.assertEqual(len(context.captured_queries), 3)
+
+    def test_registration_returns_profile_without_looking_it_up(self):
+        data = {"email": "new@gmail.com", "first_name": "New", "password": "asdf"}
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(self.registration_endpoint, data=data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["profile"]["user"], response.data["id"])
+        profile_reads = [
+            query for query in context.captured_queries
+            if query["sql"].startswith("SELECT") and "accounts_userprofile" in query["sql"]
+        ]
+        self.assertEqual(profile_reads, [])
+
+    def test_registration_is_atomic(self):
+        data = {"email": "new@gmail.com", "first_name": "New", "password": "asdf"}
+        with mock.patch.object(UserProfile.objects, "create", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post(self.registration_endpoint, data=data, format="json")
+        self.assertFalse(User.objects.filter(email="new@gmail.com").exists())
+
+    def test_login_upgrades_password_hash_to_preferred_hasher(self):
+        self.assertTrue(self.piu.password.startswith("pbkdf2_sha256$"))
+        hashers = [
+            "accounts.hashers.ScryptPasswordHasher", "accounts.hashers.TunedPBKDF2PasswordHasher"
+        ]
+        with override_settings(PASSWORD_HASHERS=hashers, PASSWORD_SCRYPT_WORK_FACTOR=2 ** 10):
+            response = self.client.post(
+                "/accounts/login/", data={"email": "piu@gmail.com", "password": "asdf"}, format="json"
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.piu.refresh_from_db()
+            self.assertTrue(self.piu.password.startswith("scrypt$1024$"))
+            self.assertTrue(self.piu.check_password("asdf"))
+
+            with override_settings(PASSWORD_SCRYPT_WORK_FACTOR=2 ** 11):
+                self.client.post(
+                    "/accounts/login/", data={"email": "piu@gmail.com", "password": "asdf"}, format="json"
+                )
+                self.piu.refresh_from_db()
+                self.assertTrue(self.piu.password.startswith("scrypt$2048$"))
+
+    def login(self, email="piu@gmail.com", password="asdf"):
+        return self.client.post("/accounts/login/", data={"email": email, "password": password}, format="json")
+
+    def test_token_claims_authenticate_without_loading_the_user(self):
+        UserProfile.objects.get_or_create(user=self.piu)
+        access = self.login().data["access"]
+        self.assertEqual(AccessToken(access)["email"], "piu@gmail.com")
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        revocation.get_filter()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.dashboard_endpoint)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["id"], self.piu.id)
+        # Only the dashboard query itself; no lookup of the authenticated user.
+        self.assertEqual(len(context.captured_queries), 1)
+
+    def test_token_without_claims_falls_back_to_the_user_row(self):
+        UserProfile.objects.get_or_create(user=self.piu)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.piu)}")
+        revocation.get_filter()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.dashboard_endpoint)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(context.captured_queries), 2)
+
+    def test_claims_user_loads_the_full_user_on_demand(self):
+        from accounts.authentication import ClaimsUser
+
+        user = ClaimsUser(AccessToken(self.login().data["access"]))
+        with self.assertNumQueries(0):
+            self.assertEqual((user.id, user.email, user.is_superuser), (self.piu.id, "piu@gmail.com", False))
+            self.assertEqual(user, self.piu)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.first_name, "PIU")
+            self.assertEqual(user.last_name, "Mario")
+
+    def test_last_login_is_updated_at_most_once_per_interval(self):
+        self.assertIsNone(self.piu.last_login)
+        self.login()
+        self.piu.refresh_from_db()
+        first_login = self.piu.last_login
+        self.assertIsNotNone(first_login)
+
+        self.login()
+        self.piu.refresh_from_db()
+        self.assertEqual(self.piu.last_login, first_login)
+
+        with override_settings(ACCOUNTS_LAST_LOGIN_INTERVAL=0):
+            self.login()
+        self.piu.refresh_from_db()
+        self.assertGreater(self.piu.last_login, first_login)
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"jti:{i}")
+        self.assertTrue(all(f"jti:{i}" in bloom for i in range(1000)))
+        false_positives = sum(f"other:{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+        self.assertTrue(bloom.is_full)
+
+    def test_unrevoked_token_is_checked_without_a_query(self):
+        access = self.login().data["access"]
+        revocation.revoke_token(AccessToken(self.login(email="superadmin@gmail.com").data["access"]))
+        revocation.get_filter()
+        with self.assertNumQueries(0):
+            self.assertFalse(revocation.is_revoked(AccessToken(access)))
+
+    def test_per_process_cache_reads_revocations_from_the_table(self):
+        access = AccessToken(self.login().data["access"])
+        self.assertFalse(revocation.is_revoked(access))
+        with self.assertNumQueries(0):
+            self.assertFalse(revocation.is_revoked(access))
+        # Revoked by another process: no cache bump reaches this one.
+        RevokedToken.objects.create(
+            key=f"jti:{access['jti']}", revoked_at=timezone.now(), expires_at=timezone.now() + timedelta(days=1)
+        )
+        with override_settings(ACCOUNTS_REVOCATION_SYNC_INTERVAL=0):
+            self.assertTrue(revocation.is_revoked(access))
+
+    def test_shared_cache_version_is_read_without_a_query(self):
+        access = AccessToken(self.login().data["access"])
+        with mock.patch.object(revocation, "_cache_is_shared", return_value=True):
+            self.assertFalse(revocation.is_revoked(access))
+            with self.assertNumQueries(0):
+                self.assertFalse(revocation.is_revoked(access))
+            revocation.revoke_token(access)
+            self.assertTrue(revocation.is_revoked(access))
+
+    def test_logout_revokes_access_and_refresh_tokens(self):
+        UserProfile.objects.get_or_create(user=self.piu)
+        tokens = self.login().data
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.assertEqual(self.client.get(self.dashboard_endpoint).status_code, status.HTTP_200_OK)
+
+        response = self.client.post("/accounts/logout/", data={"refresh": tokens["refresh"]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(RevokedToken.objects.count(), 2)
+
+        response = self.client.get(self.dashboard_endpoint)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials()
+        response = self.client.post(
+            "/accounts/login/refresh-token/", data={"refresh": tokens["refresh"]}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_logout_rejects_another_users_refresh_token(self):
+        other = self.login(email="superadmin@gmail.com").data["refresh"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.login().data['access']}")
+        response = self.client.post("/accounts/logout/", data={"refresh": other}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(RevokedToken.objects.exists())
+
+    def test_logout_everywhere_revokes_all_earlier_tokens(self):
+        UserProfile.objects.get_or_create(user=self.piu)
+        first, second = self.login().data, self.login().data
+        admin = self.login(email="superadmin@gmail.com").data
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {first['access']}")
+        response = self.client.post("/accounts/logout-all/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        for tokens in (first, second):
+            self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+            self.assertEqual(self.client.get(self.dashboard_endpoint).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {admin['access']}")
+        self.assertEqual(self.client.get(self.dashboard_endpoint).status_code, status.HTTP_200_OK)
+
+        # Tokens issued after the revocation work again, even within the same second.
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.login().data['access']}")
+        self.assertEqual(self.client.get(self.dashboard_endpoint).status_code, status.HTTP_200_OK)
+
+    def test_prune_deletes_expired_revocations(self):
+        now = timezone.now()
+        RevokedToken.objects.create(key="jti:old", revoked_at=now, expires_at=now - timedelta(seconds=1))
+        RevokedToken.objects.create(key="jti:new", revoked_at=now, expires_at=now + timedelta(hours=1))
+        self.assertEqual(revocation.prune(), 1)
+        self.assertEqual(list(RevokedToken.objects.values_list("key", flat=True)), ["jti:new"])
+
+    def test_password_reset_email_is_queued_and_sent_in_batches(self):
+        response = self.client.post("/accounts/password-reset/", data={"email": "piu@gmail.com"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(django_mail.outbox), 0)
+        # Only the template name and context are queued; the sender renders them.
+        queued = json.loads(QueuedEmail.objects.get().message)
+        self.assertEqual(queued["template"], "email/user_reset_password")
+        self.assertEqual(queued["context"]["first_name"], self.piu.first_name)
+        self.assertNotIn("body", queued)
+        for i in range(4):
+            mail.queue_email("Hello", "Plain", [f"user{i}@gmail.com"], html_body="<p>Hello</p>")
+
+        with mock.patch("accounts.mail.get_connection", wraps=mail.get_connection) as get_connection:
+            totals = mail.send_queued_mail(batch_size=2)
+        self.assertEqual(get_connection.call_count, 3)
+        self.assertEqual((totals["batches"], totals["sent"], totals["failed"]), (3, 5, 0))
+        self.assertFalse(QueuedEmail.objects.exists())
+
+        reset = django_mail.outbox[0]
+        self.assertEqual((reset.subject, reset.to), ("Password Reset", ["piu@gmail.com"]))
+        self.assertIn(f"Hello {self.piu.first_name}!", reset.body)
+        self.assertIn(queued["context"]["reset_password_url"], reset.body)
+        self.assertEqual(reset.alternatives[0][1], "text/html")
+        loader = engines["django"].engine.template_loaders[0]
+        self.assertIn("email/user_reset_password.html", loader.get_template_cache)
+
+    @override_settings(ACCOUNTS_MAIL_RETRY_DELAY=30, ACCOUNTS_MAIL_MAX_ATTEMPTS=2)
+    def test_rejected_email_is_retried_with_backoff_then_dropped(self):
+        send_messages = EmailBackend.send_messages
+
+        def reject_bad_address(backend, messages):
+            if "bad@gmail.com" in messages[0].to:
+                raise smtplib.SMTPRecipientsRefused({"bad@gmail.com": (550, b"No such user")})
+            return send_messages(backend, messages)
+
+        bad = mail.queue_email("Hello", "Plain", ["bad@gmail.com"])
+        mail.queue_email("Hello", "Plain", ["good@gmail.com"])
+        with mock.patch.object(EmailBackend, "send_messages", reject_bad_address):
+            totals = mail.send_queued_mail()
+            self.assertEqual((totals["sent"], totals["failed"], totals["dropped"]), (1, 1, 0))
+            self.assertEqual([message.to for message in django_mail.outbox], [["good@gmail.com"]])
+            bad.refresh_from_db()
+            self.assertEqual(bad.attempts, 1)
+            self.assertIn("SMTPRecipientsRefused", bad.last_error)
+            self.assertAlmostEqual(
+                (bad.next_attempt_at - timezone.now()).total_seconds(), 30, delta=5
+            )
+
+            # Not due yet, then dropped on the second failure.
+            self.assertEqual(mail.send_queued_mail()["batches"], 0)
+            QueuedEmail.objects.filter(pk=bad.pk).update(next_attempt_at=timezone.now())
+            self.assertEqual(mail.send_queued_mail()["dropped"], 1)
+        bad.refresh_from_db()
+        self.assertEqual(bad.attempts, 2)
+        self.assertIsNone(bad.next_attempt_at)
+        self.assertEqual(mail.send_queued_mail()["batches"], 0)
+
+    def test_broken_connection_defers_the_rest_of_the_batch(self):
+        for i in range(3):
+            mail.queue_email("Hello", "Plain", [f"user{i}@gmail.com"])
+        with mock.patch.object(EmailBackend, "send_messages", side_effect=[1, smtplib.SMTPServerDisconnected()]):
+            totals = mail.send_queued_mail()
+        self.assertEqual((totals["batches"], totals["sent"], totals["failed"]), (1, 1, 1))
+        self.assertEqual(QueuedEmail.objects.filter(attempts=0).count(), 1)
+        self.assertEqual(mail.send_queued_mail()["sent"], 1)
+
+    def test_unreachable_broker_leaves_queued_mail_for_the_next_schedule(self):
+        from accounts.tasks import send_queued_mail
+
+        cache.delete(mail.SCHEDULED_KEY)
+        down = OperationalError("Connection refused")
+        with mock.patch.object(send_queued_mail, "apply_async", side_effect=down) as apply_async:
+            mail.schedule()
+            self.assertIsNone(cache.get(mail.SCHEDULED_KEY))
+            mail.schedule()
+        self.assertEqual(apply_async.call_count, 2)
+
+    def test_rows_claimed_by_another_run_are_not_sent_again(self):
+        claimed = mail.queue_email("Hello", "Plain", ["claimed@gmail.com"])
+        mail.queue_email("Hello", "Plain", ["free@gmail.com"])
+        # Another run, still sending, has claimed the first message.
+        other = uuid.uuid4()
+        self.assertEqual(mail._claim(other, batch_size=1), [claimed])
+
+        self.assertEqual(mail.send_queued_mail()["sent"], 1)
+        self.assertEqual([message.to for message in django_mail.outbox], [["free@gmail.com"]])
+        claimed.refresh_from_db()
+        self.assertEqual(claimed.claim, other)
+        self.assertGreater(claimed.next_attempt_at, timezone.now())
+
+    @override_settings(ACCOUNTS_MAIL_DROPPED_RETENTION=7)
+    def test_prune_deletes_old_dropped_emails(self):
+        old = mail.queue_email("Hello", "Plain", ["old@gmail.com"])
+        recent = mail.queue_email("Hello", "Plain", ["recent@gmail.com"])
+        pending = mail.queue_email("Hello", "Plain", ["pending@gmail.com"])
+        QueuedEmail.objects.filter(pk__in=[old.pk, recent.pk]).update(next_attempt_at=None)
+        QueuedEmail.objects.filter(pk__in=[old.pk, pending.pk]).update(
+            created_at=timezone.now() - timedelta(days=8)
+        )
+        self.assertEqual(mail.prune(), 1)
+        self.assertEqual(set(QueuedEmail.objects.values_list("pk", flat=True)), {recent.pk, pending.pk})
@@ -1,6 +1,5 @@
 from django.urls import path, include
 from rest_framework.routers import SimpleRouter
-from rest_framework_simplejwt.views import TokenRefreshView
 from accounts import views
 
 router = SimpleRouter()
@@ -8,7 +7,9 @@ router = SimpleRouter()
 urlpatterns = [
     path("register/", views.RegisterView.as_view()),
     path("login/", views.CustomTokenObtainPairView.as_view(), name="token_obtain_pair"),
-    path("login/refresh-token/", TokenRefreshView.as_view(), name="token_refresh"),
+    path("login/refresh-token/", views.CustomTokenRefreshView.as_view(), name="token_refresh"),
+    path("logout/", views.LogoutView.as_view(), name="logout"),
+    path("logout-all/", views.LogoutAllView.as_view(), name="logout_all"),
     path('password-reset/', include('django_rest_passwordreset.urls', namespace='password_reset')),
 ]
 
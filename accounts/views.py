@@ -1,8 +1,10 @@
 from django.contrib.auth import get_user_model
+from django.db.models import Count
 from rest_framework import generics, permissions, status, viewsets
 from rest_framework.response import Response
-from rest_framework_simplejwt.views import TokenObtainPairView
-from accounts import serializers
+from rest_framework.views import APIView
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from accounts import revocation, serializers
 
 User = get_user_model()
 
@@ -12,6 +14,38 @@ class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = serializers.CustomTokenObtainPairSerializer
 
 
+class CustomTokenRefreshView(TokenRefreshView):
+
+    """create: Get a new access token with a refresh token that was not revoked."""
+    serializer_class = serializers.CustomTokenRefreshSerializer
+
+
+class LogoutView(generics.GenericAPIView):
+
+    """Revoke the access token used for this request and, if given, the refresh token."""
+    serializer_class = serializers.LogoutSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # `request.auth` is the access token unless another authentication class was used.
+        for token in (request.auth, serializer.validated_data.get("refresh")):
+            if token is not None:
+                revocation.revoke_token(token)
+        return Response({"detail": "Logged out."}, status=status.HTTP_200_OK)
+
+
+class LogoutAllView(APIView):
+
+    """Revoke every access and refresh token issued to the current user."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        revocation.revoke_user_tokens(request.user.id)
+        return Response({"detail": "Logged out of all sessions."}, status=status.HTTP_200_OK)
+
+
 class RegisterView(generics.CreateAPIView):
 
     """Sign up as a new user"""
@@ -33,9 +67,12 @@ class DashboardViewset(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ["list", "retrieve"]:
+            queryset = queryset.select_related("profiles").annotate(discussion_count=Count("discussions"))
         if self.request.user.is_superuser:
-            return super().get_queryset()
-        return User.objects.filter(id=self.request.user.id)
+            return queryset
+        return queryset.filter(id=self.request.user.id)
 
     def get_serializer_class(self):
         if self.action == "partial_update":
@@ -44,15 +81,11 @@ class DashboardViewset(viewsets.ModelViewSet):
 
     def list(self, request):
         if not request.user.is_superuser:
-            queryset = User.objects.get(id=request.user.id)
-            serializer = serializers.RetrieveUserSerializer(queryset, many=False)
-            return Response({
-                "discussion_count": request.user.discussions.all().count(),
-                **serializer.data
-            }, status=status.HTTP_200_OK)
-
-        queryset = User.objects.all()
-        query = self.paginate_queryset(queryset)
+            serializer = self.get_serializer(self.get_queryset().get())
+            return Response(serializer.data, status=status.HTTP_200_OK)
 
-        serializer = serializers.RetrieveUserSerializer(queryset, many=True)
+        # Count and page over bare ids, then load just that page with its annotations.
+        ids = self.paginate_queryset(User.objects.order_by("id").values_list("id", flat=True))
+        users = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer([users[pk] for pk in ids if pk in users], many=True)
         return self.get_paginated_response(serializer.data)
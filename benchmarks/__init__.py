@@ -0,0 +1,31 @@
+"""
+Benchmarks for the Forumi API.
+
+Each module is runnable with `python -m benchmarks.<name>` and works against a
+throwaway test database, so it never touches `db.sqlite3` or your Postgres data.
+"""
+import os
+from contextlib import contextmanager
+
+
+def setup():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "predict.settings")
+    import django
+    django.setup()
+
+
+@contextmanager
+def test_database(verbosity=0):
+
+    """Create a fresh test database for the duration of the block."""
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity)
+        teardown_test_environment()
@@ -0,0 +1,80 @@
+"""
+Compare authenticated read throughput of database-backed and claims-based JWT authentication.
+
+    python -m benchmarks.authentication --requests 2000
+
+"database" is simplejwt's `JWTAuthentication`, which loads the user row on every
+request; "claims" is `accounts.authentication.ClaimsJWTAuthentication`. Both
+send the same bearer token to a cached discussion detail and to the dashboard.
+"""
+import argparse
+import json
+import time
+from unittest import mock
+
+from benchmarks import setup, test_database
+
+AUTHENTICATORS = {
+    "database": "rest_framework_simplejwt.authentication.JWTAuthentication",
+    "claims": "accounts.authentication.ClaimsJWTAuthentication",
+}
+
+
+def measure(authenticator, path, token, requests):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from django.utils.module_loading import import_string
+    from rest_framework.test import APIClient
+    from rest_framework.views import APIView
+
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+    # Views inherit `authentication_classes` from APIView unless they set their own.
+    with mock.patch.object(APIView, "authentication_classes", [import_string(authenticator)]):
+        client.get(path)
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            for _ in range(requests):
+                response = client.get(path)
+                assert response.status_code == 200, response.status_code
+            elapsed = time.perf_counter() - started
+    return {"requests_per_second": requests / elapsed, "queries_per_request": len(context) / requests}
+
+
+def run(requests):
+    from accounts.models import User, UserProfile
+    from accounts.serializers import CustomTokenObtainPairSerializer
+    from forums.models import Discussion
+
+    user = User.objects.create_user(email="auth@forumi.com", password="!", first_name="Auth")
+    UserProfile.objects.create(user=user)
+    discussion = Discussion.objects.create(user=user, title="Benchmark", content="Authenticated reads")
+    token = CustomTokenObtainPairSerializer.get_token(user).access_token
+
+    results = {}
+    for path in (f"/forums/{discussion.id}/", "/accounts/dashboard/"):
+        results[path] = {name: measure(cls, path, token, requests) for name, cls in AUTHENTICATORS.items()}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--output", help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    setup()
+    with test_database():
+        results = run(args.requests)
+
+    print(f"{'path':<22} {'authentication':<15} {'req/s':>8} {'queries':>8}")
+    for path, rows in results.items():
+        for name, row in rows.items():
+            print(f"{path:<22} {name:<15} {row['requests_per_second']:>8.1f} {row['queries_per_request']:>8.1f}")
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
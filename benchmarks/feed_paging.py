@@ -0,0 +1,96 @@
+"""
+Compare page-number (COUNT + OFFSET) and keyset pagination on the discussion feed.
+
+    python -m benchmarks.feed_paging --rows 200000 --pages 1 10 100 1000 10000
+
+Keyset latency should stay flat as the page number grows; OFFSET latency grows linearly.
+"""
+import argparse
+import json
+import statistics
+import time
+
+from benchmarks import setup, test_database
+
+
+def seed(rows, batch_size=5000):
+    from accounts.models import User
+    from forums.models import Discussion
+
+    user = User.objects.create(email="bench@forumi.com", first_name="Bench", password="!")
+    for start in range(0, rows, batch_size):
+        Discussion.objects.bulk_create([
+            Discussion(user=user, title=f"Discussion {i}", content="Benchmark content")
+            for i in range(start, min(start + batch_size, rows))
+        ])
+
+
+def time_call(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def run(pages, page_size, repeat):
+    from rest_framework.pagination import PageNumberPagination
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+    from forums.models import Discussion
+    from forums.pagination import KeysetPagination
+
+    factory = APIRequestFactory()
+    queryset = Discussion.objects.order_by("-created_at", "-id")
+    results = []
+
+    for page in pages:
+        offset_paginator = PageNumberPagination()
+        offset_paginator.page_size = page_size
+        offset_request = Request(factory.get("/forums/", {"page": page}))
+
+        keyset_paginator = KeysetPagination()
+        keyset_paginator.page_size = page_size
+        params = {}
+        if page > 1:
+            boundary = queryset[(page - 1) * page_size - 1]
+            keyset_paginator.model_field = Discussion._meta.get_field("created_at")
+            params["cursor"] = keyset_paginator.cursor_for(boundary)
+        keyset_request = Request(factory.get("/forums/", params))
+
+        results.append({
+            "page": page,
+            "offset_ms": time_call(
+                lambda: list(offset_paginator.paginate_queryset(queryset, offset_request)), repeat),
+            "keyset_ms": time_call(
+                lambda: list(keyset_paginator.paginate_queryset(queryset, keyset_request)), repeat),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    setup()
+    with test_database():
+        seed(args.rows)
+        pages = [page for page in args.pages if (page - 1) * args.page_size < args.rows]
+        results = run(pages, args.page_size, args.repeat)
+
+    print(f"{'page':>8} {'offset (ms)':>12} {'keyset (ms)':>12}")
+    for row in results:
+        print(f"{row['page']:>8} {row['offset_ms']:>12.2f} {row['keyset_ms']:>12.2f}")
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
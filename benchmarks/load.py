@@ -0,0 +1,241 @@
+"""
+Load-test the forums and accounts API with repeatable scenarios.
+
+    python -m benchmarks.load --discussions 20000 --requests 500 --output before.json
+    python -m benchmarks.load --discussions 20000 --requests 500 --compare before.json
+
+By default every request goes through the Django test client against a freshly
+seeded test database, which also counts the SQL queries each request runs.
+With `--url http://localhost:8000` requests go over HTTP to a running server
+that uses the same database settings (seed it first with
+`python -m benchmarks.seed --yes`); query counts are then not available.
+
+Reports p50/p95/p99 latency, mean queries per request and throughput per scenario.
+"""
+import argparse
+import json
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import setup, test_database
+from benchmarks.seed import PASSWORD, seed
+
+SCENARIOS = ["feed", "detail", "like_storm", "comment_burst", "login_burst", "dashboard"]
+
+
+class TestClientDriver:
+
+    """Calls views in-process through the DRF test client, counting queries."""
+
+    def __init__(self):
+        from django.db import connection
+        from rest_framework.test import APIClient
+
+        self.connection = connection
+        self.client_class = APIClient
+        self.local = threading.local()
+
+    def request(self, method, path, data=None, user=None):
+        from django.test.utils import CaptureQueriesContext
+
+        if not hasattr(self.local, "client"):
+            self.local.client = self.client_class()
+        client = self.local.client
+        client.force_authenticate(user)
+        with CaptureQueriesContext(self.connection) as context:
+            response = getattr(client, method)(path, data, format="json")
+        return response.status_code, response.data, len(context.captured_queries)
+
+    def close(self):
+        self.connection.close()
+
+
+class LiveDriver:
+
+    """Sends real HTTP requests to a running server, logging each user in once for a JWT."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.tokens = {}
+        self.lock = threading.Lock()
+
+    def _token(self, user):
+        with self.lock:
+            if user.email not in self.tokens:
+                _, data, _ = self.request("post", "/accounts/login/", {"email": user.email, "password": PASSWORD})
+                self.tokens[user.email] = data["access"]
+            return self.tokens[user.email]
+
+    def request(self, method, path, data=None, user=None):
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        if user is not None:
+            headers["Authorization"] = f"Bearer {self._token(user)}"
+        if method == "get" and data:
+            path = f"{path}?{urllib.parse.urlencode(data)}"
+            data = None
+        body = json.dumps(data).encode() if data is not None else None
+        request = urllib.request.Request(
+            path if path.startswith("http") else self.base_url + path,
+            data=body, headers=headers, method=method.upper()
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                status, content = response.status, response.read()
+        except urllib.error.HTTPError as error:
+            status, content = error.code, error.read()
+        try:
+            return status, json.loads(content or b"null"), None
+        except ValueError:
+            return status, None, None
+
+    def close(self):
+        pass
+
+
+def build_scenario(name, driver, users, discussion_ids, rng):
+    """Return `call(i)` issuing the i-th request of scenario `name`."""
+    hot = discussion_ids[0]
+
+    if name == "feed":
+        # Walk the feed once to collect real cursors, then replay the pages.
+        pages, url = [], "/forums/"
+        while url and len(pages) < 50:
+            pages.append(url)
+            _, data, _ = driver.request("get", url, user=users[0])
+            url = data and data.get("next")
+        return lambda i: driver.request("get", pages[i % len(pages)], user=users[i % len(users)])
+    if name == "detail":
+        picks = [rng.choice(discussion_ids) for _ in range(1000)]
+        return lambda i: driver.request("get", f"/forums/{picks[i % len(picks)]}/", user=users[i % len(users)])
+    if name == "like_storm":
+        def like(i):
+            method = "put" if (i // len(users)) % 2 == 0 else "delete"
+            return driver.request(method, f"/forums/{hot}/like/", user=users[i % len(users)])
+        return like
+    if name == "comment_burst":
+        return lambda i: driver.request(
+            "post", f"/forums/{hot}/add-comment/", {"content": f"Comment {i}"}, user=users[i % len(users)]
+        )
+    if name == "login_burst":
+        return lambda i: driver.request(
+            "post", "/accounts/login/", {"email": users[i % len(users)].email, "password": PASSWORD}
+        )
+    if name == "dashboard":
+        return lambda i: driver.request("get", "/accounts/dashboard/", user=users[i % len(users)])
+    raise ValueError(f"Unknown scenario {name!r}")
+
+
+def percentile(timings, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    return timings[max(int(round(pct / 100 * len(timings))) - 1, 0)]
+
+
+def run_scenario(call, requests, concurrency, close):
+    def timed(i):
+        try:
+            started = time.perf_counter()
+            status, _, queries = call(i)
+            return (time.perf_counter() - started) * 1000, status, queries
+        finally:
+            if concurrency > 1:
+                close()
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(timed, range(requests)))
+    else:
+        samples = [timed(i) for i in range(requests)]
+    elapsed = time.perf_counter() - started
+
+    timings = sorted(sample[0] for sample in samples)
+    queries = [sample[2] for sample in samples if sample[2] is not None]
+    return {
+        "requests": requests,
+        "errors": sum(1 for sample in samples if sample[1] >= 400),
+        "p50_ms": percentile(timings, 50),
+        "p95_ms": percentile(timings, 95),
+        "p99_ms": percentile(timings, 99),
+        "queries_per_request": sum(queries) / len(queries) if queries else None,
+        "throughput_rps": requests / elapsed,
+    }
+
+
+def run(driver, scenarios, requests, concurrency, user_count=50):
+    from accounts.models import User
+    from forums.models import Discussion
+
+    rng = random.Random(7)
+    users = list(User.objects.filter(email__startswith="bench").order_by("id")[:user_count])
+    discussion_ids = list(Discussion.objects.order_by("-likes_count", "id").values_list("id", flat=True))
+    results = {}
+    for name in scenarios:
+        call = build_scenario(name, driver, users, discussion_ids, rng)
+        results[name] = run_scenario(call, requests, concurrency, driver.close)
+    return results
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    print(f"{'scenario':<15} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'req/s':>8} {'errors':>7}")
+    for name, row in results["scenarios"].items():
+        queries = "-" if row["queries_per_request"] is None else f"{row['queries_per_request']:.1f}"
+        print(
+            f"{name:<15} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} "
+            f"{queries:>8} {row['throughput_rps']:>8.1f} {row['errors']:>7}"
+        )
+        old = (baseline or {}).get("scenarios", {}).get(name)
+        if old:
+            change = (row["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 if old["p95_ms"] else 0
+            print(f"{'':<15} p95 {change:+.1f}% vs {baseline.get('commit') or 'baseline'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario.")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--discussions", type=int, default=2000)
+    parser.add_argument("--comments-per-discussion", type=int, default=5)
+    parser.add_argument("--likes-per-discussion", type=int, default=10)
+    parser.add_argument("--url", help="Benchmark a running server instead of the test client.")
+    parser.add_argument("--output", help="Write results as JSON to this path.")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare p95 against.")
+    args = parser.parse_args()
+
+    setup()
+    results = {"commit": current_commit(), "options": vars(args)}
+    if args.url:
+        results["scenarios"] = run(LiveDriver(args.url), args.scenarios, args.requests, args.concurrency)
+    else:
+        with test_database():
+            results["dataset"] = seed(
+                args.users, args.discussions, args.comments_per_discussion, args.likes_per_discussion
+            )
+            results["scenarios"] = run(TestClientDriver(), args.scenarios, args.requests, args.concurrency)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Compare sending emails one connection each with the batched mail queue.
+
+    python -m benchmarks.mail --messages 500 --handshake-ms 20
+
+Both modes deliver the same password-reset sized messages to a local SMTP
+stand-in over TCP. "per-message" sends each with `EmailMultiAlternatives.send`
+(a new connection per email, as the old `_send_email` task did); "queued"
+stores them with `accounts.mail.queue_email` and sends them with
+`send_queued_mail`, one connection per `--batch-size` messages.
+`--handshake-ms` delays the server greeting to stand in for a remote server's
+connect and TLS handshake.
+"""
+import argparse
+import json
+import socketserver
+import threading
+import time
+from unittest import mock
+
+from benchmarks import setup, test_database
+
+HTML_BODY = "<p>Hi Bench,</p><p>Reset your password: <a href=\"?token=0123456789abcdef\">here</a></p>" * 10
+TEXT_BODY = "Hi Bench,\nReset your password: ?token=0123456789abcdef\n" * 10
+
+
+class SMTPSink(socketserver.StreamRequestHandler):
+
+    """Minimal SMTP server that accepts and discards every message."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        time.sleep(self.server.handshake)
+        self.reply("220 localhost SMTP sink")
+        for line in self.rfile:
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                self.reply("250 localhost")
+            elif command == b"DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                for data in self.rfile:
+                    if data == b".\r\n":
+                        break
+                with self.server.lock:
+                    self.server.messages += 1
+                self.reply("250 OK")
+            elif command == b"QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+def start_server(handshake):
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SMTPSink)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.handshake = handshake
+    server.connections = server.messages = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(server, send, messages):
+    server.connections = server.messages = 0
+    started = time.perf_counter()
+    send(messages)
+    elapsed = time.perf_counter() - started
+    assert server.messages == messages, (server.messages, messages)
+    return {"messages_per_second": messages / elapsed, "connections": server.connections}
+
+
+def per_message(messages):
+    from django.core.mail import EmailMultiAlternatives
+
+    for i in range(messages):
+        message = EmailMultiAlternatives("Password Reset", TEXT_BODY, None, [f"bench{i}@forumi.com"])
+        message.attach_alternative(HTML_BODY, "text/html")
+        message.send()
+
+
+def queued(batch_size):
+    def send(messages):
+        from accounts import mail
+
+        # Send in this process instead of scheduling a Celery task.
+        with mock.patch.object(mail, "schedule"):
+            for i in range(messages):
+                mail.queue_email("Password Reset", TEXT_BODY, [f"bench{i}@forumi.com"], html_body=HTML_BODY)
+        mail.send_queued_mail(batch_size=batch_size)
+    return send
+
+
+def run(messages, batch_size, handshake):
+    from django.test import override_settings
+
+    server = start_server(handshake)
+    try:
+        with override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST="127.0.0.1", EMAIL_PORT=server.server_address[1],
+            EMAIL_HOST_USER="", EMAIL_HOST_PASSWORD="", EMAIL_USE_TLS=False,
+        ):
+            return {
+                "per-message": measure(server, per_message, messages),
+                "queued": measure(server, queued(batch_size), messages),
+            }
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--handshake-ms", type=float, default=20)
+    parser.add_argument("--output", help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    setup()
+    with test_database():
+        results = run(args.messages, args.batch_size, args.handshake_ms / 1000)
+
+    print(f"{'mode':<12} {'msg/s':>10} {'connections':>12}")
+    for name, row in results.items():
+        print(f"{name:<12} {row['messages_per_second']:>10.1f} {row['connections']:>12}")
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Compare media throughput of Django's `static.serve` and `predict.media.serve`.
+
+    python -m benchmarks.media --size 20 --requests 50
+
+Each mode serves the same random "image" of `--size` MB from a temporary
+directory: "static" is `django.views.static.serve` (what `static()` routes to),
+"streaming" is `predict.media.serve` reading the file in Python, "range" asks it
+for 1 MB ranges, and "x-accel-redirect" only returns the header nginx needs.
+Under gunicorn or uWSGI the streaming mode uses `sendfile()` instead, so its
+figure here is a lower bound.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from benchmarks import setup
+
+MB = 1024 * 1024
+
+
+def measure(view, requests, **headers):
+    from django.test import RequestFactory
+
+    factory = RequestFactory()
+    sent = 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        response = view(factory.get("/media/image.jpg", **headers))
+        assert response.status_code in (200, 206), response.status_code
+        if response.streaming:
+            sent += sum(len(chunk) for chunk in response.streaming_content)
+        response.close()
+    elapsed = time.perf_counter() - started
+    return {"requests_per_second": requests / elapsed, "mb_per_second": sent / MB / elapsed}
+
+
+def run(size, requests):
+    from django.test import override_settings
+    from django.views.static import serve as static_serve
+    from predict import media
+
+    with tempfile.TemporaryDirectory() as root:
+        with open(os.path.join(root, "image.jpg"), "wb") as fh:
+            fh.write(os.urandom(size * MB))
+
+        def static_view(request):
+            return static_serve(request, "image.jpg", document_root=root)
+
+        def media_view(request):
+            return media.serve(request, "image.jpg", root, "media/")
+
+        results = {
+            "static": measure(static_view, requests),
+            "streaming": measure(media_view, requests),
+            "range": measure(media_view, requests, HTTP_RANGE=f"bytes=0-{MB - 1}"),
+        }
+        with override_settings(MEDIA_SERVE_MODE="x-accel-redirect"):
+            results["x-accel-redirect"] = measure(media_view, requests)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=20, help="File size in MB.")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--output", help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    setup()
+    results = run(args.size, args.requests)
+
+    print(f"{'mode':<18} {'req/s':>10} {'MB/s':>10}")
+    for name, row in results.items():
+        print(f"{name:<18} {row['requests_per_second']:>10.1f} {row['mb_per_second']:>10.1f}")
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Compare `/accounts/password-reset/` latency and queued payload size with and without worker-side rendering.
+
+    python -m benchmarks.password_reset --requests 300
+
+"request" renders both email templates in the signal handler and queues the
+bodies, as the handler did before; "worker" queues only the template name and
+context (`accounts.mail.queue_template_email`), leaving rendering to the mail
+worker. The payload is the queued message that the worker later reads. The
+"send" column is the time `send_queued_mail` then takes per email with the
+locmem backend, including any rendering.
+"""
+import argparse
+import json
+import statistics
+import time
+from unittest import mock
+
+from benchmarks import setup, test_database
+
+
+def render_in_request(template, subject, context, to, from_email=None):
+    from django.template.loader import render_to_string
+    from accounts import mail
+
+    return mail.queue_email(
+        subject, render_to_string(f"{template}.txt", context), to,
+        from_email=from_email, html_body=render_to_string(f"{template}.html", context)
+    )
+
+
+def measure(emails):
+    from django.test import override_settings
+    from rest_framework.test import APIClient
+    from accounts import mail
+    from accounts.models import QueuedEmail
+
+    client = APIClient()
+    timings = []
+    for email in emails:
+        started = time.perf_counter()
+        response = client.post("/accounts/password-reset/", {"email": email}, format="json")
+        timings.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.status_code
+    payloads = [len(message.encode()) for message in QueuedEmail.objects.values_list("message", flat=True)]
+
+    with override_settings(EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend"):
+        started = time.perf_counter()
+        totals = mail.send_queued_mail()
+        sending = time.perf_counter() - started
+    assert totals["sent"] == len(emails), totals
+
+    timings.sort()
+    return {
+        "p50_ms": statistics.median(timings) * 1000,
+        "p95_ms": timings[int(len(timings) * 0.95) - 1] * 1000,
+        "payload_bytes": statistics.mean(payloads),
+        "send_ms_per_email": sending / len(emails) * 1000,
+    }
+
+
+def run(requests):
+    from django.contrib.auth.hashers import make_password
+    from accounts import mail
+    from accounts.models import User
+
+    password = make_password("reset-password")
+    User.objects.bulk_create([
+        User(email=f"reset{i}@forumi.com", first_name=f"Reset {i}", password=password) for i in range(2 * requests)
+    ])
+    emails = [f"reset{i}@forumi.com" for i in range(2 * requests)]
+
+    results = {}
+    # Send in this process instead of scheduling a Celery task.
+    with mock.patch.object(mail, "schedule"):
+        with mock.patch.object(mail, "queue_template_email", render_in_request):
+            results["request"] = measure(emails[:requests])
+        results["worker"] = measure(emails[requests:])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--output", help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    setup()
+    with test_database():
+        results = run(args.requests)
+
+    print(f"{'rendering':<10} {'p50 ms':>8} {'p95 ms':>8} {'payload B':>10} {'send ms':>8}")
+    for name, row in results.items():
+        print(
+            f"{name:<10} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} "
+            f"{row['payload_bytes']:>10.0f} {row['send_ms_per_email']:>8.2f}"
+        )
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
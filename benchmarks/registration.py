@@ -0,0 +1,88 @@
+"""
+Measure registrations per second per core for each password hasher profile.
+
+    python -m benchmarks.registration --registrations 200 --profiles pbkdf2 scrypt argon2
+
+Each profile is put first in `PASSWORD_HASHERS` (as `PASSWORD_HASHER` does) and
+`/accounts/register/` is called from a single thread, so the rate is what one
+core sustains. The hashing share shows how much of that is spent in the hasher;
+profiles whose package is missing (argon2 needs argon2-cffi) are skipped.
+"""
+import argparse
+import json
+import time
+
+from benchmarks import setup, test_database
+
+
+def available(hasher_path):
+    from django.contrib.auth.hashers import import_string
+
+    hasher = import_string(hasher_path)()
+    if not hasher.library:
+        return True
+    try:
+        hasher._load_library()
+    except ValueError:
+        return False
+    return True
+
+
+def measure(hasher_path, registrations, offset):
+    from django.contrib.auth.hashers import make_password
+    from django.test import override_settings
+    from rest_framework.test import APIClient
+
+    client = APIClient()
+    with override_settings(PASSWORD_HASHERS=[hasher_path]):
+        started = time.perf_counter()
+        for _ in range(registrations):
+            make_password("registration-password")
+        hashing = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for i in range(offset, offset + registrations):
+            response = client.post("/accounts/register/", {
+                "email": f"register{i}@forumi.com", "first_name": "Register", "password": "registration-password"
+            }, format="json")
+            assert response.status_code == 201, response.data
+        elapsed = time.perf_counter() - started
+    return {
+        "registrations_per_second": registrations / elapsed,
+        "ms_per_registration": elapsed / registrations * 1000,
+        "hashing_share": min(hashing / elapsed, 1.0),
+    }
+
+
+def main():
+    from django.conf import settings
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--registrations", type=int, default=100)
+    parser.add_argument("--profiles", nargs="+", default=["pbkdf2", "scrypt", "argon2"])
+    parser.add_argument("--output", help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    setup()
+    results = {}
+    with test_database():
+        for i, name in enumerate(args.profiles):
+            hasher_path = settings.PASSWORD_HASHER_PROFILES[name]
+            if not available(hasher_path):
+                print(f"Skipping {name}: its hashing library is not installed.")
+                continue
+            results[name] = measure(hasher_path, args.registrations, i * args.registrations)
+
+    print(f"{'profile':<8} {'reg/s/core':>11} {'ms each':>8} {'hashing':>8}")
+    for name, row in results.items():
+        print(
+            f"{name:<8} {row['registrations_per_second']:>11.1f} {row['ms_per_registration']:>8.2f} "
+            f"{row['hashing_share']:>8.0%}"
+        )
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Measure full-text search latency on a seeded dataset.
+
+    python -m benchmarks.search --rows 1000000 --comments-per-discussion 2
+
+Discussions and comments are bulk inserted, the index is rebuilt in one pass
+and every query is run `--repeat` times; the median and p95 are reported.
+"""
+import argparse
+import itertools
+import json
+import random
+import statistics
+import time
+
+from benchmarks import setup, test_database
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "to", "vi", "ze", "po", "da", "fu"]
+QUERIES = ["python", "kubernetes docker", "fintech payments startup", "nonexistentterm"]
+
+
+def vocabulary(rng, size=5000):
+    """Synthetic words with Zipf-like frequencies, plus the benchmark query terms."""
+    words = list(dict.fromkeys(
+        "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(size)
+    ))
+    words[10:10] = ["python", "kubernetes", "docker", "fintech", "payments", "startup"]
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(words) + 1)))
+    return words, cum_weights
+
+
+def sentence(rng, vocab, words):
+    return " ".join(rng.choices(vocab[0], cum_weights=vocab[1], k=words))
+
+
+def seed(rows, comments_per_discussion, batch_size=5000):
+    from accounts.models import User
+    from forums.models import Comment, Discussion
+
+    rng = random.Random(42)
+    vocab = vocabulary(rng)
+    user = User.objects.create(email="bench@forumi.com", first_name="Bench", password="!")
+    # One comment per user and discussion, as `Comment`'s unique constraint requires.
+    User.objects.bulk_create([
+        User(email=f"bench-commenter{i}@forumi.com", first_name=f"Commenter {i}", password="!")
+        for i in range(comments_per_discussion)
+    ])
+    commenters = list(User.objects.filter(email__startswith="bench-commenter"))
+    for start in range(0, rows, batch_size):
+        Discussion.objects.bulk_create([
+            Discussion(user=user, title=sentence(rng, vocab, 6), content=sentence(rng, vocab, 40))
+            for _ in range(start, min(start + batch_size, rows))
+        ])
+
+    ids = list(Discussion.objects.values_list("id", flat=True))
+    for start in range(0, len(ids), batch_size):
+        Comment.objects.bulk_create([
+            Comment(user=commenter, post_id=pk, content=sentence(rng, vocab, 20))
+            for pk in ids[start:start + batch_size] for commenter in commenters
+        ])
+
+
+def run(repeat):
+    from forums import search
+
+    backend = search.get_backend()
+    started = time.perf_counter()
+    backend.rebuild()
+    results = {"backend": type(backend).__name__, "rebuild_s": time.perf_counter() - started, "queries": []}
+
+    for query in QUERIES:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            backend.search(query, limit=20)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        results["queries"].append({
+            "query": query,
+            "p50_ms": statistics.median(timings),
+            "p95_ms": timings[int(len(timings) * 0.95) - 1 if len(timings) > 1 else 0],
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--comments-per-discussion", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    setup()
+    with test_database():
+        seed(args.rows, args.comments_per_discussion)
+        results = run(args.repeat)
+
+    print(f"{results['backend']}: rebuilt index in {results['rebuild_s']:.1f}s")
+    print(f"{'query':<28} {'p50 (ms)':>10} {'p95 (ms)':>10}")
+    for row in results["queries"]:
+        print(f"{row['query']:<28} {row['p50_ms']:>10.2f} {row['p95_ms']:>10.2f}")
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Generate a realistic forum: users, discussions, tags, comments and likes.
+
+    python -m benchmarks.seed --users 1000 --discussions 20000 --yes
+
+Run as a module this seeds the *configured* database (for benchmarking a live
+server with `benchmarks.load --url`), so it asks for `--yes` first. The load
+benchmark calls `seed()` itself against a throwaway test database.
+Every seeded user logs in with `PASSWORD`.
+"""
+import argparse
+import itertools
+import random
+
+from benchmarks import setup
+
+PASSWORD = "benchmark-password"
+EMAIL = "bench{}@forumi.com"
+TAGS = ["python", "django", "health", "fitness", "payments", "startup", "design", "career", "remote", "ai"]
+WORDS = [
+    "forum", "launch", "growth", "question", "product", "market", "idea", "team", "users", "data",
+    "scale", "mobile", "cloud", "budget", "hiring", "advice", "feedback", "release", "pricing", "api",
+]
+
+
+def sentence(rng, words):
+    return " ".join(rng.choices(WORDS, k=words)).capitalize()
+
+
+def _popularity(rng, count):
+    """Zipf-like weights so a few discussions get most of the comments and likes."""
+    ranks = list(range(1, count + 1))
+    rng.shuffle(ranks)
+    return list(itertools.accumulate(1 / rank for rank in ranks))
+
+
+def seed(users=200, discussions=2000, comments_per_discussion=5, likes_per_discussion=10,
+         batch_size=5000, rng_seed=42):
+
+    """Bulk insert the dataset and bring counters and the search index up to date. Returns a summary."""
+    from django.contrib.auth.hashers import make_password
+    from accounts.models import User, UserProfile
+    from forums import search
+    from forums.models import CATEGORY_TYPE, Comment, Discussion, DiscussionTag, Tag, assign_unique_slugs
+
+    rng = random.Random(rng_seed)
+    categories = [value for value, _ in CATEGORY_TYPE]
+    password = make_password(PASSWORD)
+    first_user = User.objects.count()
+    User.objects.bulk_create([
+        User(email=EMAIL.format(first_user + i), first_name=f"Bench {i}", password=password, is_verified=True)
+        for i in range(users)
+    ])
+    user_ids = list(User.objects.filter(email__startswith="bench").values_list("id", flat=True))
+    UserProfile.objects.bulk_create([UserProfile(user_id=pk) for pk in user_ids], ignore_conflicts=True)
+
+    for start in range(0, discussions, batch_size):
+        Discussion.objects.bulk_create(assign_unique_slugs([
+            Discussion(
+                user_id=rng.choice(user_ids), title=sentence(rng, 6), content=sentence(rng, 60),
+                category=rng.choice(categories)
+            )
+            for _ in range(start, min(start + batch_size, discussions))
+        ]))
+    discussion_ids = list(Discussion.objects.values_list("id", flat=True))
+
+    Tag.objects.bulk_create([Tag(name=name) for name in TAGS], ignore_conflicts=True)
+    tag_ids = list(Tag.objects.filter(name__in=TAGS).values_list("id", flat=True))
+    DiscussionTag.objects.bulk_create([
+        DiscussionTag(discussion_id=pk, tag_id=tag_id)
+        for pk in discussion_ids for tag_id in rng.sample(tag_ids, 2)
+    ], ignore_conflicts=True)
+
+    weights = _popularity(rng, len(discussion_ids))
+    total = len(discussion_ids) * comments_per_discussion
+    # The API keeps one comment per user per discussion, so skip repeated pairs.
+    commented = set()
+    for start in range(0, total, batch_size):
+        pairs = {
+            (rng.choice(user_ids), rng.choices(discussion_ids, cum_weights=weights)[0])
+            for _ in range(start, min(start + batch_size, total))
+        } - commented
+        commented |= pairs
+        Comment.objects.bulk_create([
+            Comment(user_id=user_id, post_id=post_id, content=sentence(rng, 20)) for user_id, post_id in pairs
+        ])
+
+    through = Discussion.likes.through
+    total = len(discussion_ids) * likes_per_discussion
+    for start in range(0, total, batch_size):
+        through.objects.bulk_create([
+            through(discussion_id=rng.choices(discussion_ids, cum_weights=weights)[0], user_id=rng.choice(user_ids))
+            for _ in range(start, min(start + batch_size, total))
+        ], ignore_conflicts=True)
+
+    Discussion.objects.reconcile_counters()
+    search.get_backend().rebuild()
+    return {
+        "users": users, "discussions": discussions, "comments": Comment.objects.count(),
+        "likes": through.objects.count(), "first_email": EMAIL.format(first_user)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--discussions", type=int, default=2000)
+    parser.add_argument("--comments-per-discussion", type=int, default=5)
+    parser.add_argument("--likes-per-discussion", type=int, default=10)
+    parser.add_argument("--yes", action="store_true", help="Really write to the configured database.")
+    args = parser.parse_args()
+    if not args.yes:
+        parser.error("this writes to the configured database; pass --yes to continue")
+
+    setup()
+    summary = seed(args.users, args.discussions, args.comments_per_discussion, args.likes_per_discussion)
+    print(f"Seeded {summary}. Log in as {summary['first_email']} / {PASSWORD}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Compare serializing the admin user listing with and without batched profile loading.
+
+    python -m benchmarks.user_listing --users 5000 --page-sizes 20 100 1000
+
+"per-user" serializes a plain `User` queryset, so every profile is one more
+query (the old `get_profile` behaviour); "batched" serializes the dashboard's
+`select_related("profiles")` queryset, which stays at two (page ids, then the page).
+"""
+import argparse
+import json
+import statistics
+import time
+
+from benchmarks import setup, test_database
+
+
+def seed(users, batch_size=5000):
+    from accounts.models import User, UserProfile
+
+    for start in range(0, users, batch_size):
+        User.objects.bulk_create([
+            User(email=f"listing{i}@forumi.com", first_name="Listing", password="!")
+            for i in range(start, min(start + batch_size, users))
+        ])
+    UserProfile.objects.bulk_create(
+        [UserProfile(user_id=pk) for pk in User.objects.values_list("id", flat=True)], batch_size=500
+    )
+
+
+def measure(queryset_factory, page_size, repeat):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from accounts.models import User
+    from accounts.serializers import RetrieveUserSerializer
+
+    timings = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            # Page over bare ids first, like DashboardViewset.list does.
+            ids = list(User.objects.order_by("id").values_list("id", flat=True)[:page_size])
+            RetrieveUserSerializer(list(queryset_factory().filter(id__in=ids)), many=True).data
+            timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), len(context.captured_queries)
+
+
+def run(page_sizes, repeat):
+    from django.db.models import Count
+    from accounts.models import User
+
+    variants = {
+        "per-user": lambda: User.objects.annotate(discussion_count=Count("discussions")),
+        "batched": lambda: User.objects.select_related("profiles").annotate(discussion_count=Count("discussions")),
+    }
+    results = []
+    for page_size in page_sizes:
+        row = {"page_size": page_size}
+        for name, factory in variants.items():
+            row[f"{name}_ms"], row[f"{name}_queries"] = measure(factory, page_size, repeat)
+        results.append(row)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--page-sizes", type=int, nargs="+", default=[20, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    setup()
+    with test_database():
+        seed(args.users)
+        results = run(args.page_sizes, args.repeat)
+
+    print(f"{'page size':>9} {'per-user ms':>12} {'queries':>8} {'batched ms':>11} {'queries':>8}")
+    for row in results:
+        print(
+            f"{row['page_size']:>9} {row['per-user_ms']:>12.2f} {row['per-user_queries']:>8} "
+            f"{row['batched_ms']:>11.2f} {row['batched_queries']:>8}"
+        )
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from forums.models import Discussion, Comment
+from forums.models import Discussion, Comment, Tag
 
 admin.site.register(Discussion)
 admin.site.register(Comment)
+admin.site.register(Tag)
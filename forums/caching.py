@@ -0,0 +1,75 @@
+"""
+Versioned cache of serialized discussion detail responses.
+
+Every discussion has a version number stored in the cache. Payloads are keyed
+by that version, so invalidating a discussion is a single `incr` and stale
+payloads simply stop being read and expire on their own. Versions expire too,
+after `VERSION_TIMEOUT`, and `forget` drops the version of a discussion that
+turned out not to exist.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+VERSION_TIMEOUT = 60 * 60 * 24
+
+def _version_key(discussion_id):
+    return f"forums:discussion:{discussion_id}:version"
+
+
+def get_version(discussion_id):
+    key = _version_key(discussion_id)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock rather than 1 so an evicted counter can never
+        # come back to a version that still has a payload cached under it.
+        cache.add(key, time.time_ns(), VERSION_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def forget(discussion_id):
+    """Drop the version of a discussion that does not exist, so probing ids leaves no keys."""
+    cache.delete(_version_key(discussion_id))
+
+
+def _bump(discussion_ids):
+    for discussion_id in discussion_ids:
+        try:
+            cache.incr(_version_key(discussion_id))
+        except ValueError:
+            # No version means nothing is cached for this discussion yet.
+            pass
+
+
+def invalidate(*discussion_ids):
+    """
+    Drop cached payloads for `discussion_ids`.
+
+    The version is bumped straight away and again on commit, so a concurrent
+    reader that cached the pre-commit row under the new version is discarded too.
+    """
+    _bump(discussion_ids)
+    transaction.on_commit(lambda: _bump(discussion_ids))
+
+
+def _payload_key(discussion_id, version):
+    return f"forums:discussion:{discussion_id}:{version}"
+
+
+def get_payload(discussion_id):
+    """Return `(version, payload)`; `payload` is `{"etag", "data"}` or None on a miss."""
+    version = get_version(discussion_id)
+    return version, cache.get(_payload_key(discussion_id, version))
+
+
+def set_payload(discussion_id, version, data):
+    body = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True).encode()
+    payload = {"etag": '"{}"'.format(hashlib.md5(body).hexdigest()), "data": data}
+    cache.set(_payload_key(discussion_id, version), payload, settings.FORUMS_CACHE_TIMEOUT)
+    return payload
@@ -0,0 +1,20 @@
+import django_filters
+from forums.models import Discussion, CATEGORY_TYPE
+
+
+class DiscussionFilter(django_filters.FilterSet):
+
+    """Filters for the discussion feed; each one is backed by an index on `Discussion`."""
+    category = django_filters.ChoiceFilter(choices=CATEGORY_TYPE)
+    user = django_filters.NumberFilter(field_name="user_id")
+    created_after = django_filters.IsoDateTimeFilter(field_name="created_at", lookup_expr="gte")
+    created_before = django_filters.IsoDateTimeFilter(field_name="created_at", lookup_expr="lte")
+    min_likes = django_filters.NumberFilter(field_name="likes_count", lookup_expr="gte")
+    tag = django_filters.CharFilter(method="filter_tag")
+
+    class Meta:
+        model = Discussion
+        fields = ["category", "user", "created_after", "created_before", "min_likes", "tag"]
+
+    def filter_tag(self, queryset, name, value):
+        return queryset.filter(tags__name=value.strip().lower())
@@ -0,0 +1,127 @@
+"""
+Resized renditions of discussion images.
+
+Uploads are stored untouched; `generate_renditions` (run by the
+`process_discussion_image` Celery task after the discussion is saved) then
+writes WebP and JPEG copies at each of `FORUMS_IMAGE_WIDTHS`, rotated upright
+and without EXIF metadata, and records the original's dimensions. Widths
+larger than the original are capped at its own width, so images are never
+upscaled.
+"""
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Q
+from PIL import Image, ImageOps
+from forums import caching
+from forums.models import Discussion, ImageRendition
+
+FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+MIME_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+def _prepare(image, image_format):
+    if image_format == "jpeg" and image.mode != "RGB":
+        # JPEG has no alpha channel: flatten transparent pixels onto white.
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    if image_format == "webp" and image.mode not in ("RGB", "RGBA"):
+        return image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+    return image
+
+
+def _encode(image, image_format):
+    buffer = BytesIO()
+    # No `exif=` argument, so Pillow writes none of the original metadata.
+    image.save(buffer, FORMATS[image_format], quality=settings.FORUMS_IMAGE_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def _render(discussion, image):
+    width, height = image.size
+    stem = discussion.img.name.rsplit("/", 1)[-1].rsplit(".", 1)[0]
+    renditions = []
+    for target in sorted({min(target, width) for target in settings.FORUMS_IMAGE_WIDTHS}):
+        size = (target, max(round(height * target / width), 1))
+        resized = image if size == image.size else image.resize(size, Image.LANCZOS)
+        for image_format in FORMATS:
+            rendition = ImageRendition(
+                discussion=discussion, format=image_format, width=size[0], height=size[1]
+            )
+            content = ContentFile(_encode(_prepare(resized, image_format), image_format))
+            rendition.file.save(f"{stem}-{target}w.{image_format}", content, save=False)
+            renditions.append(rendition)
+    return renditions
+
+
+def _delete_files(renditions):
+    for rendition in renditions:
+        rendition.file.delete(save=False)
+
+
+def generate_renditions(discussion_id):
+
+    """
+    (Re)build the renditions of a discussion's current image. Returns how many were written.
+
+    Safe to run more than once. If the image changes while this runs, the new
+    files are discarded and the task queued for the new image wins.
+    """
+    discussion = Discussion.objects.filter(pk=discussion_id).first()
+    if discussion is None:
+        return 0
+    old = list(discussion.renditions.all())
+    renditions, size = [], (None, None)
+    if discussion.img:
+        with discussion.img.open("rb") as fh, Image.open(fh) as original:
+            image = ImageOps.exif_transpose(original)
+            size = image.size
+            renditions = _render(discussion, image)
+
+    current = Discussion.objects.filter(pk=discussion_id)
+    if discussion.img:
+        current = current.filter(img=discussion.img.name)
+    else:
+        current = current.filter(Q(img__isnull=True) | Q(img=""))
+    with transaction.atomic():
+        if not current.update(img_width=size[0], img_height=size[1]):
+            transaction.on_commit(lambda: _delete_files(renditions))
+            return 0
+        ImageRendition.objects.filter(pk__in=[rendition.pk for rendition in old]).delete()
+        ImageRendition.objects.bulk_create(renditions)
+        caching.invalidate(discussion_id)
+        transaction.on_commit(lambda: _delete_files(old))
+    return len(renditions)
+
+
+def get_srcset(discussion, request=None):
+
+    """
+    Return `{mime type: srcset}` for the discussion's image, e.g.
+    `{"image/webp": "https://.../a-320w.webp 320w, ...", "image/jpeg": ...}`,
+    ready for `<picture><source type=... srcset=...>`. Empty until processed.
+    """
+    if not discussion.img:
+        return {}
+    srcset = {}
+    for rendition in sorted(discussion.renditions.all(), key=lambda rendition: rendition.width):
+        url = rendition.file.url
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        srcset.setdefault(MIME_TYPES[rendition.format], []).append(f"{url} {rendition.width}w")
+    return {mime_type: ", ".join(entries) for mime_type, entries in srcset.items()}
+
+
+def absolute_srcset(srcset, request):
+    """Make the URLs of a `get_srcset` map built without a request absolute for `request`'s host."""
+    return {
+        mime_type: ", ".join(
+            "{} {}".format(request.build_absolute_uri(url), width)
+            for url, width in (entry.rsplit(" ", 1) for entry in entries.split(", "))
+        )
+        for mime_type, entries in srcset.items()
+    }
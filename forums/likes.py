@@ -0,0 +1,197 @@
+"""
+Write-behind buffer for likes, enabled with `FORUMS_LIKE_BUFFERING`.
+
+A like or unlike is recorded in the cache instead of the likes table:
+
+* `state:<discussion>:<user>` holds the user's latest intent, so repeated
+  toggles see their own effect before anything reaches the database;
+* a journal of numbered entries (`entry:<n>`, `seq`) lists the changes in
+  order for `flush_likes`;
+* `delta:<discussion>` is the not yet flushed change to `likes_count`, which
+  `Discussion.get_likes_count` adds to the persisted count.
+
+`flush_likes` (run periodically by Celery) coalesces the journal to each
+user's final state, writes it with one `bulk_create(ignore_conflicts=True)`
+and one bulk DELETE, then recomputes the touched counters from the table.
+Likes of discussions or users deleted since they were buffered are dropped,
+and should the bulk insert still hit a missing row, the likes are inserted one
+by one so that only the bad ones are lost.
+Use a shared cache whose `incr` accepts negative results (Redis, file or
+database) in production; locmem is per process and Memcached clamps at zero.
+"""
+import logging
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from forums import caching
+
+SEQ_KEY = "forums:likes:seq"
+FLUSHED_KEY = "forums:likes:flushed"
+GAP_KEY = "forums:likes:gap"
+LOCK_KEY = "forums:likes:flush-lock"
+STATE_TIMEOUT = 60 * 60 * 24
+
+logger = logging.getLogger(__name__)
+
+
+def _state_key(discussion_id, user_id):
+    return f"forums:likes:state:{discussion_id}:{user_id}"
+
+
+def _delta_key(discussion_id):
+    return f"forums:likes:delta:{discussion_id}"
+
+
+def _entry_key(seq):
+    return f"forums:likes:entry:{seq}"
+
+
+def _incr(key, delta):
+    cache.add(key, 0, None)
+    if delta > 0:
+        return cache.incr(key, delta)
+    if delta < 0:
+        return cache.decr(key, -delta)
+    return cache.get(key, 0)
+
+
+def is_enabled():
+    return settings.FORUMS_LIKE_BUFFERING
+
+
+def pending_deltas(discussion_ids):
+    """Return `{discussion_id: delta}` of buffered but unflushed like changes."""
+    keys = {_delta_key(pk): pk for pk in discussion_ids}
+    return {keys[key]: delta for key, delta in cache.get_many(keys).items()}
+
+
+def record_like(discussion_id, user_id, liked=None):
+    """
+    Buffer `user_id` liking (`True`), unliking (`False`) or toggling (`None`) a discussion.
+
+    Returns `(liked, likes_count)` as the user should see it, or None when the
+    discussion does not exist.
+    """
+    from forums.models import Discussion
+
+    persisted = Discussion.objects.filter(pk=discussion_id).values_list("likes_count", flat=True).first()
+    if persisted is None:
+        return None
+
+    state_key = _state_key(discussion_id, user_id)
+    current = cache.get(state_key)
+    if current is None:
+        current = Discussion.likes.through.objects.filter(
+            discussion_id=discussion_id, user_id=user_id
+        ).exists()
+    liked = not current if liked is None else liked
+    change = int(liked) - int(current)
+
+    cache.set(state_key, liked, STATE_TIMEOUT)
+    if change:
+        seq = _incr(SEQ_KEY, 1)
+        cache.set(_entry_key(seq), (discussion_id, user_id, liked, change), None)
+        delta = _incr(_delta_key(discussion_id), change)
+        caching.invalidate(discussion_id)
+    else:
+        delta = cache.get(_delta_key(discussion_id), 0)
+    return liked, max(persisted + delta, 0)
+
+
+def _read_journal(start, end):
+    """Return the entries `start..end` in order, stopping at an entry still being written."""
+    keys = [_entry_key(seq) for seq in range(start, end + 1)]
+    found = cache.get_many(keys)
+    entries = []
+    for seq, key in enumerate(keys, start):
+        if key not in found:
+            # A writer took this number but has not stored the entry yet. Wait
+            # for it once; if it is still missing next flush, the writer died.
+            if cache.get(GAP_KEY) != seq:
+                cache.set(GAP_KEY, seq, None)
+                return entries, seq - 1
+            continue
+        entries.append(found[key])
+    return entries, end
+
+
+def _existing(through, pairs):
+    """Return the `(discussion_id, user_id)` pairs whose discussion and user both still exist."""
+    if not pairs:
+        return pairs
+    discussion_model = through._meta.get_field("discussion").related_model
+    user_model = through._meta.get_field("user").related_model
+    discussions = set(discussion_model.objects.filter(pk__in={d for d, _ in pairs}).values_list("pk", flat=True))
+    users = set(user_model.objects.filter(pk__in={u for _, u in pairs}).values_list("pk", flat=True))
+    existing = [(d, u) for d, u in pairs if d in discussions and u in users]
+    if len(existing) < len(pairs):
+        logger.warning("Dropping %d buffered likes of deleted discussions or users", len(pairs) - len(existing))
+    return existing
+
+
+def _create_likes(through, rows):
+    # Foreign keys are checked at commit; check them per savepoint instead so a
+    # row deleted since `_existing` only costs its own like.
+    if not rows:
+        return
+    try:
+        with transaction.atomic():
+            through.objects.bulk_create(rows, ignore_conflicts=True)
+            connection.check_constraints(table_names=[through._meta.db_table])
+        return
+    except IntegrityError:
+        pass
+    for row in rows:
+        try:
+            with transaction.atomic():
+                through.objects.bulk_create([row], ignore_conflicts=True)
+                connection.check_constraints(table_names=[through._meta.db_table])
+        except IntegrityError as error:
+            logger.warning(
+                "Dropping buffered like of discussion %s by user %s: %s", row.discussion_id, row.user_id, error
+            )
+
+
+def flush_likes(batch_size=None):
+    """Write buffered likes to the database. Returns the number of journal entries applied."""
+    from forums.models import Discussion
+
+    if not cache.add(LOCK_KEY, True, 300):
+        return 0
+    try:
+        flushed = cache.get(FLUSHED_KEY, 0)
+        end = min(cache.get(SEQ_KEY, 0), flushed + (batch_size or settings.FORUMS_LIKE_FLUSH_BATCH))
+        if end <= flushed:
+            return 0
+        entries, end = _read_journal(flushed + 1, end)
+        if end <= flushed:
+            return 0
+
+        final, applied = {}, {}
+        for discussion_id, user_id, liked, change in entries:
+            final[discussion_id, user_id] = liked
+            applied[discussion_id] = applied.get(discussion_id, 0) + change
+
+        through = Discussion.likes.through
+        liked = [
+            through(discussion_id=d, user_id=u)
+            for d, u in _existing(through, [pair for pair, state in final.items() if state])
+        ]
+        unliked = [Q(discussion_id=d, user_id=u) for (d, u), state in final.items() if not state]
+        with transaction.atomic():
+            _create_likes(through, liked)
+            if unliked:
+                through.objects.filter(reduce(or_, unliked)).delete()
+            Discussion.objects.filter(pk__in=applied).reconcile_counters()
+
+        for discussion_id, change in applied.items():
+            _incr(_delta_key(discussion_id), -change)
+        cache.delete_many([_entry_key(seq) for seq in range(flushed + 1, end + 1)])
+        cache.set(FLUSHED_KEY, end, None)
+        return len(entries)
+    finally:
+        cache.delete(LOCK_KEY)
@@ -0,0 +1,166 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+from forums import search
+from forums.models import Comment, Discussion, DiscussionTag, Tag, assign_unique_slugs
+
+
+@contextmanager
+def keep_timestamps(*models):
+    """Let `bulk_create` store the imported `created_at`/`updated_at` instead of now."""
+    fields = [
+        field for model in models for field in model._meta.fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+
+    """
+    Bulk load JSON Lines produced by export_forum (or a legacy converter).
+
+    Records are `{"type": "discussion" | "tag" | "comment" | "like", ...}`, with
+    parents before children and ids preserved. Every batch is written in one
+    transaction with `bulk_create`, then a checkpoint records the last line
+    committed, so an interrupted import resumes where it stopped. Rows that
+    already exist are skipped, which keeps re-running a batch harmless. A
+    comment by a user who already commented on that discussion is skipped as
+    well (one comment per user and discussion); those are counted and their ids
+    reported.
+    """
+    help = "Import discussions, tags, comments and likes from a JSON Lines file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="JSON Lines file written by export_forum.")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--checkpoint", help="Progress file; defaults to <input>.checkpoint.")
+
+    def handle(self, *args, **options):
+        checkpoint = options["checkpoint"] or f"{options['input']}.checkpoint"
+        done = self._read_checkpoint(checkpoint)
+        if done:
+            self.stdout.write(f"Resuming after line {done}.")
+
+        started, rows, batch = time.perf_counter(), 0, []
+        self.duplicate_comments = []
+        with open(options["input"]) as fh, keep_timestamps(Discussion, Comment):
+            for line_number, line in enumerate(fh, 1):
+                if line_number <= done or not line.strip():
+                    continue
+                batch.append(self._parse(line, line_number))
+                if len(batch) >= options["batch_size"]:
+                    rows += self._write_batch(batch)
+                    self._write_checkpoint(checkpoint, line_number)
+                    batch = []
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(f"{rows} rows, {rows / elapsed:.0f} rows/s")
+            if batch:
+                rows += self._write_batch(batch)
+
+        fixed = Discussion.objects.reconcile_counters()
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                no_style(), [Discussion, Comment, Tag, DiscussionTag, Discussion.likes.through]
+            ):
+                cursor.execute(sql)
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {rows} rows in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):.0f} rows/s); "
+            f"reconciled {fixed} counter(s)."
+        ))
+        if self.duplicate_comments:
+            self.stdout.write(self.style.WARNING(
+                f"Skipped {len(self.duplicate_comments)} comment(s) by users who had already commented on the "
+                f"discussion: ids {', '.join(map(str, sorted(self.duplicate_comments)))}."
+            ))
+
+    def _read_checkpoint(self, path):
+        if not os.path.exists(path):
+            return 0
+        with open(path) as fh:
+            return int(fh.read().strip() or 0)
+
+    def _write_checkpoint(self, path, line_number):
+        with open(f"{path}.tmp", "w") as fh:
+            fh.write(str(line_number))
+        os.replace(f"{path}.tmp", path)
+
+    def _parse(self, line, line_number):
+        try:
+            record = json.loads(line)
+            if record["type"] not in ("discussion", "tag", "comment", "like"):
+                raise ValueError(f"unknown record type {record['type']!r}")
+        except (KeyError, TypeError, ValueError) as error:
+            raise CommandError(f"Line {line_number}: {error}")
+        return record
+
+    def _timestamps(self, record):
+        now = timezone.now()
+        field = Discussion._meta.get_field("created_at")
+        return {
+            "created_at": field.to_python(record.get("created_at")) or now,
+            "updated_at": field.to_python(record.get("updated_at")) or now,
+        }
+
+    @transaction.atomic
+    def _write_batch(self, batch):
+        discussions = [
+            Discussion(
+                id=record["id"], user_id=record["user"], title=record["title"],
+                slug=record.get("slug"), content=record["content"], img=record.get("img") or "",
+                category=record.get("category") or "Others", **self._timestamps(record)
+            )
+            for record in batch if record["type"] == "discussion"
+        ]
+        comments = [
+            Comment(
+                id=record["id"], user_id=record["user"], post_id=record["post"],
+                content=record["content"], **self._timestamps(record)
+            )
+            for record in batch if record["type"] == "comment"
+        ]
+        tags = [record for record in batch if record["type"] == "tag"]
+        likes = [record for record in batch if record["type"] == "like"]
+
+        Discussion.objects.bulk_create(assign_unique_slugs(discussions), ignore_conflicts=True)
+        if tags:
+            names = {record["name"].strip().lower() for record in tags}
+            Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+            tag_ids = dict(Tag.objects.filter(name__in=names).values_list("name", "id"))
+            DiscussionTag.objects.bulk_create([
+                DiscussionTag(discussion_id=record["discussion"], tag_id=tag_ids[record["name"].strip().lower()])
+                for record in tags
+            ], ignore_conflicts=True)
+        Comment.objects.bulk_create(comments, ignore_conflicts=True)
+        # An existing id is a re-run; a missing one lost to the (user, post) constraint.
+        ids = {comment.pk for comment in comments}
+        imported = set(Comment.objects.filter(pk__in=ids).values_list("pk", flat=True))
+        self.duplicate_comments.extend(ids - imported)
+        Discussion.likes.through.objects.bulk_create([
+            Discussion.likes.through(discussion_id=record["discussion"], user_id=record["user"])
+            for record in likes
+        ], ignore_conflicts=True)
+
+        backend = search.get_backend()
+        backend.index_discussions(
+            {discussion.pk for discussion in discussions} | {record["discussion"] for record in tags}
+        )
+        backend.index_comments(imported)
+        return len(batch)
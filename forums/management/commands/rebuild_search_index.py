@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+from forums import search
+
+
+class Command(BaseCommand):
+
+    """Rebuild the discussion/comment full-text index from scratch."""
+    help = "Repopulate the forums search index from the discussion and comment tables."
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        search.get_backend().rebuild()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt in {elapsed:.2f}s."))
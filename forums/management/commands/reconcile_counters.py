@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from forums.models import Discussion
+
+
+class Command(BaseCommand):
+
+    """Recompute denormalized like and comment counters that have drifted."""
+    help = "Fix Discussion.likes_count and Discussion.comments_count drift in bulk."
+
+    def handle(self, *args, **options):
+        fixed = Discussion.objects.reconcile_counters()
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {fixed} discussion(s)."))
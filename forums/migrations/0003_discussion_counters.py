@@ -0,0 +1,42 @@
+# Generated by Django 3.0.5 on 2026-10-18 11:03
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Discussion = apps.get_model("forums", "Discussion")
+    Comment = apps.get_model("forums", "Comment")
+    likes = Subquery(
+        Discussion.likes.through.objects.filter(discussion=OuterRef("pk"))
+        .order_by().values("discussion").annotate(total=Count("*")).values("total"),
+        output_field=IntegerField()
+    )
+    comments = Subquery(
+        Comment.objects.filter(post=OuterRef("pk"))
+        .order_by().values("post").annotate(total=Count("*")).values("total"),
+        output_field=IntegerField()
+    )
+    Discussion.objects.update(likes_count=Coalesce(likes, 0), comments_count=Coalesce(comments, 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forums', '0002_auto_20211026_2231'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discussion',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='discussion',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.0.5 on 2026-10-18 11:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forums', '0003_discussion_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='discussion',
+            index=models.Index(fields=['-created_at', '-id'], name='forums_disc_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='discussion',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='forums_disc_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.5 on 2026-10-18 11:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forums', '0004_discussion_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'created_at', 'id'], name='forums_comment_post_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+from django.db import migrations
+
+CREATE_INDEX = {
+    "postgresql": [
+        """
+        CREATE TABLE forums_search_index (
+            id bigint PRIMARY KEY,
+            discussion_id integer NOT NULL
+                REFERENCES forums_discussion (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+            document tsvector NOT NULL
+        )
+        """,
+        "CREATE INDEX forums_search_index_document ON forums_search_index USING GIN (document)",
+        """
+        INSERT INTO forums_search_index (id, discussion_id, document)
+        SELECT d.id * 2, d.id,
+            setweight(to_tsvector('english', d.title), 'A')
+            || setweight(to_tsvector('english', d.tags), 'A')
+            || setweight(to_tsvector('english', d.content), 'B')
+        FROM forums_discussion d
+        """,
+        """
+        INSERT INTO forums_search_index (id, discussion_id, document)
+        SELECT c.id * 2 + 1, c.post_id, setweight(to_tsvector('english', c.content), 'C')
+        FROM forums_comment c
+        """,
+    ],
+    "sqlite": [
+        """
+        CREATE VIRTUAL TABLE forums_search_index USING fts5(
+            discussion_id UNINDEXED, title, content, tags, comment, tokenize = 'porter unicode61'
+        )
+        """,
+        """
+        INSERT INTO forums_search_index (rowid, discussion_id, title, content, tags, comment)
+        SELECT d.id * 2, d.id, d.title, d.content, d.tags, '' FROM forums_discussion d
+        """,
+        """
+        INSERT INTO forums_search_index (rowid, discussion_id, title, content, tags, comment)
+        SELECT c.id * 2 + 1, c.post_id, '', '', '', c.content FROM forums_comment c
+        """,
+    ],
+}
+
+
+def create_search_index(apps, schema_editor):
+    for statement in CREATE_INDEX.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_INDEX:
+        schema_editor.execute("DROP TABLE forums_search_index")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forums', '0005_comment_post_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.0.5 on 2026-10-18 11:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forums', '0006_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DiscussionTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('discussion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='discussion_tags', to='forums.Discussion')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='discussion_tags', to='forums.Tag')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='discussiontag',
+            index=models.Index(fields=['tag', 'discussion'], name='forums_disctag_tag_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='discussiontag',
+            constraint=models.UniqueConstraint(fields=('discussion', 'tag'), name='forums_unique_discussion_tag'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+
+def copy_tags(apps, schema_editor):
+    Discussion = apps.get_model("forums", "Discussion")
+    Tag = apps.get_model("forums", "Tag")
+    DiscussionTag = apps.get_model("forums", "DiscussionTag")
+
+    tagged = {}
+    for pk, tags in Discussion.objects.exclude(tags="").values_list("pk", "tags").iterator():
+        names = (name.strip().lower()[:50] for name in tags.split(","))
+        tagged[pk] = list(dict.fromkeys(name for name in names if name))
+
+    names = {name for discussion_tags in tagged.values() for name in discussion_tags}
+    Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+    tag_ids = dict(Tag.objects.values_list("name", "pk"))
+    DiscussionTag.objects.bulk_create([
+        DiscussionTag(discussion_id=pk, tag_id=tag_ids[name])
+        for pk, discussion_tags in tagged.items() for name in discussion_tags
+    ], batch_size=1000, ignore_conflicts=True)
+
+
+def restore_tags(apps, schema_editor):
+    Discussion = apps.get_model("forums", "Discussion")
+    DiscussionTag = apps.get_model("forums", "DiscussionTag")
+
+    tagged = {}
+    for pk, name in DiscussionTag.objects.values_list("discussion_id", "tag__name").iterator():
+        tagged.setdefault(pk, []).append(name)
+    for pk, names in tagged.items():
+        Discussion.objects.filter(pk=pk).update(tags=", ".join(names)[:70])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forums', '0007_tag_discussiontag'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_tags, restore_tags),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forums', '0008_copy_tags'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='discussion',
+            name='tags',
+        ),
+        migrations.AddField(
+            model_name='discussion',
+            name='tags',
+            field=models.ManyToManyField(blank=True, related_name='discussions', through='forums.DiscussionTag', to='forums.Tag'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.0.5 on 2026-10-18 11:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forums', '0009_discussion_tags_m2m'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='discussion',
+            index=models.Index(fields=['category', '-created_at', '-id'], name='forums_disc_cat_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='discussion',
+            index=models.Index(fields=['-likes_count', '-id'], name='forums_disc_likes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='discussion',
+            index=models.Index(fields=['-comments_count', '-id'], name='forums_disc_comments_idx'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 3.0.5 on 2026-10-18 11:41
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+# Search index row key column per vendor (see 0006_search_index); comment rows are `2 * id + 1`.
+SEARCH_ROW_COLUMN = {"postgresql": "id", "sqlite": "rowid"}
+
+
+def remove_search_rows(connection, comment_ids):
+    column = SEARCH_ROW_COLUMN.get(connection.vendor)
+    row_ids = [comment_id * 2 + 1 for comment_id in comment_ids]
+    if column is None or not row_ids:
+        return
+    with connection.cursor() as cursor:
+        for start in range(0, len(row_ids), 500):
+            chunk = row_ids[start:start + 500]
+            cursor.execute(
+                f"DELETE FROM forums_search_index WHERE {column} IN ({', '.join(['%s'] * len(chunk))})", chunk
+            )
+
+
+def remove_duplicate_comments(apps, schema_editor):
+    """Keep only the newest comment of each user on each discussion, then fix the counters and search index."""
+    Comment = apps.get_model("forums", "Comment")
+    Discussion = apps.get_model("forums", "Discussion")
+
+    duplicated = (
+        Comment.objects.order_by().values("user", "post")
+        .annotate(keep=Max("id"), total=Count("id")).filter(total__gt=1)
+    )
+    posts, removed = set(), []
+    for row in list(duplicated):
+        duplicates = Comment.objects.filter(user=row["user"], post=row["post"]).exclude(id=row["keep"])
+        removed.extend(duplicates.values_list("id", flat=True))
+        duplicates.delete()
+        posts.add(row["post"])
+    if not posts:
+        return
+
+    # Only the removed comments' rows go stale: the affected posts' index then
+    # matches a rebuild without reindexing every discussion.
+    remove_search_rows(schema_editor.connection, removed)
+
+    comments = Subquery(
+        Comment.objects.filter(post=OuterRef("pk"))
+        .order_by().values("post").annotate(total=Count("*")).values("total"),
+        output_field=IntegerField()
+    )
+    Discussion.objects.filter(pk__in=posts).update(comments_count=Coalesce(comments, 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forums', '0010_discussion_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_comments, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='comment',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='forums_unique_comment_user_post'),
+        ),
+    ]
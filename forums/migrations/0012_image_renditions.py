@@ -0,0 +1,39 @@
+# Generated by Django 3.0.5 on 2026-10-18 11:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forums', '0011_comment_unique_user_post'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discussion',
+            name='img_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='discussion',
+            name='img_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='ImageRendition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.ImageField(max_length=255, upload_to='images/discussion/renditions/%Y/%m/%d/')),
+                ('format', models.CharField(choices=[('webp', 'WebP'), ('jpeg', 'JPEG')], max_length=10)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('discussion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='forums.Discussion')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='imagerendition',
+            constraint=models.UniqueConstraint(fields=('discussion', 'format', 'width'), name='forums_unique_image_rendition'),
+        ),
+    ]
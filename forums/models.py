@@ -1,5 +1,18 @@
+import heapq
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.core.cache import cache
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from forums import caching, likes, search
+from django.utils import timezone
+from django.utils.crypto import get_random_string
 from django.utils.text import slugify
 
 User = get_user_model()
@@ -17,6 +30,51 @@ CATEGORY_TYPE = (
     ("Others", "Others")
 )
 
+MAX_TAGS = 10
+
+SLUG_SUFFIX_LENGTH = 6
+SLUG_SUFFIX_CHARS = "abcdefghijklmnopqrstuvwxyz0123456789"
+SLUG_MAX_ATTEMPTS = 5
+COMMENT_WEIGHT = 2
+HOT_GRAVITY = 1.8
+TOP_WINDOWS = {"day": timedelta(days=1), "week": timedelta(weeks=1)}
+
+
+class DiscussionQuerySet(models.QuerySet):
+
+    def adjust_counters(self, **deltas):
+        """Atomically add `deltas` to counter columns, never going below zero."""
+        return self.update(**{
+            field: Greatest(F(field) + delta, 0) for field, delta in deltas.items()
+        })
+
+    def reconcile_counters(self):
+        """Recompute drifted like/comment counters in bulk. Returns the number of rows fixed."""
+        likes = Subquery(
+            Discussion.likes.through.objects.filter(discussion=OuterRef("pk"))
+            .order_by().values("discussion").annotate(total=Count("*")).values("total"),
+            output_field=IntegerField()
+        )
+        comments = Subquery(
+            Comment.objects.filter(post=OuterRef("pk"))
+            .order_by().values("post").annotate(total=Count("*")).values("total"),
+            output_field=IntegerField()
+        )
+        drifted = self.annotate(
+            actual_likes=Coalesce(likes, 0),
+            actual_comments=Coalesce(comments, 0)
+        ).exclude(likes_count=F("actual_likes"), comments_count=F("actual_comments"))
+
+        ids = list(drifted.values_list("pk", flat=True))
+        if not ids:
+            return 0
+        fixed = Discussion.objects.filter(pk__in=ids).update(
+            likes_count=Coalesce(likes, 0),
+            comments_count=Coalesce(comments, 0)
+        )
+        caching.invalidate(*ids)
+        return fixed
+
 
 class Discussion(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="discussions")
@@ -24,41 +82,113 @@ class Discussion(models.Model):
     slug = models.SlugField(unique=True, null=True, blank=True, editable=False)
     content = models.TextField()
     img = models.ImageField(upload_to="images/discussion/%Y/%m/%d/", null=True, blank=True)
+    # Set by `forums.images.generate_renditions` once the upload has been processed.
+    img_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    img_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
     category = models.CharField(max_length=25, blank=True, default="Others", choices=CATEGORY_TYPE)
-    tags = models.CharField(max_length=70, blank=True, help_text="Separate tags with comma")
+    tags = models.ManyToManyField("Tag", through="DiscussionTag", related_name="discussions", blank=True)
     likes = models.ManyToManyField(User, related_name="likes", blank=True)
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = DiscussionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="forums_disc_created_idx"),
+            models.Index(fields=["user", "-created_at", "-id"], name="forums_disc_user_created_idx"),
+            models.Index(fields=["category", "-created_at", "-id"], name="forums_disc_cat_created_idx"),
+            models.Index(fields=["-likes_count", "-id"], name="forums_disc_likes_idx"),
+            models.Index(fields=["-comments_count", "-id"], name="forums_disc_comments_idx"),
+        ]
+
     def __str__(self):
         return self.title
 
     def get_likes_count(self):
-        return self.likes.count()
+        if likes.is_enabled():
+            return max(self.likes_count + likes.pending_deltas([self.pk]).get(self.pk, 0), 0)
+        return self.likes_count
+
+    def _get_slug_base(self):
+        max_length = self._meta.get_field("slug").max_length - SLUG_SUFFIX_LENGTH - 1
+        return slugify(self.title)[:max_length].strip("-") or "discussion"
+
+    def _get_suffixed_slug(self):
+        return "{}-{}".format(self._get_slug_base(), get_random_string(SLUG_SUFFIX_LENGTH, SLUG_SUFFIX_CHARS))
 
     def _get_unique_slug(self):
-        slug = slugify(self.title)
-        unique_slug = slug
-        num = 1
-        while Discussion.objects.filter(slug=unique_slug).exists():
-            unique_slug = "{}-{}".format(slug, num)
-            num += 1
-        return unique_slug
+        """Return the bare title slug if it is free, else a randomly suffixed one."""
+        slug = self._get_slug_base()
+        if Discussion.objects.filter(slug=slug).exists():
+            return self._get_suffixed_slug()
+        return slug
 
     def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = self._get_unique_slug()
-        super().save(*args, **kwargs)
+        if self.slug:
+            return super().save(*args, **kwargs)
+
+        self.slug = self._get_unique_slug()
+        for attempt in range(SLUG_MAX_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                # Only retry when we lost a race for the slug itself.
+                if attempt + 1 == SLUG_MAX_ATTEMPTS or not Discussion.objects.filter(slug=self.slug).exists():
+                    self.slug = None
+                    raise
+                self.slug = self._get_suffixed_slug()
+
+    def get_latest_comments(self):
+        if hasattr(self, "latest_comments"):
+            return self.latest_comments
+        return list(self.comments.select_related("user").order_by(
+            "-created_at", "-id")[:settings.FORUMS_LATEST_COMMENTS])
 
     def get_tags(self):
-        return self.tags.split(",")
+        return [tag.name for tag in self.tags.all()]
+
+    def set_tags(self, names):
+        """Replace this discussion's tags with `names`, creating missing tags in bulk."""
+        names = parse_tags(names)
+        Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+        self.tags.set(Tag.objects.filter(name__in=names))
+        search.get_backend().index_discussions([self.pk])
+        caching.invalidate(self.pk)
 
     def delete(self, *args, **kwargs):
         if self.img:
             self.img.delete()
+        for rendition in self.renditions.all():
+            rendition.file.delete(save=False)
         super().delete(*args, **kwargs)
 
 
+class ImageRendition(models.Model):
+
+    """A resized, EXIF-free copy of a discussion's image in one format and width."""
+    FORMATS = (("webp", "WebP"), ("jpeg", "JPEG"))
+
+    discussion = models.ForeignKey("Discussion", on_delete=models.CASCADE, related_name="renditions")
+    file = models.ImageField(upload_to="images/discussion/renditions/%Y/%m/%d/", max_length=255)
+    format = models.CharField(max_length=10, choices=FORMATS)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["discussion", "format", "width"], name="forums_unique_image_rendition"
+            ),
+        ]
+
+    def __str__(self):
+        return self.file.name
+
+
 class Comment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="comments")
     post = models.ForeignKey("Discussion", on_delete=models.CASCADE, related_name="comments")
@@ -69,5 +199,341 @@ class Comment(models.Model):
     def __str__(self):
         return self.content
 
+    class Meta:
+        constraints = [
+            # One comment per user per discussion; `upsert_comment` relies on it.
+            models.UniqueConstraint(fields=["user", "post"], name="forums_unique_comment_user_post"),
+        ]
+        indexes = [
+            models.Index(fields=["post", "created_at", "id"], name="forums_comment_post_idx"),
+        ]
+
     def comment_count(self):
         return self.content.count()
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
+class DiscussionTag(models.Model):
+    discussion = models.ForeignKey("Discussion", on_delete=models.CASCADE, related_name="discussion_tags")
+    tag = models.ForeignKey("Tag", on_delete=models.CASCADE, related_name="discussion_tags")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["discussion", "tag"], name="forums_unique_discussion_tag"),
+        ]
+        indexes = [
+            models.Index(fields=["tag", "discussion"], name="forums_disctag_tag_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.discussion_id}:{self.tag_id}"
+
+
+def parse_tags(value):
+
+    """Normalize a comma separated string (or list) of tags to unique lowercase names."""
+    if isinstance(value, str):
+        value = value.split(",")
+    names = (name.strip().lower() for name in value)
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def get_tag_cloud(limit=None):
+
+    """Return `[{"name", "count"}]` for the most used tags, cached for `FORUMS_TAG_CLOUD_TTL` seconds."""
+    limit = settings.FORUMS_TAG_CLOUD_SIZE if limit is None else limit
+    key = f"forums:tag-cloud:{limit}"
+    cloud = cache.get(key)
+    if cloud is None:
+        cloud = list(
+            Tag.objects.annotate(count=Count("discussion_tags")).filter(count__gt=0)
+            .order_by("-count", "name").values("name", "count")[:limit]
+        )
+        cache.set(key, cloud, settings.FORUMS_TAG_CLOUD_TTL)
+    return cloud
+
+
+def assign_unique_slugs(discussions):
+
+    """
+    Give every discussion in `discussions` a unique slug before a `bulk_create`.
+
+    Keeps an existing slug when it is free; the whole batch is checked with one
+    query per round, and only clashing slugs are re-drawn with a random suffix.
+    """
+    pending = list(discussions)
+    for discussion in pending:
+        discussion.slug = discussion.slug or discussion._get_slug_base()
+    seen = set()
+    while pending:
+        taken = set(Discussion.objects.filter(
+            slug__in=[discussion.slug for discussion in pending]
+        ).values_list("slug", flat=True))
+        clashing = []
+        for discussion in pending:
+            if discussion.slug in taken or discussion.slug in seen:
+                discussion.slug = discussion._get_suffixed_slug()
+                clashing.append(discussion)
+            else:
+                seen.add(discussion.slug)
+        pending = clashing
+    return discussions
+
+
+def set_discussion_like(discussion_id, user_id, liked):
+
+    """
+    Make `user_id` like (or stop liking) a discussion, idempotently.
+
+    The like row is written with one `INSERT ... ON CONFLICT DO NOTHING` or
+    `DELETE`, and the counter is only touched when that changed a row, so
+    concurrent or repeated requests can never double count. Bypasses
+    `m2m_changed`, so it adjusts the counter and the detail cache itself.
+    Returns `(changed, likes_count)`, or None when the discussion does not exist.
+    """
+    through = Discussion.likes.through
+    with transaction.atomic(), connection.cursor() as cursor:
+        if liked:
+            cursor.execute(f"""
+                INSERT INTO {through._meta.db_table} (discussion_id, user_id)
+                SELECT %s, %s WHERE EXISTS (SELECT 1 FROM {Discussion._meta.db_table} WHERE id = %s)
+                ON CONFLICT DO NOTHING
+            """, [discussion_id, user_id, discussion_id])
+            changed = cursor.rowcount
+        else:
+            changed, _ = through.objects.filter(discussion_id=discussion_id, user_id=user_id).delete()
+
+        if changed:
+            delta = 1 if liked else -1
+            cursor.execute(f"""
+                UPDATE {Discussion._meta.db_table} SET likes_count = likes_count + %s
+                WHERE id = %s RETURNING likes_count
+            """, [delta, discussion_id])
+            caching.invalidate(discussion_id)
+        else:
+            cursor.execute(
+                f"SELECT likes_count FROM {Discussion._meta.db_table} WHERE id = %s", [discussion_id]
+            )
+        row = cursor.fetchone()
+    return None if row is None else (bool(changed), row[0])
+
+
+def upsert_comment(discussion_id, user_id, content):
+    """
+    Create `user_id`'s comment on a discussion, or replace its content.
+
+    `INSERT ... ON CONFLICT (user, post) DO NOTHING RETURNING` creates the
+    comment; when it returns no row, an `UPDATE ... RETURNING` replaces the
+    existing one, so which statement returned the row says whether it was
+    created and concurrent submissions still end up as a single row. Like
+    `set_discussion_like` it bypasses `post_save`, so it keeps the counter,
+    search index and detail cache up to date itself. Returns
+    `(comment, created, comments_count)`, or None when the discussion does not exist.
+    """
+    now = Comment._meta.get_field("created_at").get_db_prep_value(timezone.now(), connection)
+    table = Comment._meta.db_table
+    columns = "id, user_id, post_id, content, created_at, updated_at"
+    with transaction.atomic():
+        while True:
+            comments = list(Comment.objects.raw(f"""
+                INSERT INTO {table} (user_id, post_id, content, created_at, updated_at)
+                SELECT %s, %s, %s, %s, %s WHERE EXISTS (SELECT 1 FROM {Discussion._meta.db_table} WHERE id = %s)
+                ON CONFLICT (user_id, post_id) DO NOTHING
+                RETURNING {columns}
+            """, [user_id, discussion_id, content, now, now, discussion_id]))
+            created = bool(comments)
+            if not created:
+                comments = list(Comment.objects.raw(f"""
+                    UPDATE {table} SET content = %s, updated_at = %s WHERE user_id = %s AND post_id = %s
+                    RETURNING {columns}
+                """, [content, now, user_id, discussion_id]))
+            if comments:
+                break
+            if not Discussion.objects.filter(pk=discussion_id).exists():
+                return None
+            # The conflicting comment was deleted in between: insert again.
+        comment = comments[0]
+        with connection.cursor() as cursor:
+            if created:
+                cursor.execute(f"""
+                    UPDATE {Discussion._meta.db_table} SET comments_count = comments_count + 1
+                    WHERE id = %s RETURNING comments_count
+                """, [discussion_id])
+            else:
+                cursor.execute(
+                    f"SELECT comments_count FROM {Discussion._meta.db_table} WHERE id = %s", [discussion_id]
+                )
+            comments_count = cursor.fetchone()[0]
+        search.get_backend().index_comments([comment.pk])
+        caching.invalidate(discussion_id)
+    return comment, created, comments_count
+
+
+def _ranked_feed_key(name):
+    return f"forums:feed:{name}"
+
+
+def rank_discussions(now=None):
+
+    """
+    Score discussions for the `hot` and `top:<window>` feeds and cache the ranked ids.
+
+    Hot decays engagement with age: `(likes + 2 * comments + 1) / (age_hours + 2) ** 1.8`
+    over the last `FORUMS_HOT_WINDOW_DAYS`. Top is plain engagement within each window.
+    """
+    now = timezone.now() if now is None else now
+    size = settings.FORUMS_RANKED_FEED_SIZE
+
+    def hot_score(row):
+        pk, likes, comments, created_at = row
+        age_hours = max((now - created_at).total_seconds(), 0) / 3600
+        return (likes + COMMENT_WEIGHT * comments + 1) / (age_hours + 2) ** HOT_GRAVITY, pk
+
+    candidates = Discussion.objects.filter(
+        created_at__gte=now - timedelta(days=settings.FORUMS_HOT_WINDOW_DAYS)
+    ).values_list("id", "likes_count", "comments_count", "created_at")
+    feeds = {"hot": [row[0] for row in heapq.nlargest(size, candidates.iterator(), key=hot_score)]}
+
+    for window, age in TOP_WINDOWS.items():
+        feeds[f"top:{window}"] = list(
+            Discussion.objects.filter(created_at__gte=now - age)
+            .annotate(score=F("likes_count") + COMMENT_WEIGHT * F("comments_count"))
+            .order_by("-score", "-id").values_list("id", flat=True)[:size]
+        )
+
+    cache.set_many(
+        {_ranked_feed_key(name): ids for name, ids in feeds.items()}, settings.FORUMS_RANKED_FEED_TTL
+    )
+    return feeds
+
+
+def get_ranked_feed(name):
+    """Return the cached ids of ranked feed `name`, or None when it has not been computed yet."""
+    return cache.get(_ranked_feed_key(name))
+
+
+def prefetch_renditions(discussions):
+
+    """Prefetch image renditions, skipping the query when no discussion has an image."""
+    discussions = list(discussions)
+    models.prefetch_related_objects([discussion for discussion in discussions if discussion.img], "renditions")
+    return discussions
+
+
+def prefetch_latest_comments(discussions, limit=None):
+
+    """
+    Attach the newest `limit` comments of each discussion as `latest_comments`.
+
+    Uses one query built from a UNION ALL of per-discussion `LIMIT` selects, so
+    each discussion costs a single index seek however many comments it has.
+    """
+    limit = settings.FORUMS_LATEST_COMMENTS if limit is None else limit
+    discussions = list(discussions)
+    if not discussions:
+        return discussions
+
+    selects, params = [], []
+    for i, discussion in enumerate(discussions):
+        latest = Comment.objects.filter(post_id=discussion.pk).order_by("-created_at", "-id")
+        sql, latest_params = latest.values("id")[:limit].query.sql_with_params()
+        selects.append(f"SELECT * FROM ({sql}) AS latest_{i}")
+        params.extend(latest_params)
+
+    comments = Comment.objects.filter(
+        id__in=RawSQL(" UNION ALL ".join(selects), params)
+    ).select_related("user").order_by("-created_at", "-id")
+
+    by_post = {discussion.pk: [] for discussion in discussions}
+    for comment in comments:
+        by_post[comment.post_id].append(comment)
+    for discussion in discussions:
+        discussion.latest_comments = by_post[discussion.pk]
+    return discussions
+
+
+@receiver(m2m_changed, sender=Discussion.likes.through)
+def update_likes_count(sender, instance, action, reverse, pk_set, **kwargs):
+
+    """Keep `Discussion.likes_count` in step with the likes table, whichever side edits it."""
+    if action == "pre_clear" and reverse:
+        instance._cleared_discussion_ids = list(instance.likes.values_list("pk", flat=True))
+    elif action == "post_clear":
+        if reverse:
+            discussions = Discussion.objects.filter(pk__in=instance._cleared_discussion_ids)
+            discussions.adjust_counters(likes_count=-1)
+        else:
+            Discussion.objects.filter(pk=instance.pk).update(likes_count=0)
+    elif action in ("post_add", "post_remove") and pk_set:
+        delta = 1 if action == "post_add" else -1
+        if reverse:
+            Discussion.objects.filter(pk__in=pk_set).adjust_counters(likes_count=delta)
+        else:
+            Discussion.objects.filter(pk=instance.pk).adjust_counters(likes_count=delta * len(pk_set))
+
+
+@receiver(pre_delete, sender=User)
+def decrement_liked_likes_count(sender, instance, **kwargs):
+
+    """Deleting a user cascades to their likes without `m2m_changed`; uncount them here."""
+    liked = list(instance.likes.values_list("pk", flat=True))
+    if liked:
+        Discussion.objects.filter(pk__in=liked).adjust_counters(likes_count=-1)
+        caching.invalidate(*liked)
+
+
+@receiver(post_save, sender=Comment)
+def increment_comments_count(sender, instance, created, **kwargs):
+    if created:
+        Discussion.objects.filter(pk=instance.post_id).adjust_counters(comments_count=1)
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_comments_count(sender, instance, **kwargs):
+    Discussion.objects.filter(pk=instance.post_id).adjust_counters(comments_count=-1)
+
+
+@receiver(post_save, sender=Discussion)
+def index_discussion(sender, instance, **kwargs):
+    search.get_backend().index_discussions([instance.pk])
+
+
+@receiver(post_delete, sender=Discussion)
+def unindex_discussion(sender, instance, **kwargs):
+    search.get_backend().remove_discussion(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, **kwargs):
+    search.get_backend().index_comments([instance.pk])
+
+
+@receiver(post_delete, sender=Comment)
+def unindex_comment(sender, instance, **kwargs):
+    search.get_backend().remove_comment(instance.pk)
+
+
+@receiver(m2m_changed, sender=Discussion.likes.through)
+def invalidate_liked_discussions(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "post_clear":
+        caching.invalidate(*(instance._cleared_discussion_ids if reverse else [instance.pk]))
+    elif action in ("post_add", "post_remove") and pk_set:
+        caching.invalidate(*(pk_set if reverse else [instance.pk]))
+
+
+@receiver(post_save, sender=Discussion)
+@receiver(post_delete, sender=Discussion)
+def invalidate_discussion(sender, instance, **kwargs):
+    caching.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_commented_discussion(sender, instance, **kwargs):
+    caching.invalidate(instance.post_id)
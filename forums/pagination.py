@@ -0,0 +1,110 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+Keyset = namedtuple("Keyset", ["position", "pk", "reverse"])
+
+
+class KeysetPagination(CursorPagination):
+
+    """
+    Paginate on `(ordering field, pk)` with opaque cursors.
+
+    Unlike `PageNumberPagination` this never issues a `COUNT(*)` and never
+    uses OFFSET, so page 10,000 costs the same index seek as page 1.
+    Only the first ordering field is used; `pk` is always the tie-breaker.
+    """
+    ordering = ("-created_at", "-id")
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        field = self.get_ordering(request, queryset, view)[0]
+        self.field_name = field.lstrip("-")
+        self.descending = field.startswith("-")
+        self.model_field = queryset.model._meta.get_field(self.field_name)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+
+        queryset = queryset.order_by(*self._order_by(reverse))
+        if self.cursor is not None:
+            queryset = queryset.filter(self._seek(self.cursor))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        return self.page
+
+    def _order_by(self, reverse):
+        prefix = "-" if self.descending != reverse else ""
+        if self.field_name in ("id", "pk"):
+            return (prefix + "pk",)
+        return (prefix + self.field_name, prefix + "pk")
+
+    def _seek(self, cursor):
+        lookup = "lt" if self.descending != cursor.reverse else "gt"
+        if self.field_name in ("id", "pk"):
+            return Q(**{f"pk__{lookup}": cursor.pk})
+        # The redundant `field <= position` bound lets the planner seek the
+        # composite index instead of scanning it to evaluate the OR.
+        return Q(**{f"{self.field_name}__{lookup}e": cursor.position}) & (
+            Q(**{f"{self.field_name}__{lookup}": cursor.position})
+            | Q(**{f"pk__{lookup}": cursor.pk})
+        )
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.cursor_for(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.cursor_for(self.page[0], reverse=True))
+
+    def cursor_for(self, instance, reverse=False):
+        """Return the opaque token pointing just past `instance`."""
+        position = self.model_field.value_to_string(instance)
+        token = json.dumps([position, instance.pk, int(reverse)], separators=(",", ":"))
+        return urlsafe_b64encode(token.encode()).decode("ascii")
+
+    def encode_cursor(self, token):
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            position, pk, reverse = json.loads(urlsafe_b64decode(encoded.encode("ascii")))
+            return Keyset(self.model_field.to_python(position), int(pk), bool(reverse))
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class CommentPagination(KeysetPagination):
+
+    """Oldest-first keyset pagination for a discussion's comments."""
+    ordering = ("created_at", "id")
@@ -0,0 +1,210 @@
+"""
+Full-text search over discussions and their comments.
+
+Discussions and comments are indexed as separate rows of one search table,
+so a new comment only indexes its own text instead of re-reading the thread.
+Row ids are derived from the object id (`2n` for discussions, `2n + 1` for
+comments) which lets both backends update or delete a single row by key.
+
+The backend is `FORUMS_SEARCH_BACKEND` when set, otherwise it is picked from
+the database vendor: a GIN-indexed `tsvector` table on PostgreSQL, an FTS5
+virtual table on SQLite and a plain `icontains` scan anywhere else.
+"""
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+SEARCH_TABLE = "forums_search_index"
+
+
+def discussion_row_id(discussion_id):
+    return discussion_id * 2
+
+
+def comment_row_id(comment_id):
+    return comment_id * 2 + 1
+
+
+class BaseSearchBackend:
+
+    """Interface every search backend implements."""
+
+    def index_discussions(self, discussion_ids):
+        raise NotImplementedError
+
+    def index_comments(self, comment_ids):
+        raise NotImplementedError
+
+    def remove_discussion(self, discussion_id):
+        raise NotImplementedError
+
+    def remove_comment(self, comment_id):
+        raise NotImplementedError
+
+    def rebuild(self):
+        raise NotImplementedError
+
+    def search(self, query, limit, offset=0):
+        """Return discussion ids matching `query`, best match first."""
+        raise NotImplementedError
+
+
+class SQLSearchBackend(BaseSearchBackend):
+
+    """Shared plumbing for backends that keep a search table in the database."""
+    discussion_sql = None
+    comment_sql = None
+    clear_sql = "DELETE FROM {table}"
+
+    def _execute(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(table=SEARCH_TABLE), params)
+            return cursor.fetchall() if cursor.description else None
+
+    def _in_clause(self, ids):
+        return ", ".join(["%s"] * len(ids))
+
+    def _delete_rows(self, row_ids):
+        self._execute(f"DELETE FROM {{table}} WHERE id IN ({self._in_clause(row_ids)})", row_ids)
+
+    def index_discussions(self, discussion_ids):
+        discussion_ids = list(discussion_ids)
+        if discussion_ids:
+            self._delete_rows([discussion_row_id(pk) for pk in discussion_ids])
+            where = f"WHERE d.id IN ({self._in_clause(discussion_ids)})"
+            self._execute(self.discussion_sql.format(table="{table}", where=where), discussion_ids)
+
+    def index_comments(self, comment_ids):
+        comment_ids = list(comment_ids)
+        if comment_ids:
+            self._delete_rows([comment_row_id(pk) for pk in comment_ids])
+            where = f"WHERE c.id IN ({self._in_clause(comment_ids)})"
+            self._execute(self.comment_sql.format(table="{table}", where=where), comment_ids)
+
+    def remove_discussion(self, discussion_id):
+        self._delete_rows([discussion_row_id(discussion_id)])
+
+    def remove_comment(self, comment_id):
+        self._delete_rows([comment_row_id(comment_id)])
+
+    def rebuild(self):
+        self._execute(self.clear_sql)
+        self._execute(self.discussion_sql.format(table="{table}", where=""))
+        self._execute(self.comment_sql.format(table="{table}", where=""))
+
+
+class SQLiteSearchBackend(SQLSearchBackend):
+
+    """FTS5 virtual table ranked with bm25; titles and tags weigh most."""
+    discussion_sql = """
+        INSERT INTO {table} (rowid, discussion_id, title, content, tags, comment)
+        SELECT d.id * 2, d.id, d.title, d.content, COALESCE((
+            SELECT group_concat(t.name, ' ') FROM forums_discussiontag dt
+            JOIN forums_tag t ON t.id = dt.tag_id WHERE dt.discussion_id = d.id
+        ), ''), ''
+        FROM forums_discussion d {where}
+    """
+    comment_sql = """
+        INSERT INTO {table} (rowid, discussion_id, title, content, tags, comment)
+        SELECT c.id * 2 + 1, c.post_id, '', '', '', c.content
+        FROM forums_comment c {where}
+    """
+
+    def _delete_rows(self, row_ids):
+        self._execute(f"DELETE FROM {{table}} WHERE rowid IN ({self._in_clause(row_ids)})", row_ids)
+
+    def search(self, query, limit, offset=0):
+        # Quote every term so user input can never be parsed as FTS5 syntax.
+        terms = " ".join('"{}"'.format(term.replace('"', '""')) for term in query.split())
+        if not terms:
+            return []
+        # `LIMIT -1` stops SQLite flattening the subquery, which bm25() does not allow.
+        rows = self._execute("""
+            SELECT discussion_id, MIN(score) AS best FROM (
+                SELECT discussion_id, bm25({table}, 0, 10.0, 1.0, 5.0, 0.5) AS score
+                FROM {table} WHERE {table} MATCH %s LIMIT -1
+            ) GROUP BY discussion_id ORDER BY best, discussion_id DESC LIMIT %s OFFSET %s
+        """, [terms, limit, offset])
+        return [row[0] for row in rows]
+
+
+class PostgresSearchBackend(SQLSearchBackend):
+
+    """Weighted `tsvector` rows behind a GIN index, ranked with ts_rank_cd."""
+    discussion_sql = """
+        INSERT INTO {table} (id, discussion_id, document)
+        SELECT d.id * 2, d.id,
+            setweight(to_tsvector('english', d.title), 'A')
+            || setweight(to_tsvector('english', COALESCE((
+                SELECT string_agg(t.name, ' ') FROM forums_discussiontag dt
+                JOIN forums_tag t ON t.id = dt.tag_id WHERE dt.discussion_id = d.id
+            ), '')), 'A')
+            || setweight(to_tsvector('english', d.content), 'B')
+        FROM forums_discussion d {where}
+    """
+    comment_sql = """
+        INSERT INTO {table} (id, discussion_id, document)
+        SELECT c.id * 2 + 1, c.post_id, setweight(to_tsvector('english', c.content), 'C')
+        FROM forums_comment c {where}
+    """
+    clear_sql = "TRUNCATE {table}"
+
+    def search(self, query, limit, offset=0):
+        rows = self._execute("""
+            SELECT discussion_id, MAX(ts_rank_cd(document, query)) AS best
+            FROM {table}, plainto_tsquery('english', %s) query
+            WHERE document @@ query
+            GROUP BY discussion_id ORDER BY best DESC, discussion_id DESC LIMIT %s OFFSET %s
+        """, [query, limit, offset])
+        return [row[0] for row in rows]
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+
+    """Unindexed fallback for databases without a full-text engine."""
+
+    def index_discussions(self, discussion_ids):
+        pass
+
+    def index_comments(self, comment_ids):
+        pass
+
+    def remove_discussion(self, discussion_id):
+        pass
+
+    def remove_comment(self, comment_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, query, limit, offset=0):
+        from forums.models import Discussion
+
+        matches = Q()
+        for term in query.split():
+            matches &= (
+                Q(title__icontains=term) | Q(content__icontains=term)
+                | Q(tags__name__icontains=term) | Q(comments__content__icontains=term)
+            )
+        ids = Discussion.objects.filter(matches).order_by("-created_at", "-id").values_list("id", flat=True)
+        return list(ids.distinct()[offset:offset + limit])
+
+
+VENDOR_BACKENDS = {
+    "postgresql": PostgresSearchBackend,
+    "sqlite": SQLiteSearchBackend,
+}
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        if settings.FORUMS_SEARCH_BACKEND:
+            _backend = import_string(settings.FORUMS_SEARCH_BACKEND)()
+        else:
+            _backend = VENDOR_BACKENDS.get(connection.vendor, SimpleSearchBackend)()
+    return _backend
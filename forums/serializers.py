@@ -1,9 +1,49 @@
+from django.db import transaction
 from rest_framework import serializers
-from forums.models import Discussion, Comment, CATEGORY_TYPE
+from forums import images
+from forums.models import Discussion, Comment, Tag, CATEGORY_TYPE, MAX_TAGS, parse_tags
+from forums.tasks import enqueue, process_discussion_image
 
 
-class CreateDiscussionSerializer(serializers.ModelSerializer):
+class TagListField(serializers.Field):
+
+    """Accepts tags as a comma separated string or a list; returns a list of names."""
+    default_error_messages = {
+        "invalid": "Expected a comma separated string or a list of tags.",
+        "max_length": "Tags cannot be longer than {max_length} characters.",
+        "max_tags": "A discussion can have at most {max_tags} tags.",
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, list) and all(isinstance(name, str) for name in data):
+            data = ",".join(data)
+        if not isinstance(data, str):
+            self.fail("invalid")
+
+        names = parse_tags(data)
+        max_length = Tag._meta.get_field("name").max_length
+        if any(len(name) > max_length for name in names):
+            self.fail("max_length", max_length=max_length)
+        if len(names) > MAX_TAGS:
+            self.fail("max_tags", max_tags=MAX_TAGS)
+        return names
+
+    def to_representation(self, value):
+        return [tag.name for tag in value.all()]
+
+
+class ImageSrcsetMixin(serializers.Serializer):
+
+    """Adds `img_srcset`, the `{mime type: srcset}` map of the image's resized renditions."""
+    img_srcset = serializers.SerializerMethodField()
+
+    def get_img_srcset(self, obj):
+        return images.get_srcset(obj, self.context.get("request"))
+
+
+class CreateDiscussionSerializer(ImageSrcsetMixin, serializers.ModelSerializer):
     likes = serializers.SerializerMethodField()
+    tags = TagListField(required=False)
 
     class Meta:
         model = Discussion
@@ -12,11 +52,38 @@ class CreateDiscussionSerializer(serializers.ModelSerializer):
     def get_likes(self, obj):
         return obj.get_likes_count()
 
+    def _process_image(self, discussion, validated_data):
+        if "img" in validated_data:
+            transaction.on_commit(lambda: self._queue_image(discussion.pk))
+
+    def _queue_image(self, discussion_id):
+        # The discussion is already committed: process the image here rather
+        # than fail the request when the broker is unreachable.
+        if not enqueue(process_discussion_image, discussion_id):
+            images.generate_renditions(discussion_id)
 
-class RetrieveDiscussionSerializer(serializers.ModelSerializer):
+    def create(self, validated_data):
+        tags = validated_data.pop("tags", None)
+        discussion = super().create(validated_data)
+        if tags is not None:
+            discussion.set_tags(tags)
+        self._process_image(discussion, validated_data)
+        return discussion
+
+    def update(self, instance, validated_data):
+        tags = validated_data.pop("tags", None)
+        discussion = super().update(instance, validated_data)
+        if tags is not None:
+            discussion.set_tags(tags)
+        self._process_image(discussion, validated_data)
+        return discussion
+
+
+class RetrieveDiscussionSerializer(ImageSrcsetMixin, serializers.ModelSerializer):
 
     likes = serializers.SerializerMethodField()
-    comments = serializers.SerializerMethodField()
+    tags = TagListField(read_only=True)
+    latest_comments = serializers.SerializerMethodField()
 
     class Meta:
         model = Discussion
@@ -25,8 +92,8 @@ class RetrieveDiscussionSerializer(serializers.ModelSerializer):
     def get_likes(self, obj):
         return obj.get_likes_count()
 
-    def get_comments(self, obj):
-        return RetrieveCommentSerializer(obj.comments.all(), many=True).data
+    def get_latest_comments(self, obj):
+        return RetrieveCommentSerializer(obj.get_latest_comments(), many=True).data
 
 
 class CreateCommentSerializer(serializers.ModelSerializer):
@@ -43,6 +110,27 @@ class RetrieveCommentSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class LikeStatusSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    liked = serializers.BooleanField()
+    likes = serializers.IntegerField()
+
+
+class LikeSerializer(serializers.Serializer):
+    liked = serializers.BooleanField()
+    likes_count = serializers.IntegerField()
+
+
+class CommentStatusSerializer(serializers.Serializer):
+    comment = RetrieveCommentSerializer()
+    comments_count = serializers.IntegerField()
+
+
+class TagCountSerializer(serializers.Serializer):
+    name = serializers.CharField()
+    count = serializers.IntegerField()
+
+
 class EmptySerializer(serializers.Serializer):
     pass
 
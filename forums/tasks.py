@@ -0,0 +1,37 @@
+import logging
+
+from celery import shared_task
+from kombu.exceptions import OperationalError
+from forums.images import generate_renditions
+from forums.likes import flush_likes
+from forums.models import rank_discussions
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(task, *args, **options):
+    """`task.apply_async(args, **options)`, but returns False instead of raising when the broker is unreachable."""
+    try:
+        task.apply_async(args, **options)
+    except OperationalError as error:
+        logger.warning("Could not queue %s: %s", task.name, error)
+        return False
+    return True
+
+
+@shared_task
+def update_ranked_feeds():
+    """Recompute the cached hot and top feeds; scheduled by `CELERYBEAT_SCHEDULE`."""
+    rank_discussions()
+
+
+@shared_task
+def flush_like_buffer():
+    """Write buffered likes to the database; a no-op unless `FORUMS_LIKE_BUFFERING` is on."""
+    flush_likes()
+
+
+@shared_task
+def process_discussion_image(discussion_id):
+    """Build the resized, EXIF-free renditions of a discussion's image."""
+    return generate_renditions(discussion_id)
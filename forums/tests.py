@@ -1,7 +1,28 @@
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from kombu.exceptions import OperationalError
+from PIL import Image
 from rest_framework.test import APIClient, APITestCase
-from rest_framework import status
+from rest_framework import permissions, status
 from accounts.models import User
-from forums.models import Discussion, Comment
+from forums import caching, tasks
+from forums.images import generate_renditions
+from forums.likes import flush_likes
+from forums.models import Discussion, Comment, rank_discussions
+from forums.serializers import CreateDiscussionSerializer
 
 
 class ForumTest(APITestCase):
@@ -9,6 +30,9 @@ class ForumTest(APITestCase):
     endpoint = "/forums/"
     client = APIClient()
 
+    def setUp(self):
+        cache.clear()
+
     def regular_user_login(self):
         user = User.objects.get(id=2)
         self.client.force_authenticate(user)
@@ -17,6 +41,29 @@ class ForumTest(APITestCase):
         admin = User.objects.get(id=1)
         self.client.force_authenticate(admin)
 
+    def _count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries)
+
+    def _explain_feed_query(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        sql = next(
+            query["sql"] for query in context.captured_queries
+            if query["sql"].startswith('SELECT "forums_discussion"."id"')
+        )
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                # Tiny test tables would otherwise always be read sequentially.
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute(f"EXPLAIN {sql}")
+            else:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            return " ".join(str(column) for row in cursor.fetchall() for column in row)
+
     def _create_discussion(self, id):
         self.regular_user_login()
         post = Discussion.objects.create(
@@ -35,6 +82,7 @@ class ForumTest(APITestCase):
         response = self.client.post(self.endpoint, data=data, format="json")
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data.get("tags"), ["premium", "friendly"])
 
     def test_user_can_update_own_discussion(self):
         url = self._create_discussion(2)
@@ -66,14 +114,14 @@ class ForumTest(APITestCase):
         self.regular_user_login()
         response = self.client.get(self.endpoint, format="json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data.get("count"), 2)
+        self.assertEqual(len(response.data.get("results")), 2)
 
     def test_user_can_list_all_own_discussions(self):
         self.regular_user_login()
         url = f"{self.endpoint}mine/"
         response = self.client.get(url, format="json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data.get("count"), 1)
+        self.assertEqual(len(response.data.get("results")), 1)
 
     def test_user_can_add_comment(self):
         self.regular_user_login()
@@ -123,7 +171,6 @@ class ForumTest(APITestCase):
         self.assertEqual(Comment.objects.all().count(), 2)
         self.assertNotEqual(Comment.objects.all().count(), 1)
 
-
     def test_user_can_delete_own_comment(self):
         self.regular_user_login()
         comment = Comment.objects.create(
@@ -150,3 +197,581 @@ class ForumTest(APITestCase):
         response = self.client.post(url, format="json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data.get("likes"), 2)
+
+    def test_discussion_list_query_count_is_constant(self):
+        self.regular_user_login()
+        user = User.objects.get(id=2)
+        queries = self._count_queries(self.endpoint)
+
+        for i in range(5):
+            post = Discussion.objects.create(user=user, title=f"Post {i}", content="Content")
+            post.likes.add(user)
+            Comment.objects.create(user=user, post=post, content="Comment")
+
+        self.assertEqual(self._count_queries(self.endpoint), queries)
+        self.assertEqual(self._count_queries(f"{self.endpoint}mine/"), queries)
+        self.assertEqual(self._count_queries(f"{self.endpoint}1/"), 3)
+
+    def test_counters_follow_likes_and_comments(self):
+        self.regular_user_login()
+        self.client.post("/forums/1/like-unlike/", format="json")
+        self.client.post("/forums/1/add-comment/", data={"content": "Hi"}, format="json")
+
+        discussion = Discussion.objects.get(id=1)
+        self.assertEqual(discussion.likes_count, discussion.likes.count())
+        self.assertEqual(discussion.comments_count, discussion.comments.count())
+
+        discussion.likes.clear()
+        User.objects.get(id=3).comments.all().delete()
+        self.assertEqual(Discussion.objects.get(id=1).likes_count, 0)
+        self.assertEqual(Discussion.objects.get(id=2).comments_count, 0)
+
+    def test_deleting_a_user_uncounts_their_likes(self):
+        Discussion.objects.reconcile_counters()
+        User.objects.get(id=3).delete()
+        for discussion in Discussion.objects.all():
+            self.assertEqual(discussion.likes_count, discussion.likes.count())
+        self.assertEqual(Discussion.objects.get(id=2).likes_count, 2)
+
+    def test_reconcile_counters_fixes_drift(self):
+        Discussion.objects.update(likes_count=42, comments_count=7)
+        call_command("reconcile_counters", stdout=StringIO())
+
+        for discussion in Discussion.objects.all():
+            self.assertEqual(discussion.likes_count, discussion.likes.count())
+            self.assertEqual(discussion.comments_count, discussion.comments.count())
+        self.assertEqual(Discussion.objects.reconcile_counters(), 0)
+
+    def test_discussion_feed_pages_with_cursor(self):
+        self.regular_user_login()
+        user = User.objects.get(id=2)
+        for i in range(5):
+            Discussion.objects.create(user=user, title=f"Post {i}", content="Content")
+        expected = list(Discussion.objects.order_by("-created_at", "-id").values_list("id", flat=True))
+
+        seen, url = [], f"{self.endpoint}?page_size=3"
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url, format="json")
+            self.assertFalse(any("COUNT(" in q["sql"] for q in context.captured_queries))
+            seen += [item["id"] for item in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(seen, expected)
+
+        response = self.client.get(f"{self.endpoint}?page_size=3", format="json")
+        response = self.client.get(response.data["next"], format="json")
+        response = self.client.get(response.data["previous"], format="json")
+        self.assertEqual([item["id"] for item in response.data["results"]], expected[:3])
+        self.assertIsNone(response.data["previous"])
+
+    def test_invalid_cursor_returns_not_found(self):
+        self.regular_user_login()
+        response = self.client.get(f"{self.endpoint}?cursor=garbage", format="json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_user_can_page_through_comments(self):
+        self.regular_user_login()
+        discussion = Discussion.objects.get(id=1)
+        for i in range(5):
+            commenter = User.objects.create(email=f"commenter{i}@gmail.com", first_name="Commenter")
+            Comment.objects.create(user=commenter, post=discussion, content=f"Comment {i}")
+        expected = list(discussion.comments.order_by("created_at", "id").values_list("id", flat=True))
+
+        seen, url = [], "/forums/1/comments/?page_size=2"
+        while url:
+            response = self.client.get(url, format="json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [comment["id"] for comment in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(seen, expected)
+
+    def test_discussion_only_embeds_latest_comments(self):
+        self.regular_user_login()
+        discussion = Discussion.objects.get(id=1)
+        for i in range(5):
+            commenter = User.objects.create(email=f"commenter{i}@gmail.com", first_name="Commenter")
+            Comment.objects.create(user=commenter, post=discussion, content=f"Comment {i}")
+
+        for url in (f"{self.endpoint}1/", self.endpoint):
+            response = self.client.get(url, format="json")
+            data = response.data if url != self.endpoint else response.data["results"][-1]
+            self.assertEqual(data["comments_count"], 5)
+            self.assertEqual(
+                [comment["content"] for comment in data["latest_comments"]],
+                ["Comment 4", "Comment 3", "Comment 2"]
+            )
+
+    def test_comment_mutations_return_only_changed_fields(self):
+        self.regular_user_login()
+        response = self.client.post("/forums/1/add-comment/", data={"content": "Hi"}, format="json")
+        self.assertEqual(response.data["comments_count"], 1)
+        self.assertEqual(response.data["comment"]["content"], "Hi")
+        self.assertNotIn("latest_comments", response.data)
+
+        data = {"comment_id": response.data["comment"]["id"]}
+        response = self.client.delete("/forums/1/delete-comment/", data=data, format="json")
+        self.assertEqual(response.data["comments_count"], 0)
+
+    def test_add_comment_upserts_in_a_few_queries(self):
+        self.regular_user_login()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post("/forums/1/add-comment/", data={"content": "Hi"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # Insert, counter update, search index (delete + insert).
+        self.assertEqual(len([q for q in context.captured_queries if "SAVEPOINT" not in q["sql"]]), 4)
+
+        response = self.client.post("/forums/1/add-comment/", data={"content": "Edited"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["comments_count"], 1)
+        self.assertEqual(response.data["comment"]["content"], "Edited")
+        comment = Comment.objects.get(post_id=1, user_id=2)
+        self.assertEqual(comment.content, "Edited")
+        self.assertGreater(comment.updated_at, comment.created_at)
+        self.assertEqual(self.client.get("/forums/search/?q=edited").data["results"][0]["id"], 1)
+
+        response = self.client.post("/forums/999/add-comment/", data={"content": "Hi"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.post("/forums/1/add-comment/", data={}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_slug_generation_costs_constant_queries(self):
+        user = User.objects.get(id=2)
+        counts = []
+        for _ in range(30):
+            with CaptureQueriesContext(connection) as context:
+                Discussion.objects.create(user=user, title="Hello", content="Content")
+            counts.append(len(context.captured_queries))
+
+        self.assertEqual(len(set(counts[1:])), 1)
+        slugs = Discussion.objects.filter(title="Hello").values_list("slug", flat=True)
+        self.assertEqual(len(set(slugs)), 30)
+        self.assertIn("hello", slugs)
+
+    def test_user_can_search_discussions_and_comments(self):
+        self.regular_user_login()
+        user = User.objects.get(id=2)
+        in_title = Discussion.objects.create(user=user, title="Kubernetes tips", content="Content")
+        in_comment = Discussion.objects.create(user=user, title="Deployments", content="Content")
+        comment = Comment.objects.create(user=user, post=in_comment, content="Try kubernetes")
+
+        response = self.client.get(f"{self.endpoint}search/?q=kubernetes", format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item["id"] for item in response.data["results"]], [in_title.id, in_comment.id])
+
+        comment.delete()
+        in_title.title = "Docker tips"
+        in_title.save()
+        response = self.client.get(f"{self.endpoint}search/?q=kubernetes", format="json")
+        self.assertEqual(response.data["results"], [])
+
+    def test_search_without_term_fails(self):
+        self.regular_user_login()
+        response = self.client.get(f"{self.endpoint}search/", format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_user_can_filter_discussions_by_tag(self):
+        self.regular_user_login()
+        response = self.client.get(f"{self.endpoint}?tag=Nike", format="json")
+        self.assertEqual([item["id"] for item in response.data["results"]], [2])
+
+        response = self.client.get(f"{self.endpoint}?tag=fitness", format="json")
+        self.assertEqual(len(response.data["results"]), 2)
+
+    def test_tag_cloud_counts_are_cached(self):
+        self.regular_user_login()
+        url = f"{self.endpoint}tags/"
+        response = self.client.get(url, format="json")
+        self.assertEqual(response.data[0], {"name": "fitness", "count": 2})
+
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url, format="json")
+        self.assertEqual(len(context.captured_queries), 0)
+
+    def test_discussion_cannot_have_too_many_tags(self):
+        self.regular_user_login()
+        data = {"title": "Tagged", "content": "Content", "tags": ",".join(f"t{i}" for i in range(11))}
+        response = self.client.post(self.endpoint, data=data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_user_can_filter_and_order_discussions(self):
+        self.regular_user_login()
+        response = self.client.get(f"{self.endpoint}?category=HealthTech", format="json")
+        self.assertEqual([item["id"] for item in response.data["results"]], [1])
+
+        response = self.client.get(f"{self.endpoint}?min_likes=2", format="json")
+        self.assertEqual([item["id"] for item in response.data["results"]], [2])
+
+        response = self.client.get(f"{self.endpoint}?user=1&created_before=2021-01-01T00:00:00Z", format="json")
+        self.assertEqual([item["id"] for item in response.data["results"]], [1])
+
+        response = self.client.get(f"{self.endpoint}?ordering=likes_count&page_size=1", format="json")
+        self.assertEqual([item["id"] for item in response.data["results"]], [1])
+        response = self.client.get(response.data["next"], format="json")
+        self.assertEqual([item["id"] for item in response.data["results"]], [2])
+
+    def test_discussion_filters_use_indexes(self):
+        self.regular_user_login()
+        plans = {
+            "forums_disc_cat_created_idx": f"{self.endpoint}?category=FinTech",
+            "forums_disc_likes_idx": f"{self.endpoint}?ordering=-likes_count",
+            "forums_disc_user_created_idx": f"{self.endpoint}mine/",
+        }
+        for index, url in plans.items():
+            self.assertIn(index, self._explain_feed_query(url))
+
+    def test_discussion_detail_is_cached_until_changed(self):
+        self.regular_user_login()
+        url = f"{self.endpoint}1/"
+        response = self.client.get(url, format="json")
+        etag = response["ETag"]
+        # A hit still looks the discussion up for 404s and object permissions.
+        self.assertEqual(self._count_queries(url), 1)
+        with mock.patch.object(permissions.IsAuthenticated, "has_object_permission", return_value=False):
+            self.assertEqual(self.client.get(url, format="json").status_code, status.HTTP_403_FORBIDDEN)
+
+        response = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertFalse(response.content)
+
+        self.client.post("/forums/1/like-unlike/", format="json")
+        response = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["likes"], 2)
+        etag = response["ETag"]
+
+        self.client.post("/forums/1/add-comment/", data={"content": "Hi"}, format="json")
+        response = self.client.get(url, format="json", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["comments_count"], 1)
+
+        Discussion.objects.get(id=1).delete()
+        response = self.client.get(url, format="json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_missing_discussion_leaves_nothing_in_the_cache(self):
+        self.regular_user_login()
+        response = self.client.get(f"{self.endpoint}123456/", format="json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIsNone(cache.get(caching._version_key(123456)))
+
+    @override_settings(ALLOWED_HOSTS=["testserver", "other.example"])
+    def test_cached_discussion_detail_does_not_depend_on_the_host(self):
+        self.regular_user_login()
+        Discussion.objects.filter(id=1).update(img="images/photo.jpg")
+        url = f"{self.endpoint}1/"
+        self.assertEqual(self.client.get(url, format="json").data["img"], "http://testserver/media/images/photo.jpg")
+        # Served from the same cached payload.
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, format="json", HTTP_HOST="other.example")
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(response.data["img"], "http://other.example/media/images/photo.jpg")
+
+    def test_unreachable_broker_degrades_instead_of_failing(self):
+        self.regular_user_login()
+        cache.delete("forums:feed:pending")
+        down = OperationalError("Connection refused")
+        with mock.patch.object(tasks.update_ranked_feeds, "apply_async", side_effect=down) as apply_async:
+            response = self.client.get(f"{self.endpoint}hot/", format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"], [])
+        apply_async.assert_called_once()
+
+        buffer = BytesIO()
+        Image.new("RGB", (100, 50), "red").save(buffer, "JPEG")
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            discussion = Discussion.objects.get(id=1)
+            discussion.img.save("photo.jpg", ContentFile(buffer.getvalue()))
+            with mock.patch.object(tasks.process_discussion_image, "apply_async", side_effect=down):
+                CreateDiscussionSerializer()._queue_image(discussion.pk)
+            self.assertTrue(discussion.renditions.exists())
+
+    def test_discussions_cannot_be_replaced_with_put(self):
+        self.regular_user_login()
+        data = {"title": "Replaced", "content": "Replaced", "category": "FinTech", "user": 2}
+        for discussion_id in (1, 2):
+            response = self.client.put(f"{self.endpoint}{discussion_id}/", data=data, format="json")
+            self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertFalse(Discussion.objects.filter(title="Replaced").exists())
+
+    def test_hot_and_top_feeds_serve_precomputed_ranking(self):
+        self.regular_user_login()
+        response = self.client.get(f"{self.endpoint}hot/", format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"], [])
+
+        user = User.objects.get(id=2)
+        quiet = Discussion.objects.create(user=user, title="Quiet", content="Content")
+        busy = Discussion.objects.create(user=user, title="Busy", content="Content")
+        busy.likes.add(user)
+        Comment.objects.create(user=user, post=busy, content="Comment")
+        Discussion.objects.filter(pk=quiet.pk).update(likes_count=50)
+        Discussion.objects.filter(pk=quiet.pk).update(created_at=F("created_at") - timedelta(days=3))
+        rank_discussions()
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f"{self.endpoint}hot/", format="json")
+        self.assertEqual([item["id"] for item in response.data["results"]], [busy.id, quiet.id])
+        # Only the id lookup, its tags and the latest comments; never the ranking.
+        self.assertEqual(len(context.captured_queries), 3)
+
+        response = self.client.get(f"{self.endpoint}top/?window=day", format="json")
+        self.assertEqual([item["id"] for item in response.data["results"]], [busy.id])
+        response = self.client.get(f"{self.endpoint}top/?window=week", format="json")
+        self.assertEqual([item["id"] for item in response.data["results"]], [quiet.id, busy.id])
+        response = self.client.get(f"{self.endpoint}top/?window=year", format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_like_put_and_delete_are_idempotent(self):
+        self.regular_user_login()
+        url = "/forums/1/like/"
+        for _ in range(2):
+            response = self.client.put(url, format="json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data, {"liked": True, "likes_count": 2})
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.delete(url, format="json")
+        self.assertEqual(response.data, {"liked": False, "likes_count": 1})
+        # One DELETE of the like row and one counter UPDATE ... RETURNING.
+        queries = [query for query in context.captured_queries if "forums_discussion" in query["sql"]]
+        self.assertEqual(len(queries), 2)
+
+        response = self.client.delete(url, format="json")
+        self.assertEqual(response.data, {"liked": False, "likes_count": 1})
+        self.assertEqual(Discussion.objects.get(id=1).likes.count(), 1)
+
+        response = self.client.put("/forums/999/like/", format="json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(FORUMS_LIKE_BUFFERING=True)
+    def test_buffered_likes_are_flushed_in_bulk(self):
+        self.regular_user_login()
+        for _ in range(3):
+            response = self.client.post("/forums/1/like-unlike/", format="json")
+        self.assertEqual(response.data["liked"], True)
+        self.assertEqual(response.data["likes"], 2)
+        response = self.client.put("/forums/2/like/", format="json")
+        self.assertEqual(response.data, {"liked": True, "likes_count": 3})
+        response = self.client.delete("/forums/2/like/", format="json")
+        self.assertEqual(response.data, {"liked": False, "likes_count": 2})
+        self.assertEqual(Discussion.objects.get(id=2).likes_count, 3)
+
+        self.assertEqual(Discussion.objects.get(id=1).likes.count(), 1)
+        self.assertEqual(self.client.get("/forums/1/", format="json").data["likes"], 2)
+
+        # Three toggles on the first discussion and one unlike on the second; the PUT was a no-op.
+        self.assertEqual(flush_likes(), 4)
+        self.assertEqual(flush_likes(), 0)
+        for discussion in Discussion.objects.filter(id__in=[1, 2]):
+            self.assertEqual(discussion.likes_count, discussion.likes.count())
+            self.assertEqual(discussion.get_likes_count(), discussion.likes_count)
+        self.assertTrue(Discussion.objects.get(id=1).likes.filter(id=2).exists())
+        self.assertFalse(Discussion.objects.get(id=2).likes.filter(id=2).exists())
+        self.assertEqual(self.client.get("/forums/1/", format="json").data["likes"], 2)
+
+    @override_settings(FORUMS_LIKE_BUFFERING=True)
+    def test_buffered_likes_of_deleted_discussions_are_dropped(self):
+        doomed, raced = (
+            Discussion.objects.create(user=User.objects.get(id=2), title=f"Doomed {i}", content="Content")
+            for i in range(2)
+        )
+        self.regular_user_login()
+        self.client.put(f"/forums/{doomed.id}/like/", format="json")
+        self.client.put("/forums/1/like/", format="json")
+        doomed.delete()
+        self.assertEqual(flush_likes(), 2)
+        # Foreign keys are only checked at commit, which a TestCase never reaches.
+        connection.check_constraints()
+        self.assertEqual(list(Discussion.objects.get(id=1).likes.values_list("id", flat=True)), [2, 3])
+
+        # Deleted after the existence check: the bulk insert fails and only that like is lost.
+        self.super_admin_login()
+        self.client.put(f"/forums/{raced.id}/like/", format="json")
+        self.client.put("/forums/1/like/", format="json")
+        raced.delete()
+        with mock.patch("forums.likes._existing", lambda through, pairs: pairs):
+            self.assertEqual(flush_likes(), 2)
+        connection.check_constraints()
+        self.assertEqual(list(Discussion.objects.get(id=1).likes.values_list("id", flat=True)), [1, 2, 3])
+        self.assertEqual(flush_likes(), 0)
+
+    def test_forum_export_round_trips_through_import(self):
+        Discussion.objects.filter(id=1).update(slug="kept-slug")
+        discussion = Discussion.objects.get(id=1)
+        expected = {
+            "discussion": (discussion.slug, discussion.created_at, discussion.get_tags(), discussion.likes_count),
+            "comments": list(Comment.objects.order_by("id").values_list("id", "post_id", "content")),
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "forum.jsonl")
+            call_command("export_forum", path, stderr=StringIO())
+            Discussion.objects.all().delete()
+
+            # Pretend a previous run committed the first line, then crashed.
+            with open(f"{path}.checkpoint", "w") as fh:
+                fh.write("1")
+            out = StringIO()
+            call_command("import_forum", path, batch_size=2, stdout=out)
+            self.assertIn("Resuming after line 1.", out.getvalue())
+            self.assertIn("rows/s", out.getvalue())
+            self.assertFalse(os.path.exists(f"{path}.checkpoint"))
+            self.assertFalse(Discussion.objects.filter(id=1).exists())
+
+            call_command("import_forum", path, stdout=StringIO())
+
+        discussion = Discussion.objects.get(id=1)
+        self.assertEqual(
+            (discussion.slug, discussion.created_at, discussion.get_tags(), discussion.likes_count),
+            expected["discussion"]
+        )
+        self.assertEqual(
+            list(Comment.objects.order_by("id").values_list("id", "post_id", "content")), expected["comments"]
+        )
+        self.assertEqual(Discussion.objects.reconcile_counters(), 0)
+
+    def test_import_reports_duplicate_comments(self):
+        records = [
+            {"type": "discussion", "id": 100, "user": 2, "title": "Hello", "content": "Content"},
+            {"type": "comment", "id": 200, "user": 3, "post": 100, "content": "First"},
+            {"type": "comment", "id": 201, "user": 3, "post": 100, "content": "Again"},
+            {"type": "comment", "id": 202, "user": 2, "post": 100, "content": "Reply"},
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "forum.jsonl")
+            with open(path, "w") as fh:
+                fh.writelines(json.dumps(record) + "\n" for record in records)
+            out = StringIO()
+            call_command("import_forum", path, stdout=out)
+
+        self.assertIn("Skipped 1 comment(s)", out.getvalue())
+        self.assertIn("ids 201.", out.getvalue())
+        comments = Comment.objects.filter(post_id=100).order_by("id")
+        self.assertEqual(list(comments.values_list("id", flat=True)), [200, 202])
+
+    def test_imported_discussions_get_unique_slugs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "forum.jsonl")
+            with open(path, "w") as fh:
+                for i in range(100, 105):
+                    fh.write(json.dumps({
+                        "type": "discussion", "id": i, "user": 2, "title": "Hello", "content": "Content"
+                    }) + "\n")
+            call_command("import_forum", path, batch_size=2, stdout=StringIO())
+
+        slugs = list(Discussion.objects.filter(title="Hello").values_list("slug", flat=True))
+        self.assertEqual(len(set(slugs)), 5)
+        self.assertIn("hello", slugs)
+
+    def test_uploaded_image_gets_upright_exif_free_renditions(self):
+        self.regular_user_login()
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotate 90 degrees clockwise to display.
+        exif[0x010F] = "Camera maker"
+        buffer = BytesIO()
+        Image.new("RGB", (800, 400), "red").save(buffer, "JPEG", exif=exif)
+        upload = SimpleUploadedFile("photo.jpg", buffer.getvalue(), content_type="image/jpeg")
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+            MEDIA_ROOT=media_root, FORUMS_IMAGE_WIDTHS=[320, 640, 1280]
+        ):
+            response = self.client.post(
+                self.endpoint, data={"title": "Photo", "content": "Content", "img": upload}, format="multipart"
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response.data["img_srcset"], {})
+            discussion = Discussion.objects.get(title="Photo")
+
+            # Larger widths are capped at the upright image's own width.
+            self.assertEqual(generate_renditions(discussion.pk), 4)
+            discussion.refresh_from_db()
+            self.assertEqual((discussion.img_width, discussion.img_height), (400, 800))
+            renditions = discussion.renditions.order_by("width", "format")
+            self.assertEqual(
+                [(r.format, r.width, r.height) for r in renditions],
+                [("jpeg", 320, 640), ("webp", 320, 640), ("jpeg", 400, 800), ("webp", 400, 800)]
+            )
+            for rendition in renditions:
+                with Image.open(rendition.file.path) as image:
+                    self.assertEqual(image.size, (rendition.width, rendition.height))
+                    self.assertEqual(len(image.getexif()), 0)
+
+            data = self.client.get(f"{self.endpoint}{discussion.pk}/", format="json").data
+            self.assertEqual(set(data["img_srcset"]), {"image/webp", "image/jpeg"})
+            self.assertRegex(data["img_srcset"]["image/webp"], r"^http://testserver/media/\S+-320w\.webp 320w, \S+ 400w$")
+
+            # Rebuilding replaces the previous renditions.
+            old_ids = {rendition.pk for rendition in renditions}
+            self.assertEqual(generate_renditions(discussion.pk), 4)
+            self.assertEqual(discussion.renditions.count(), 4)
+            self.assertFalse(discussion.renditions.filter(pk__in=old_ids).exists())
+
+
+class ForumConcurrencyTest(TransactionTestCase):
+    fixtures = ["users.json", "discussion.json"]
+
+    def _run_concurrently(self, func, calls, workers=8):
+        def run(i):
+            try:
+                return func(i)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(run, range(calls)))
+
+    def test_concurrent_same_title_discussions_get_unique_slugs(self):
+        user = User.objects.get(id=2)
+        creates = 2000
+        self._run_concurrently(
+            lambda i: Discussion.objects.create(user=user, title="Hello", content="Content"), creates)
+
+        slugs = list(Discussion.objects.filter(title="Hello").values_list("slug", flat=True))
+        self.assertEqual(len(slugs), creates)
+        self.assertEqual(len(set(slugs)), creates)
+
+    def test_concurrent_likes_are_counted_exactly(self):
+        users = [
+            User.objects.create(email=f"liker{i}@forumi.com", first_name="Liker", password="!")
+            for i in range(20)
+        ]
+        discussion = Discussion.objects.get(id=1)
+        expected = discussion.likes_count + len(users)
+
+        def request(method):
+            def call(i):
+                client = APIClient()
+                client.force_authenticate(users[i % len(users)])
+                return getattr(client, method)("/forums/1/like/", format="json").status_code
+            return call
+
+        # Every user taps "like" five times at once.
+        self.assertEqual(set(self._run_concurrently(request("put"), 100)), {status.HTTP_200_OK})
+        discussion.refresh_from_db()
+        self.assertEqual(discussion.likes_count, expected)
+        self.assertEqual(discussion.likes.count(), expected)
+
+        self.assertEqual(set(self._run_concurrently(request("delete"), 100)), {status.HTTP_200_OK})
+        discussion.refresh_from_db()
+        self.assertEqual(discussion.likes_count, expected - len(users))
+        self.assertEqual(discussion.likes.count(), expected - len(users))
+
+    def test_concurrent_comments_keep_one_per_user(self):
+        users = [
+            User.objects.create(email=f"commenter{i}@forumi.com", first_name="Commenter", password="!")
+            for i in range(10)
+        ]
+        discussion = Discussion.objects.get(id=1)
+        expected = discussion.comments_count + len(users)
+
+        def call(i):
+            client = APIClient()
+            client.force_authenticate(users[i % len(users)])
+            return client.post("/forums/1/add-comment/", {"content": f"Comment {i}"}, format="json").status_code
+
+        # Every user submits the same form five times at once.
+        statuses = self._run_concurrently(call, 50)
+        self.assertEqual(statuses.count(status.HTTP_201_CREATED), len(users))
+        self.assertEqual(statuses.count(status.HTTP_200_OK), 40)
+        discussion.refresh_from_db()
+        self.assertEqual(discussion.comments_count, expected)
+        self.assertEqual(discussion.comments.count(), expected)
@@ -1,11 +1,27 @@
+from django.core.cache import cache
+from django.db import transaction
 from django.db.models import F, Q
+from django.http import Http404
+from django.shortcuts import get_object_or_404
 from django.core.paginator import Paginator
-from rest_framework import status, permissions, viewsets, parsers
+from django.utils.http import parse_etags
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import filters, status, permissions, viewsets, parsers
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 from drf_yasg.utils import swagger_auto_schema
-from forums.models import Discussion, Comment
-from forums import serializers
+from forums.filters import DiscussionFilter
+from forums.models import (
+    TOP_WINDOWS, Discussion, Comment, get_ranked_feed, get_tag_cloud, prefetch_latest_comments,
+    prefetch_renditions, set_discussion_like, upsert_comment
+)
+from forums.pagination import CommentPagination, KeysetPagination
+from forums import caching, images, likes, search, serializers
+from forums.tasks import enqueue, update_ranked_feeds
 
 
 class DiscussionViewset(viewsets.ModelViewSet):
@@ -13,36 +29,86 @@ class DiscussionViewset(viewsets.ModelViewSet):
     """
     create: Create a Discussion thread.
     list: List all discussions in forum
+    retrieve: Get a discussion; send `If-None-Match` with its ETag to get a 304 when unchanged.
     partial_update: Update discussion info as authenticated author.
     destroy: Delete discussion info as authenticated author.
     """
-    queryset = Discussion.objects.all().order_by("-created_at")
+    queryset = Discussion.objects.prefetch_related("tags").order_by("-created_at")
     serializer_class = serializers.RetrieveDiscussionSerializer
     http_method_names = ["get", "post", "patch", "delete"]
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filterset_class = DiscussionFilter
+    ordering_fields = ["created_at", "likes_count", "comments_count"]
+    ordering = ["-created_at"]
 
     def get_serializer_class(self):
         if self.action in ["create", "partial_update"]:
             return serializers.CreateDiscussionSerializer
         return super().get_serializer_class()
 
+    def _prefetch(self, discussions):
+        return prefetch_renditions(prefetch_latest_comments(discussions))
+
+    def list(self, request):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        serializer = self.get_serializer(self._prefetch(page), many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def retrieve(self, request, pk):
+        if not str(pk).isdigit():
+            self.get_object()
+        discussion_id = int(pk)
+
+        version, payload = caching.get_payload(discussion_id)
+        if payload is None:
+            # Cache media URLs relative, so one payload serves every host.
+            context = {**self.get_serializer_context(), "request": None}
+            try:
+                discussion = self.get_object()
+            except Http404:
+                caching.forget(discussion_id)
+                raise
+            data = self.get_serializer_class()(discussion, context=context).data
+            payload = caching.set_payload(discussion_id, version, data)
+        else:
+            self._check_object()
+
+        etags = parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+        if "*" in etags or payload["etag"] in etags:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": payload["etag"]})
+        return Response(self._absolute_urls(payload["data"]), headers={"ETag": payload["etag"]})
+
+    def _check_object(self):
+        """`get_object()` without loading the discussion: same queryset, filters, 404s and object permissions."""
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None).only("id", "user_id")
+        self.check_object_permissions(self.request, get_object_or_404(queryset, pk=self.kwargs["pk"]))
+
+    def _absolute_urls(self, data):
+        data = dict(data)
+        if data.get("img"):
+            data["img"] = self.request.build_absolute_uri(data["img"])
+        data["img_srcset"] = images.absolute_srcset(data["img_srcset"], self.request)
+        return data
+
     def create(self, request):
         serializer = serializers.CreateDiscussionSerializer(data=request.data)
         if serializer.is_valid(raise_exception=True):
-            serializer.save(user=request.user)
+            serializer.save(user_id=request.user.id)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.error_messages, status=status.HTTP_400_BAD_REQUEST)
 
     def partial_update(self, request, pk):
         discussion = self.get_object()
-        if discussion.user != request.user:
+        if discussion.user_id != request.user.id:
             return Response({
                 "detail": "You cannot edit a post you did not create."
             }, status=status.HTTP_403_FORBIDDEN)
 
         serializer = self.get_serializer(data=request.data, partial=True)
         if serializer.is_valid(raise_exception=True):
-            serializer.save(user=request.user)
+            serializer.save(user_id=request.user.id)
             return Response({
                 "detail": "Discussion updated successfully!",
                 **serializer.data
@@ -51,7 +117,7 @@ class DiscussionViewset(viewsets.ModelViewSet):
 
     def destroy(self, request, pk):
         discussion = self.get_object()
-        if discussion.user != request.user:
+        if discussion.user_id != request.user.id:
             return Response({
                 "detail": "You cannot delete a post you did not create."
             }, status=status.HTTP_403_FORBIDDEN)
@@ -67,75 +133,201 @@ class DiscussionViewset(viewsets.ModelViewSet):
         methods=["post"],
         operation_description="Like or unlike this discussion",
         request_body=serializers.EmptySerializer,
-        response_body=serializers.RetrieveDiscussionSerializer,
+        response_body=serializers.LikeStatusSerializer,
         permission_classes=[permissions.IsAuthenticated]
     )
     @action(methods=["post"], detail=True, url_path="like-unlike")
     def like_or_unlike(self, request, pk):
-        discussion = self.get_object()
-        if discussion.likes.filter(id=request.user.id).exists():
-            discussion.likes.remove(request.user)
-            serializer = self.get_serializer(instance=discussion, many=False)
-            return Response({
-                "detail": "You unliked this post.",
-                **serializer.data
-            }, status=status.HTTP_200_OK)
+        result = self._set_like(pk, request.user.id, None)
+        if result is None:
+            raise NotFound()
+        liked, likes_count = result
+
+        return Response({
+            "detail": "You liked this post!" if liked else "You unliked this post.",
+            "id": int(pk),
+            "liked": liked,
+            "likes": likes_count
+        }, status=status.HTTP_200_OK)
+
+    def _set_like(self, pk, user_id, liked):
+        """Like, unlike or toggle (`liked=None`). Returns `(liked, likes_count)`, None if not found."""
+        if not str(pk).isdigit():
+            return None
+        if likes.is_enabled():
+            return likes.record_like(int(pk), user_id, liked)
+        if liked is not None:
+            result = set_discussion_like(int(pk), user_id, liked)
+            return result and (liked, result[1])
+
+        # Try to like first; if the like already existed the insert is a no-op, so unlike.
+        result = set_discussion_like(int(pk), user_id, True)
+        if result is None or result[0]:
+            return result
+        _, likes_count = set_discussion_like(int(pk), user_id, False)
+        return False, likes_count
 
-        discussion.likes.add(request.user)
-        serializer = self.get_serializer(instance=discussion, many=False)
+    @swagger_auto_schema(
+        methods=["put"],
+        operation_description="Like this discussion. Liking it again changes nothing.",
+        request_body=serializers.EmptySerializer,
+        response_body=serializers.LikeSerializer,
+        permission_classes=[permissions.IsAuthenticated]
+    )
+    @swagger_auto_schema(
+        methods=["delete"],
+        operation_description="Remove your like from this discussion. Removing it again changes nothing.",
+        response_body=serializers.LikeSerializer,
+        permission_classes=[permissions.IsAuthenticated]
+    )
+    # PUT is only routed here: the viewset itself does not accept it.
+    @action(methods=["put", "delete"], detail=True, url_path="like", http_method_names=["put", "delete"])
+    def like(self, request, pk):
+        result = self._set_like(pk, request.user.id, request.method == "PUT")
+        if result is None:
+            raise NotFound()
         return Response({
-            "detail": "You liked this post!",
-            **serializer.data
+            "liked": result[0],
+            "likes_count": result[1]
         }, status=status.HTTP_200_OK)
 
     @action(methods=["get"], detail=False, url_path="mine")
     def own_discussions(self, request):
-        user_discussions = Discussion.objects.filter(user=request.user)
+        user_discussions = self.filter_queryset(self.get_queryset()).filter(user_id=request.user.id)
         user_discussions = self.paginate_queryset(user_discussions)
-        serializer = self.get_serializer(user_discussions, many=True)
+        serializer = self.get_serializer(self._prefetch(user_discussions), many=True)
         return self.get_paginated_response(serializer.data)
 
+    @swagger_auto_schema(
+        methods=["get"],
+        operation_description="Full-text search over discussion titles, content, tags and comments.\
+            Results are ranked best match first; pass `q` and optionally `page`.",
+        response_body=serializers.RetrieveDiscussionSerializer,
+        permission_classes=[permissions.IsAuthenticated]
+    )
+    @action(methods=["get"], detail=False, url_path="search")
+    def search_discussions(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response({
+                "detail": "Provide a search term with the `q` query parameter."
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            page = max(int(request.query_params.get("page", 1)), 1)
+        except ValueError:
+            page = 1
+        page_size = api_settings.PAGE_SIZE
+
+        ids = search.get_backend().search(query, limit=page_size + 1, offset=(page - 1) * page_size)
+        found = self.get_queryset().in_bulk(ids[:page_size])
+        discussions = [found[pk] for pk in ids[:page_size] if pk in found]
+        serializer = self.get_serializer(self._prefetch(discussions), many=True)
+
+        url = request.build_absolute_uri()
+        return Response({
+            "next": replace_query_param(url, "page", page + 1) if len(ids) > page_size else None,
+            "previous": replace_query_param(url, "page", page - 1) if page > 1 else None,
+            "results": serializer.data
+        }, status=status.HTTP_200_OK)
+
+    def _ranked_feed(self, request, name):
+        ids = get_ranked_feed(name)
+        if ids is None:
+            # Never rank on the request path; ask a worker to do it, once. If the
+            # broker is down, serve the empty feed and ask again in a minute.
+            if cache.add("forums:feed:pending", True, 60):
+                enqueue(update_ranked_feeds)
+            ids = []
+
+        paginator = PageNumberPagination()
+        page = paginator.paginate_queryset(ids, request, view=self)
+        found = self.get_queryset().in_bulk(page)
+        discussions = [found[pk] for pk in page if pk in found]
+        serializer = self.get_serializer(self._prefetch(discussions), many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @swagger_auto_schema(
+        methods=["get"],
+        operation_description="Trending discussions, scored by likes and comments decayed by age.",
+        response_body=serializers.RetrieveDiscussionSerializer,
+        permission_classes=[permissions.IsAuthenticated]
+    )
+    @action(methods=["get"], detail=False, url_path="hot")
+    def hot(self, request):
+        return self._ranked_feed(request, "hot")
+
+    @swagger_auto_schema(
+        methods=["get"],
+        operation_description="Most liked and commented discussions of the last `window` (day or week).",
+        response_body=serializers.RetrieveDiscussionSerializer,
+        permission_classes=[permissions.IsAuthenticated]
+    )
+    @action(methods=["get"], detail=False, url_path="top")
+    def top(self, request):
+        window = request.query_params.get("window", "day")
+        if window not in TOP_WINDOWS:
+            return Response({
+                "detail": f"`window` must be one of: {', '.join(TOP_WINDOWS)}."
+            }, status=status.HTTP_400_BAD_REQUEST)
+        return self._ranked_feed(request, f"top:{window}")
+
+    @swagger_auto_schema(
+        methods=["get"],
+        operation_description="Most used tags with the number of discussions using each.",
+        response_body=serializers.TagCountSerializer,
+        permission_classes=[permissions.IsAuthenticated]
+    )
+    @action(methods=["get"], detail=False, url_path="tags")
+    def tag_cloud(self, request):
+        return Response(get_tag_cloud(), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        methods=["get"],
+        operation_description="List this discussion's comments, oldest first.",
+        response_body=serializers.RetrieveCommentSerializer,
+        permission_classes=[permissions.IsAuthenticated]
+    )
+    @action(methods=["get"], detail=True, url_path="comments")
+    def comments(self, request, pk):
+        discussion = self.get_object()
+        paginator = CommentPagination()
+        queryset = Comment.objects.filter(post=discussion).select_related("user")
+        page = paginator.paginate_queryset(queryset, request)
+        serializer = serializers.RetrieveCommentSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
     @swagger_auto_schema(
         methods=["post"],
         operation_description="Leave a comment on this Discussion.\
             If a comment already exists, this endpoint updates the user's reply.",
-        response_body=serializers.RetrieveDiscussionSerializer,
+        response_body=serializers.CommentStatusSerializer,
         request_body=serializers.CreateCommentSerializer,
         permission_classes=[permissions.IsAuthenticated]
     )
     @action(methods=["post"], detail=True, url_path="add-comment")
     def add_comment(self, request, pk):
-        discussion = self.get_object()
-
-        try:
-            discussion = Discussion.objects.get(id=discussion.id)
-            _, created = Comment.objects.update_or_create(
-                user=request.user,
-                post=discussion,
-                defaults={
-                    "content": request.data.get("content")
-                }
-            )
-            serializer = serializers.RetrieveDiscussionSerializer(discussion, many=False)
-
-            if created:
-                return Response({
-                    "detail": "Comment added!",
-                    **serializer.data
-                }, status.HTTP_201_CREATED)
-            return Response({
-                "detail": "Comment updated!",
-                **serializer.data
-            }, status=status.HTTP_200_OK)
-        except:
+        serializer = serializers.CreateCommentSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = None
+        if str(pk).isdigit():
+            result = upsert_comment(int(pk), request.user.id, serializer.validated_data["content"])
+        if result is None:
             return Response({
                 "detail": "Discussion not found"
             }, status=status.HTTP_404_NOT_FOUND)
+        comment, created, comments_count = result
+
+        return Response({
+            "detail": "Comment added!" if created else "Comment updated!",
+            "comment": serializers.RetrieveCommentSerializer(comment).data,
+            "comments_count": comments_count
+        }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
     @swagger_auto_schema(
         methods=["delete"],
         operation_description="Delete comment as an authenticated user",
-        response_body=serializers.RetrieveDiscussionSerializer,
+        response_body=serializers.CommentStatusSerializer,
         request_body=serializers.IDSerializer,
         permission_classes=[permissions.IsAuthenticated]
     )
@@ -149,17 +341,19 @@ class DiscussionViewset(viewsets.ModelViewSet):
             comment = discussion.comments.get(id=comment_id)
 
             if comment:
-                if comment.user != request.user:
+                if comment.user_id != request.user.id:
                     return Response({
                         "detail": "You cannot delete a comment you did not create."
                     }, status=status.HTTP_403_FORBIDDEN)
                 
-                comment.delete()
-                serializer = self.get_serializer(instance=discussion, many=False)
+                with transaction.atomic():
+                    comment.delete()
+                discussion.refresh_from_db(fields=["comments_count"])
 
                 return Response({
                     "detail": "Comment has been deleted!",
-                    **serializer.data
+                    "comment_id": comment_id,
+                    "comments_count": discussion.comments_count
                 })
         except:
             return Response({
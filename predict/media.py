@@ -0,0 +1,195 @@
+"""
+Serving of uploaded media and collected static files.
+
+`MEDIA_SERVE_MODE` picks who sends the bytes:
+
+* ``x-accel-redirect`` (nginx) or ``x-sendfile`` (Apache, lighttpd): Django
+  only checks the path and conditional headers, then hands the file to the
+  front server, which also answers range requests. With nginx, a file under
+  MEDIA_URL is redirected to `MEDIA_ACCEL_REDIRECT_PREFIX` + MEDIA_URL + path,
+  e.g. `/protected/media/...`, which must be an `internal` location aliased
+  to MEDIA_ROOT (likewise for static files);
+* ``django``: a `FileResponse` streams the file itself, with single range
+  support. Under a WSGI server with `wsgi.file_wrapper` (gunicorn, uWSGI) the
+  file is sent with `sendfile()`, so the bytes never pass through Python;
+* ``off``: no routes; the front server serves `MEDIA_ROOT` and `STATIC_ROOT`.
+
+In ``django`` mode responses carry a strong ETag derived from a hash of the
+file's content, cached per path, size and mtime so each file is read once. The
+offload modes never read the file: their ETag is built from its mtime and size,
+like nginx's own, so a large file costs a `stat()`. Files whose names contain
+a `ManifestStaticFilesStorage` hash never change, so they are cached for a
+year; everything else for `MEDIA_CACHE_MAX_AGE` seconds and then revalidated.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.urls import re_path
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+
+HASHED_NAME = re.compile(r"\.[0-9a-f]{12}\.[^./]+$")
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+BLOCK_SIZE = 64 * 1024
+
+
+class FileRange:
+
+    """Read-only view of `length` bytes of an open file from `start`, for range responses."""
+
+    def __init__(self, fh, start, length):
+        self.fh = fh
+        self.remaining = length
+        fh.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fh.read(size)
+        self.remaining -= len(data)
+        return data
+
+    # `wsgi.file_wrapper` implementations call sendfile() from `tell()` for
+    # at most Content-Length bytes, so ranges stay zero-copy too.
+    def fileno(self):
+        return self.fh.fileno()
+
+    def tell(self):
+        return self.fh.tell()
+
+    def close(self):
+        self.fh.close()
+
+
+def get_stat_etag(stat):
+    return '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_size)
+
+
+def get_etag(full_path, stat):
+    key = "media:etag:{}".format(hashlib.md5(
+        f"{full_path}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+    ).hexdigest())
+    etag = cache.get(key)
+    if etag is None:
+        digest = hashlib.sha256()
+        with open(full_path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(BLOCK_SIZE), b""):
+                digest.update(chunk)
+        etag = '"{}"'.format(digest.hexdigest()[:32])
+        cache.set(key, etag, None)
+    return etag
+
+
+def parse_range(header, size):
+    """Return `(start, end)` (inclusive) for a single byte range, None to ignore it, or False if unsatisfiable."""
+    match = RANGE.match(header.strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # A suffix range: the last `last` bytes.
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _cache_control(path):
+    if HASHED_NAME.search(path):
+        return f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    return f"public, max-age={settings.MEDIA_CACHE_MAX_AGE}"
+
+
+@require_safe
+def serve(request, path, document_root, url_prefix):
+
+    """Serve `path` from `document_root` in the configured `MEDIA_SERVE_MODE`."""
+    try:
+        full_path = safe_join(document_root, path)
+    except SuspiciousFileOperation:
+        raise Http404("File not found")
+    try:
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404("File not found")
+    if not os.path.isfile(full_path):
+        raise Http404("File not found")
+
+    mode = settings.MEDIA_SERVE_MODE
+    offloaded = mode in ("x-accel-redirect", "x-sendfile")
+    etag = get_stat_etag(stat) if offloaded else get_etag(full_path, stat)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(stat.st_mtime),
+        "Cache-Control": _cache_control(path),
+    }
+    not_modified = get_conditional_response(request, etag=etag, last_modified=stat.st_mtime)
+    if not_modified is not None:
+        for name, value in headers.items():
+            not_modified[name] = value
+        return not_modified
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or "application/octet-stream"
+    if offloaded:
+        response = HttpResponse(content_type=content_type)
+        if mode == "x-accel-redirect":
+            relative = os.path.relpath(full_path, document_root).replace(os.sep, "/")
+            response["X-Accel-Redirect"] = quote(settings.MEDIA_ACCEL_REDIRECT_PREFIX + url_prefix + relative)
+        else:
+            response["X-Sendfile"] = full_path
+    else:
+        response = _file_response(request, full_path, stat.st_size, etag, content_type)
+    for name, value in headers.items():
+        response[name] = value
+    if encoding:
+        response["Content-Encoding"] = encoding
+    return response
+
+
+def _file_response(request, full_path, size, etag, content_type):
+    byte_range = None
+    if "HTTP_RANGE" in request.META:
+        if_range = request.META.get("HTTP_IF_RANGE")
+        if if_range is None or etag in parse_etags(if_range):
+            byte_range = parse_range(request.META["HTTP_RANGE"], size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    fh = open(full_path, "rb")
+    if byte_range is None:
+        response = FileResponse(fh, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = FileResponse(FileRange(fh, start, end - start + 1), status=206, content_type=content_type)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = end - start + 1
+    response.block_size = BLOCK_SIZE
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+
+def urlpatterns():
+    """URL patterns serving MEDIA_URL and STATIC_URL, or none when `MEDIA_SERVE_MODE` is "off"."""
+    if settings.MEDIA_SERVE_MODE == "off":
+        return []
+    return [
+        re_path(r"^{}(?P<path>.+)$".format(re.escape(url.lstrip("/"))), serve, {
+            "document_root": root, "url_prefix": url.lstrip("/")
+        })
+        for url, root in ((settings.MEDIA_URL, settings.MEDIA_ROOT), (settings.STATIC_URL, settings.STATIC_ROOT))
+    ]
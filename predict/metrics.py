@@ -0,0 +1,157 @@
+"""
+Per-request query and timing instrumentation.
+
+`MetricsMiddleware` samples `METRICS_SAMPLE_RATE` of requests. For each sampled
+request it counts SQL queries and their time on every database connection,
+times response rendering, and reports everything in a `Server-Timing` header.
+Rendering is the renderer encoding already serialized data as JSON:
+`serializer.data` runs inside the view, so serializer time is part of the
+total (minus DB time), not of render. The numbers also feed in-memory
+histograms per view, which `/metrics` serves in the Prometheus text format to
+admin users. Histograms are per process; scrape every worker.
+"""
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from rest_framework import permissions
+from rest_framework.views import APIView
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+
+    """Thread-safe cumulative histogram keyed by label values."""
+
+    def __init__(self, name, documentation, buckets, labels=("view", "method")):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.setdefault(
+                label_values, {"buckets": [0] * len(self.buckets), "sum": 0, "count": 0}
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def reset(self):
+        with self.lock:
+            self.series.clear()
+
+    def _labels(self, label_values, *extra):
+        pairs = list(zip(self.labels, label_values)) + list(extra)
+        return "{" + ",".join(
+            '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for name, value in pairs
+        ) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_values, series in sorted(self.series.items()):
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    lines.append(f"{self.name}_bucket{self._labels(label_values, ('le', bound))} {count}")
+                lines.append(f"{self.name}_bucket{self._labels(label_values, ('le', '+Inf'))} {series['count']}")
+                lines.append(f"{self.name}_sum{self._labels(label_values)} {series['sum']}")
+                lines.append(f"{self.name}_count{self._labels(label_values)} {series['count']}")
+        return "\n".join(lines)
+
+
+REQUEST_SECONDS = Histogram(
+    "forumi_request_duration_seconds", "Total time spent handling the request.", SECONDS_BUCKETS)
+DB_SECONDS = Histogram(
+    "forumi_db_duration_seconds", "Time spent executing SQL queries.", SECONDS_BUCKETS)
+RENDER_SECONDS = Histogram(
+    "forumi_render_duration_seconds", "Time spent rendering the response body, after the view.", SECONDS_BUCKETS)
+DB_QUERIES = Histogram(
+    "forumi_db_queries", "Number of SQL queries run by the request.", QUERY_BUCKETS)
+HISTOGRAMS = (REQUEST_SECONDS, DB_SECONDS, RENDER_SECONDS, DB_QUERIES)
+
+
+class QueryTimer:
+
+    """`execute_wrapper` that counts queries and adds up their duration."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+class MetricsMiddleware:
+
+    """Record query count, DB time, render time and total time for a sample of requests."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+
+        timer = QueryTimer()
+        request._metrics_render = [0.0, 0.0]
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+        render = request._metrics_render[1]
+
+        match = getattr(request, "resolver_match", None)
+        view = (match.view_name or match.route) if match else "unresolved"
+        for histogram, value in (
+            (REQUEST_SECONDS, total), (DB_SECONDS, timer.duration),
+            (RENDER_SECONDS, render), (DB_QUERIES, timer.count),
+        ):
+            histogram.observe(value, view, request.method)
+
+        response["Server-Timing"] = ", ".join([
+            f'db;dur={timer.duration * 1000:.2f};desc="{timer.count} queries"',
+            f"render;dur={render * 1000:.2f}",
+            f"total;dur={total * 1000:.2f}",
+        ])
+        return response
+
+    def process_template_response(self, request, response):
+        if hasattr(request, "_metrics_render"):
+            request._metrics_render[0] = time.perf_counter()
+
+            def rendered(response):
+                request._metrics_render[1] = time.perf_counter() - request._metrics_render[0]
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+class MetricsView(APIView):
+
+    """Prometheus scrape endpoint for the request histograms; admin users only."""
+    permission_classes = [permissions.IsAdminUser]
+    swagger_schema = None
+
+    def get(self, request):
+        body = "\n".join(histogram.render() for histogram in HISTOGRAMS) + "\n"
+        return HttpResponse(body, content_type="text/plain; version=0.0.4; charset=utf-8")
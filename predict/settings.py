@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 
 from pathlib import Path
 from datetime import timedelta
-from decouple import config
+from decouple import Csv, config
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -26,7 +26,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = config('SECRET_KEY')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = config('DEBUG')
+DEBUG = config('DEBUG', cast=bool)
 
 ALLOWED_HOSTS = []
 
@@ -51,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'predict.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -66,8 +67,14 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Cached even with DEBUG on, so the mail worker compiles each email template once.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -88,6 +95,22 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # A file-backed test database lets concurrency tests use real
+        # per-thread connections instead of a shared-cache in-memory DB.
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='forumi'),
     }
 }
 
@@ -111,6 +134,31 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing
+# PASSWORD_HASHER picks the hasher for new passwords: pbkdf2, scrypt or argon2
+# (argon2 needs argon2-cffi). Older hashes still verify and are upgraded on login.
+
+PASSWORD_HASHER_PROFILES = {
+    'pbkdf2': 'accounts.hashers.TunedPBKDF2PasswordHasher',
+    'scrypt': 'accounts.hashers.ScryptPasswordHasher',
+    'argon2': 'accounts.hashers.TunedArgon2PasswordHasher',
+}
+PASSWORD_HASHER = config('PASSWORD_HASHER', default='pbkdf2')
+PASSWORD_HASHERS = [PASSWORD_HASHER_PROFILES[PASSWORD_HASHER]] + [
+    hasher for name, hasher in PASSWORD_HASHER_PROFILES.items() if name != PASSWORD_HASHER
+] + [
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+PASSWORD_PBKDF2_ITERATIONS = config('PASSWORD_PBKDF2_ITERATIONS', default=180000, cast=int)
+PASSWORD_SCRYPT_WORK_FACTOR = config('PASSWORD_SCRYPT_WORK_FACTOR', default=2 ** 14, cast=int)
+PASSWORD_SCRYPT_BLOCK_SIZE = config('PASSWORD_SCRYPT_BLOCK_SIZE', default=8, cast=int)
+PASSWORD_SCRYPT_PARALLELISM = config('PASSWORD_SCRYPT_PARALLELISM', default=1, cast=int)
+PASSWORD_ARGON2_TIME_COST = config('PASSWORD_ARGON2_TIME_COST', default=2, cast=int)
+PASSWORD_ARGON2_MEMORY_COST = config('PASSWORD_ARGON2_MEMORY_COST', default=512, cast=int)
+PASSWORD_ARGON2_PARALLELISM = config('PASSWORD_ARGON2_PARALLELISM', default=2, cast=int)
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
 
@@ -134,6 +182,23 @@ STATIC_URL = '/static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# How predict.media serves MEDIA_URL and STATIC_URL: 'django' (FileResponse,
+# sendfile under gunicorn/uWSGI), 'x-accel-redirect' (nginx), 'x-sendfile'
+# (Apache/lighttpd) or 'off' (the front server serves both directories).
+MEDIA_SERVE_MODE = config('MEDIA_SERVE_MODE', default='django')
+# Internal nginx location prefix; /protected/media/ must alias MEDIA_ROOT (see predict/media.py).
+MEDIA_ACCEL_REDIRECT_PREFIX = config('MEDIA_ACCEL_REDIRECT_PREFIX', default='/protected/')
+MEDIA_CACHE_MAX_AGE = config('MEDIA_CACHE_MAX_AGE', default=60 * 60 * 24, cast=int)
+# ManifestStaticFilesStorage hashes static file names, which are then cached for a year.
+STATICFILES_STORAGE = config(
+    'STATICFILES_STORAGE', default='django.contrib.staticfiles.storage.StaticFilesStorage'
+)
+
+# Stream uploads to a temporary file instead of holding them in memory; the
+# storage then moves that file into MEDIA_ROOT.
+FILE_UPLOAD_HANDLERS = ['django.core.files.uploadhandler.TemporaryFileUploadHandler']
+FILE_UPLOAD_TEMP_DIR = config('FILE_UPLOAD_TEMP_DIR', default=None)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -145,13 +210,41 @@ CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND')
 CELERY_BACKEND_URL=config('CELERY_BACKEND_URL')
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
+CELERYBEAT_SCHEDULE = {
+    'rank-discussions': {
+        'task': 'forums.tasks.update_ranked_feeds',
+        'schedule': timedelta(seconds=config('FORUMS_RANKING_INTERVAL', default=300, cast=int)),
+    },
+    'flush-like-buffer': {
+        'task': 'forums.tasks.flush_like_buffer',
+        'schedule': timedelta(seconds=config('FORUMS_LIKE_FLUSH_INTERVAL', default=2, cast=int)),
+    },
+    'send-queued-mail': {
+        'task': 'accounts.tasks.send_queued_mail',
+        'schedule': timedelta(seconds=config('ACCOUNTS_MAIL_FLUSH_INTERVAL', default=30, cast=int)),
+    },
+    'prune-revoked-tokens': {
+        'task': 'accounts.tasks.prune_revoked_tokens',
+        'schedule': timedelta(hours=1),
+    },
+    'prune-dropped-mail': {
+        'task': 'accounts.tasks.prune_dropped_mail',
+        'schedule': timedelta(hours=1),
+    },
+}
 
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=25, cast=int)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=False, cast=bool)
+EMAIL_TIMEOUT = config('EMAIL_TIMEOUT', default=30, cast=int)
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL')
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.ClaimsJWTAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
@@ -164,8 +257,43 @@ REST_FRAMEWORK = {
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
-    'UPDATE_LAST_LOGIN': True,
+    # accounts.authentication.record_login throttles last_login updates instead.
+    'UPDATE_LAST_LOGIN': False,
+    'TOKEN_USER_CLASS': 'accounts.authentication.ClaimsUser',
 }
+ACCOUNTS_LAST_LOGIN_INTERVAL = config('ACCOUNTS_LAST_LOGIN_INTERVAL', default=3600, cast=int)
+# Keys each process's revoked-token bloom filter holds before it is rebuilt larger.
+ACCOUNTS_REVOCATION_FILTER_CAPACITY = config('ACCOUNTS_REVOCATION_FILTER_CAPACITY', default=100000, cast=int)
+# Seconds between revocation checks against the table when the cache is per process (locmem).
+ACCOUNTS_REVOCATION_SYNC_INTERVAL = config('ACCOUNTS_REVOCATION_SYNC_INTERVAL', default=5, cast=int)
+# accounts.mail: queued emails are sent in batches over one connection, and
+# retried after ACCOUNTS_MAIL_RETRY_DELAY seconds, doubling on each failure.
+ACCOUNTS_MAIL_BATCH_SIZE = config('ACCOUNTS_MAIL_BATCH_SIZE', default=100, cast=int)
+ACCOUNTS_MAIL_BATCH_DELAY = config('ACCOUNTS_MAIL_BATCH_DELAY', default=2, cast=int)
+ACCOUNTS_MAIL_RETRY_DELAY = config('ACCOUNTS_MAIL_RETRY_DELAY', default=30, cast=int)
+ACCOUNTS_MAIL_MAX_ATTEMPTS = config('ACCOUNTS_MAIL_MAX_ATTEMPTS', default=5, cast=int)
+# Days a dropped email stays in the queue table, for inspection, before it is pruned.
+ACCOUNTS_MAIL_DROPPED_RETENTION = config('ACCOUNTS_MAIL_DROPPED_RETENTION', default=7, cast=int)
+
+# Share of requests timed by predict.metrics.MetricsMiddleware (0 disables it).
+METRICS_SAMPLE_RATE = config('METRICS_SAMPLE_RATE', default=0.05, cast=float)
+
+# Forums
+FORUMS_CACHE_TIMEOUT = config('FORUMS_CACHE_TIMEOUT', default=300, cast=int)
+FORUMS_HOT_WINDOW_DAYS = config('FORUMS_HOT_WINDOW_DAYS', default=7, cast=int)
+# Buffer likes in the cache and write them in bulk (see forums/likes.py).
+FORUMS_LIKE_BUFFERING = config('FORUMS_LIKE_BUFFERING', default=False, cast=bool)
+FORUMS_LIKE_FLUSH_BATCH = config('FORUMS_LIKE_FLUSH_BATCH', default=5000, cast=int)
+# Widths (px) and quality of the WebP/JPEG renditions made for discussion images.
+FORUMS_IMAGE_WIDTHS = config('FORUMS_IMAGE_WIDTHS', default='320,640,1280', cast=Csv(int))
+FORUMS_IMAGE_QUALITY = config('FORUMS_IMAGE_QUALITY', default=80, cast=int)
+FORUMS_LATEST_COMMENTS = config('FORUMS_LATEST_COMMENTS', default=3, cast=int)
+FORUMS_RANKED_FEED_SIZE = config('FORUMS_RANKED_FEED_SIZE', default=500, cast=int)
+FORUMS_RANKED_FEED_TTL = config('FORUMS_RANKED_FEED_TTL', default=3600, cast=int)
+FORUMS_TAG_CLOUD_SIZE = config('FORUMS_TAG_CLOUD_SIZE', default=50, cast=int)
+FORUMS_TAG_CLOUD_TTL = config('FORUMS_TAG_CLOUD_TTL', default=300, cast=int)
+# Dotted path to a forums.search backend; picked from the database vendor when empty.
+FORUMS_SEARCH_BACKEND = config('FORUMS_SEARCH_BACKEND', default='')
 
 SWAGGER_SETTINGS = {
     'USE_SESSION_AUTH': False
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+from django.core.cache import cache
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from rest_framework import status
+from rest_framework.test import APITestCase
+from accounts.models import User
+from predict import media
+
+
+class MetricsTest(APITestCase):
+    fixtures = ["users.json", "discussion.json"]
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(METRICS_SAMPLE_RATE=1)
+    def test_requests_are_timed_and_exported_as_metrics(self):
+        self.client.force_authenticate(User.objects.get(id=2))
+        response = self.client.get("/forums/", format="json")
+        timing = response["Server-Timing"]
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn("render;dur=", timing)
+        self.assertIn("total;dur=", timing)
+
+        self.assertEqual(self.client.get("/metrics").status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(User.objects.get(id=1))
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn("# TYPE forumi_request_duration_seconds histogram", body)
+        self.assertIn('forumi_db_queries_count{view="discussion-list",method="GET"}', body)
+
+
+class MediaTest(SimpleTestCase):
+    content = bytes(range(256)) * 400
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        os.makedirs(os.path.join(self.media_root, "images"))
+        for name in ("photo.jpg", "app.0123456789ab.css"):
+            with open(os.path.join(self.media_root, "images", name), "wb") as fh:
+                fh.write(self.content)
+
+    def get(self, path, **headers):
+        return media.serve(self.factory.get(f"/media/{path}", **headers), path, self.media_root, "media/")
+
+    def read(self, response):
+        # Not `response.close()`: its request_finished signal closes database connections.
+        try:
+            return b"".join(response.streaming_content)
+        finally:
+            response.file_to_stream.close()
+
+    def test_file_is_streamed_with_cache_validators(self):
+        response = self.get("images/photo.jpg")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.read(response), self.content)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["Cache-Control"], "public, max-age=86400")
+
+        response = self.get("images/photo.jpg", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.get("images/app.0123456789ab.css")
+        self.read(response)
+        self.assertIn("immutable", response["Cache-Control"])
+
+    def test_byte_ranges(self):
+        response = self.get("images/photo.jpg", HTTP_RANGE="bytes=100-199")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response["Content-Range"], f"bytes 100-199/{len(self.content)}")
+        self.assertEqual(self.read(response), self.content[100:200])
+        response = self.get("images/photo.jpg", HTTP_RANGE="bytes=-10")
+        self.assertEqual(self.read(response), self.content[-10:])
+
+        # A stale If-Range gets the whole file.
+        response = self.get("images/photo.jpg", HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.read(response), self.content)
+        response = self.get("images/photo.jpg", HTTP_RANGE=f"bytes={len(self.content)}-")
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    @override_settings(MEDIA_SERVE_MODE="x-accel-redirect")
+    def test_offloaded_file_is_never_read(self):
+        stat = os.stat(os.path.join(self.media_root, "images", "photo.jpg"))
+        with mock.patch.object(media, "get_etag") as get_etag:
+            response = self.get("images/photo.jpg")
+            get_etag.assert_not_called()
+        self.assertEqual(response["X-Accel-Redirect"], "/protected/media/images/photo.jpg")
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], media.get_stat_etag(stat))
+
+        response = self.get("images/photo.jpg", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_paths_outside_the_root_are_not_found(self):
+        with self.assertRaises(Http404):
+            self.get("../../etc/passwd")
+        with self.assertRaises(Http404):
+            self.get("images/missing.jpg")
@@ -15,13 +15,13 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
 
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from schema_graph.views import Schema
+from predict import media
+from predict.metrics import MetricsView
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -41,10 +41,10 @@ urlpatterns = [
     path('accounts/', include('accounts.urls')),
     path('forums/', include('forums.urls')),
 
+    path('metrics', MetricsView.as_view()),
     path('schema/', Schema.as_view()),
     path('', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
 ]
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+urlpatterns += media.urlpatterns()